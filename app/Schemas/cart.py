@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
+from app.Schemas.order import ShippingAddress
 
 class CartItem(BaseModel):
     product_id: str
@@ -25,7 +26,6 @@ class CartItemUpdate(BaseModel):
     quantity: int = Field(..., gt=0)
 
 class CartCheckout(BaseModel):
-    items: List[CartItem]
-    shipping_address: dict
+    shipping_address: ShippingAddress
     payment_method: str
-    total_price: float
\ No newline at end of file
+    shipping_price: float = Field(default=0, ge=0)
\ No newline at end of file
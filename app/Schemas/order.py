@@ -31,7 +31,7 @@ class OrderBase(BaseModel):
   shipping_address: ShippingAddress
   payment_method: str
   items_price: float = Field(...,gt=0)
-  shipping_price: float = Field(default=0, gt=0)
+  shipping_price: float = Field(default=0, ge=0)
   total_price: float = Field(...,gt=0)
 
 class OrderCreate(OrderBase):
@@ -14,6 +14,7 @@ class ProductBase(BaseModel):
   images: List[str] = []
   rating: float = Field(default=0, ge=0, le=5)
   num_reviews : int = Field(default=0,ge=0)
+  sku: Optional[str] = Field(default=None, min_length=1, max_length=64)
 
 class ProductCreate(ProductBase):
   pass
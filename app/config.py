@@ -1,13 +1,133 @@
+import os
+import tempfile
 from pydantic_settings import BaseSettings
 from typing import Optional
 
 class Settings(BaseSettings):
     mongodb_url: str = "mongodb://localhost:27017"
     database_name: str = "ecommerce"
+    # Use multi-document transactions when the deployment supports them
+    mongodb_use_transactions: bool = True
+
+    # Connection pool and driver tuning
+    mongodb_max_pool_size: int = 100
+    mongodb_min_pool_size: int = 10
+    mongodb_max_idle_time_ms: Optional[int] = None
+    mongodb_wait_queue_timeout_ms: Optional[int] = None
+    # Comma separated wire compressors, e.g. "zstd,zlib" (zstd needs the zstandard package)
+    mongodb_compressors: str = ""
+    mongodb_server_selection_timeout_ms: int = 5000
+    mongodb_connect_timeout_ms: int = 5000
+    mongodb_socket_timeout_ms: Optional[int] = None
+    mongodb_retry_writes: bool = True
+    # Open min_pool_size connections during startup instead of on first use
+    mongodb_warm_pool: bool = True
+    health_ping_timeout_seconds: float = 1.0
     secret_key: str = "your-secret-key-here"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
 
+    # In-process cache of authenticated users, keyed by the token "sub"
+    user_cache_ttl_seconds: float = 60.0
+    user_cache_max_size: int = 10000
+
+    # Stateless auth: access tokens carry the user's claims and get_current_user
+    # trusts them without a database read; revocations are pulled this often
+    stateless_auth: bool = False
+    token_revocation_refresh_seconds: float = 30.0
+
+    # bcrypt runs in a dedicated thread pool so it never blocks the event loop
+    password_hash_workers: int = 4
+    password_hash_max_queue: int = 64
+    password_hash_queue_timeout_seconds: float = 2.0
+
+    # Token-bucket limits on login and register, per email and per client IP:
+    # up to `burst` attempts at once, refilled at `per_minute`
+    rate_limit_enabled: bool = True
+    rate_limit_backend: str = "memory"  # "memory" (per worker) or "sqlite" (shared on the host)
+    # Outside the working tree; every worker on the host finds the same file
+    rate_limit_sqlite_path: str = os.path.join(tempfile.gettempdir(), "ecommerce_rate_limits.sqlite3")
+    rate_limit_max_buckets: int = 100000
+    rate_limit_trust_forwarded_for: bool = False
+    login_rate_limit_email_burst: int = 5
+    login_rate_limit_email_per_minute: float = 5.0
+    login_rate_limit_ip_burst: int = 20
+    login_rate_limit_ip_per_minute: float = 30.0
+    register_rate_limit_email_burst: int = 3
+    register_rate_limit_email_per_minute: float = 1.0
+    register_rate_limit_ip_burst: int = 5
+    register_rate_limit_ip_per_minute: float = 5.0
+
+    # Run explain() on every registered model query at startup and refuse to
+    # start if one of them is a collection scan
+    verify_query_plans_on_startup: bool = False
+
+    # Mongo commands slower than this are logged with the route that issued them
+    slow_query_ms: float = 100.0
+
+    # Read-through product catalog cache (single products and list pages)
+    product_cache_ttl_seconds: float = 30.0
+    product_cache_max_size: int = 10000
+    product_page_cache_max_size: int = 256
+    # Facets are recomputed at most this often after writes that can't be applied in place
+    facet_cache_refresh_seconds: float = 30.0
+
+    # Bulk product import: rows per bulk_write and how many row errors are reported
+    product_import_batch_size: int = 1000
+    product_import_max_errors: int = 1000
+
+    # Documents per getMore batch (and per streamed chunk) of the admin order export
+    order_export_batch_size: int = 1000
+
+    # Cache-Control of the public catalog reads; every other response gets no-store
+    cache_control_product: str = "public, max-age=60, stale-while-revalidate=300"
+    cache_control_catalog: str = "public, max-age=30, stale-while-revalidate=120"
+
+    # Response compression, negotiated from Accept-Encoding in this order of
+    # preference (br and zstd need the brotli and zstandard packages)
+    compression_encodings: str = "zstd,br,gzip"
+    compression_minimum_size: int = 1024
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 5
+    compression_zstd_level: int = 3
+    # Compressed bodies of responses with an ETag (catalog reads), by ETag and encoding
+    compression_cache_max_size: int = 512
+    compression_cache_ttl_seconds: float = 60.0
+
+    # Cart items hold their stock this long after the last change; the
+    # sweeper releases expired reservations in batches of this size
+    reservation_ttl_seconds: int = 900
+    reservation_sweep_interval_seconds: float = 5.0
+    reservation_sweep_batch_size: int = 500
+
+    # Hot products can keep their stock in several counter documents so
+    # concurrent orders don't queue on one; the reconciler rebalances them
+    # and writes the total back to the product this often
+    stock_shard_default_count: int = 8
+    stock_shard_max_count: int = 64
+    stock_shard_reconcile_interval_seconds: float = 10.0
+
+    # Background jobs (order follow-ups): workers per process, how long a
+    # claim is leased, retry backoff and how long finished jobs are kept
+    jobs_enabled: bool = True
+    job_worker_concurrency: int = 4
+    job_poll_interval_seconds: float = 1.0
+    job_lease_seconds: float = 60.0
+    job_max_attempts: int = 5
+    job_retry_base_seconds: float = 2.0
+    job_retry_max_seconds: float = 300.0
+    job_drain_timeout_seconds: float = 10.0
+    job_retention_seconds: int = 7 * 86400
+
+    # How long a checkout Idempotency-Key is remembered, and after how long
+    # a checkout that never recorded its order is taken to have crashed
+    idempotency_key_ttl_seconds: int = 86400
+    idempotency_checkout_timeout_seconds: int = 60
+
+    # Encode list responses with orjson straight from projected documents
+    # instead of building and re-validating a Pydantic model per item
+    fast_serialization: bool = True
+
     class Config:
         env_file = ".env"
 
@@ -1,14 +1,55 @@
+import asyncio
+import time
 from motor.motor_asyncio import AsyncIOMotorClient
 from app.config import settings
+from app.utils.pool_monitor import pool_monitor
+from app.utils.query_stats import query_stats
 
 class Database:
     client: AsyncIOMotorClient = None
     database = None
+    supports_transactions: bool = False
+
+    def _client_options(self) -> dict:
+        options = {
+            "maxPoolSize": settings.mongodb_max_pool_size,
+            "minPoolSize": settings.mongodb_min_pool_size,
+            "serverSelectionTimeoutMS": settings.mongodb_server_selection_timeout_ms,
+            "connectTimeoutMS": settings.mongodb_connect_timeout_ms,
+            "retryWrites": settings.mongodb_retry_writes,
+            "event_listeners": [pool_monitor, query_stats],
+        }
+        if settings.mongodb_max_idle_time_ms is not None:
+            options["maxIdleTimeMS"] = settings.mongodb_max_idle_time_ms
+        if settings.mongodb_wait_queue_timeout_ms is not None:
+            options["waitQueueTimeoutMS"] = settings.mongodb_wait_queue_timeout_ms
+        if settings.mongodb_socket_timeout_ms is not None:
+            options["socketTimeoutMS"] = settings.mongodb_socket_timeout_ms
+        if settings.mongodb_compressors:
+            options["compressors"] = settings.mongodb_compressors
+        return options
 
     async def connect(self):
-        self.client = AsyncIOMotorClient(settings.mongodb_url)
+        self.client = AsyncIOMotorClient(settings.mongodb_url, **self._client_options())
         self.database = self.client[settings.database_name]
-        print("Connected to MongoDB")
+        # Multi-document transactions need a replica set or a sharded cluster
+        hello = await self.client.admin.command("hello")
+        self.supports_transactions = settings.mongodb_use_transactions and bool(
+            hello.get("setName") or hello.get("msg") == "isdbgrid"
+        )
+        if settings.mongodb_warm_pool:
+            await self.warm_pool()
+        print(f"Connected to MongoDB (transactions {'enabled' if self.supports_transactions else 'disabled'})")
+
+    async def warm_pool(self):
+        """Check out min_pool_size connections at once so the first requests don't pay for the handshakes"""
+        await asyncio.gather(*[self.ping() for _ in range(max(settings.mongodb_min_pool_size, 1))])
+
+    async def ping(self) -> float:
+        """Round-trip a ping to the server and return the latency in seconds"""
+        start = time.perf_counter()
+        await self.client.admin.command("ping")
+        return time.perf_counter() - start
 
     async def disconnect(self):
         if self.client:
@@ -20,4 +61,16 @@ class Database:
             raise RuntimeError("Database not connected")
         return self.database[name]
 
+    async def run_in_transaction(self, callback):
+        """
+        Run `await callback(session)` inside a transaction, retrying on
+        transient errors such as write conflicts. When the deployment can't
+        run transactions the callback is called once with session=None and
+        must compensate on failure itself.
+        """
+        if not self.supports_transactions:
+            return await callback(None)
+        async with await self.client.start_session() as session:
+            return await session.with_transaction(callback)
+
 db = Database()
\ No newline at end of file
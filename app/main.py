@@ -1,17 +1,50 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from fastapi import FastAPI, HTTPException, Response, status
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import app
 from app.config import settings
 from app.database import db
-from app.routers import products, orders, auth, cart, seed
+from app.models.inventory import StockShardReconciler
+from app.models.job import JobWorkerPool
+from app.models.product import ProductModel, catalog_cache, facet_cache
+from app.models.reservation import ReservationSweeper
+from app.models.token_revocation import RevocationRefresher, token_revocations
+from app.models.user import user_cache
+from app.utils.compression import CompressionMiddleware
+from app.utils.http_cache import CacheControlMiddleware
+from app.utils.indexes import ensure_indexes, verify_query_plans
+from app.utils.metrics import MetricsMiddleware, registry
+from app.utils.pool_monitor import pool_monitor
+from app.utils.security import shutdown_password_executor
+from app.routers import products, orders, auth, cart, seed, admin
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
   await db.connect()
+  await ensure_indexes()
+  if settings.verify_query_plans_on_startup:
+    await verify_query_plans()
+  reservation_sweeper = ReservationSweeper()
+  reservation_sweeper.start()
+  stock_shard_reconciler = StockShardReconciler(ProductModel())
+  stock_shard_reconciler.start()
+  job_workers = JobWorkerPool()
+  if settings.jobs_enabled:
+    job_workers.start()
+  revocation_refresher = RevocationRefresher()
+  if settings.stateless_auth:
+    await revocation_refresher.start()
   try:
     yield
   finally:
+    # Drain first: running jobs may still need the database
+    await job_workers.stop()
+    await revocation_refresher.stop()
+    await stock_shard_reconciler.stop()
+    await reservation_sweeper.stop()
+    await shutdown_password_executor()
     await db.disconnect()
 
 
@@ -28,19 +61,58 @@ app.add_middleware(
   allow_credentials = True,
   allow_methods = ["*"],
   allow_headers = ["*"],
+  expose_headers = ["X-Next-Cursor", "ETag", "Last-Modified"],
 )
+app.add_middleware(CacheControlMiddleware)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth.router)
 app.include_router(products.router)
 app.include_router(orders.router)
 app.include_router(cart.router)
 app.include_router(seed.router)
+app.include_router(admin.router)
 
 
 @app.get("/")
 async def root():
   return {"message": "Welcome to FastAPI E-commerce API", "version": "1.0.0"}
 
+def _cache_samples(field: str):
+  caches = {"users": user_cache, "products": catalog_cache.products, "product_pages": catalog_cache.pages}
+  return lambda: {(name,): getattr(cache, field) for name, cache in caches.items()}
+
+registry.callback_counter("cache_hits_total", "In-process cache hits", ("cache",), _cache_samples("hits"))
+registry.callback_counter("cache_misses_total", "In-process cache misses", ("cache",), _cache_samples("misses"))
+registry.callback_gauge("cache_entries", "In-process cache size", ("cache",), lambda: {
+  (name,): len(cache) for name, cache in
+  (("users", user_cache), ("products", catalog_cache.products), ("product_pages", catalog_cache.pages))
+})
+registry.callback_gauge(
+  "mongodb_pool_connections", "MongoDB pool connections by state", ("state",),
+  lambda: {(state,): pool_monitor.stats()[state] for state in ("in_use", "available")}
+)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+  """Prometheus text exposition of this worker's metrics"""
+  return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/health")
-async def check():
-  return {"status": "healthy", "database": "connected"}
\ No newline at end of file
+async def check(response: Response):
+  """Liveness plus a real database ping (bounded by health_ping_timeout_seconds)"""
+  try:
+    latency = await asyncio.wait_for(db.ping(), timeout=settings.health_ping_timeout_seconds)
+    health, database = "healthy", {"status": "connected", "ping_ms": round(latency * 1000, 3)}
+  except Exception as e:
+    response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    health, database = "unhealthy", {"status": "unreachable", "error": repr(e)}
+
+  return {
+    "status": health,
+    "database": database,
+    "pool": pool_monitor.stats(),
+    "cache": {"users": user_cache.stats(), "catalog": catalog_cache.stats(), "facets": facet_cache.stats()},
+    "auth": {"stateless": settings.stateless_auth, "revoked_users": len(token_revocations)}
+  }
\ No newline at end of file
@@ -1,8 +1,21 @@
 from datetime import datetime,timezone
 from bson import ObjectId
 from app.database import db
+from app.utils.indexes import register_indexes, register_query
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from typing import List, Optional, Dict
 
+register_indexes(
+    "carts",
+    IndexModel([("user_id", ASCENDING)], unique=True, name="user_id_unique")
+)
+register_query("carts", "get_cart_by_user_id", {"user_id": "probe"})
+
+def _recompute_total() -> Dict:
+    """Update-pipeline stage that derives total_amount from the item subtotals"""
+    return {"$set": {"total_amount": {"$sum": "$items.subtotal"}}}
+
 class CartModel:
     def __init__(self):
         self.collection = db.get_collection("carts")
@@ -11,6 +24,11 @@ class CartModel:
         """Get cart for a specific user"""
         return await self.collection.find_one({"user_id": user_id})
 
+    async def has_item(self, user_id: str, product_id: str) -> bool:
+        """Whether the product is in the user's cart"""
+        cart = await self.collection.find_one({"user_id": user_id, "items.product_id": product_id}, {"_id": 1})
+        return cart is not None
+
     async def create_cart(self, user_id: str) -> str:
         """Create a new cart for user"""
         cart_data = {
@@ -23,106 +41,155 @@ class CartModel:
         result = await self.collection.insert_one(cart_data)
         return str(result.inserted_id)
 
-    async def add_item_to_cart(self, user_id: str, product_id: str, quantity: int, price: float) -> bool:
-        """Add item to cart or update quantity if exists"""
-        cart = await self.get_cart_by_user_id(user_id)
-
-        if not cart:
-            # Create new cart if doesn't exist
-            await self.create_cart(user_id)
-            cart = await self.get_cart_by_user_id(user_id)
-
-        # Check if item already exists in cart
-        existing_item = None
-        for item in cart["items"]:
-            if item["product_id"] == product_id:
-                existing_item = item
-                break
-
-        if existing_item:
-            # Update quantity
-            existing_item["quantity"] += quantity
-            existing_item["subtotal"] = existing_item["quantity"] * price
-        else:
-            # Add new item
-            new_item = {
-                "product_id": product_id,
-                "quantity": quantity,
-                "price": price,
-                "subtotal": quantity * price
-            }
-            cart["items"].append(new_item)
-
-        # Update total amount
-        total_amount = sum(item["subtotal"] for item in cart["items"])
-
-        result = await self.collection.update_one(
+    async def get_or_create_cart(self, user_id: str) -> Dict:
+        """Get the user's cart, creating an empty one if needed (one round trip)"""
+        now = datetime.now(timezone.utc)
+        return await self._find_one_and_update(
             {"user_id": user_id},
             {
-                "$set": {
-                    "items": cart["items"],
-                    "total_amount": total_amount,
-                    "updated_at": datetime.now(timezone.utc)
+                "$setOnInsert": {
+                    "items": [],
+                    "total_amount": 0.0,
+                    "created_at": now,
+                    "updated_at": now
                 }
-            }
+            },
+            upsert=True
         )
-        return result.modified_count > 0
-
-    async def remove_item_from_cart(self, user_id: str, product_id: str) -> bool:
-        """Remove item from cart"""
-        cart = await self.get_cart_by_user_id(user_id)
-        if not cart:
-            return False
 
-        # Filter out the item
-        cart["items"] = [item for item in cart["items"] if item["product_id"] != product_id]
-
-        # Update total amount
-        total_amount = sum(item["subtotal"] for item in cart["items"])
-
-        result = await self.collection.update_one(
-            {"user_id": user_id},
+    async def add_item_to_cart(self, user_id: str, product_id: str, quantity: int, price: float) -> Dict:
+        """
+        Add item to cart or increase its quantity if it is already there.
+        Creates the cart if needed. The whole change, including the new
+        total_amount, is applied server-side in a single atomic update, so
+        concurrent adds cannot overwrite each other. Returns the updated cart.
+        """
+        now = datetime.now(timezone.utc)
+        product_id = {"$literal": product_id}
+        items = {"$ifNull": ["$items", []]}
+        in_cart = {"$in": [product_id, {"$ifNull": ["$items.product_id", []]}]}
+        new_quantity = {"$add": ["$$item.quantity", quantity]}
+
+        pipeline = [
             {
                 "$set": {
-                    "items": cart["items"],
-                    "total_amount": total_amount,
+                    "items": {
+                        "$cond": [
+                            in_cart,
+                            {
+                                "$map": {
+                                    "input": items,
+                                    "as": "item",
+                                    "in": {
+                                        "$cond": [
+                                            {"$eq": ["$$item.product_id", product_id]},
+                                            {
+                                                "$mergeObjects": [
+                                                    "$$item",
+                                                    {
+                                                        "quantity": new_quantity,
+                                                        "price": price,
+                                                        "subtotal": {"$multiply": [new_quantity, price]}
+                                                    }
+                                                ]
+                                            },
+                                            "$$item"
+                                        ]
+                                    }
+                                }
+                            },
+                            {
+                                "$concatArrays": [
+                                    items,
+                                    [{
+                                        "product_id": product_id,
+                                        "quantity": quantity,
+                                        "price": price,
+                                        "subtotal": quantity * price
+                                    }]
+                                ]
+                            }
+                        ]
+                    },
+                    "created_at": {"$ifNull": ["$created_at", now]},
+                    "updated_at": now
+                }
+            },
+            _recompute_total()
+        ]
+        return await self._find_one_and_update({"user_id": user_id}, pipeline, upsert=True)
+
+    async def remove_item_from_cart(self, user_id: str, product_id: str) -> Optional[Dict]:
+        """Remove item from cart. Returns the updated cart, or None if the item was not in it"""
+        pipeline = [
+            {
+                "$set": {
+                    "items": {
+                        "$filter": {
+                            "input": "$items",
+                            "as": "item",
+                            "cond": {"$ne": ["$$item.product_id", {"$literal": product_id}]}
+                        }
+                    },
                     "updated_at": datetime.now(timezone.utc)
                 }
-            }
+            },
+            _recompute_total()
+        ]
+        return await self._find_one_and_update(
+            {"user_id": user_id, "items.product_id": product_id}, pipeline
         )
-        return result.modified_count > 0
-
-    async def update_item_quantity(self, user_id: str, product_id: str, quantity: int) -> bool:
-        """Update quantity of specific item"""
-        cart = await self.get_cart_by_user_id(user_id)
-        if not cart:
-            return False
-
-        # Find and update item
-        for item in cart["items"]:
-            if item["product_id"] == product_id:
-                if quantity <= 0:
-                    # Remove item if quantity is 0 or less
-                    return await self.remove_item_from_cart(user_id, product_id)
 
-                item["quantity"] = quantity
-                item["subtotal"] = quantity * item["price"]
-                break
+    async def update_item_quantity(self, user_id: str, product_id: str, quantity: int) -> Optional[Dict]:
+        """Set quantity of a specific item. Returns the updated cart, or None if the item was not in it"""
+        if quantity <= 0:
+            # Remove item if quantity is 0 or less
+            return await self.remove_item_from_cart(user_id, product_id)
 
-        # Update total amount
-        total_amount = sum(item["subtotal"] for item in cart["items"])
-
-        result = await self.collection.update_one(
-            {"user_id": user_id},
+        pipeline = [
             {
                 "$set": {
-                    "items": cart["items"],
-                    "total_amount": total_amount,
+                    "items": {
+                        "$map": {
+                            "input": "$items",
+                            "as": "item",
+                            "in": {
+                                "$cond": [
+                                    {"$eq": ["$$item.product_id", {"$literal": product_id}]},
+                                    {
+                                        "$mergeObjects": [
+                                            "$$item",
+                                            {
+                                                "quantity": quantity,
+                                                "subtotal": {"$multiply": [quantity, "$$item.price"]}
+                                            }
+                                        ]
+                                    },
+                                    "$$item"
+                                ]
+                            }
+                        }
+                    },
                     "updated_at": datetime.now(timezone.utc)
                 }
-            }
+            },
+            _recompute_total()
+        ]
+        return await self._find_one_and_update(
+            {"user_id": user_id, "items.product_id": product_id}, pipeline
         )
-        return result.modified_count > 0
+
+    async def _find_one_and_update(self, query: Dict, update, upsert: bool = False) -> Optional[Dict]:
+        try:
+            return await self.collection.find_one_and_update(
+                query, update, upsert=upsert, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Two first-time upserts for the same user raced on the unique
+            # user_id index; the cart exists now, so the retry updates it
+            return await self.collection.find_one_and_update(
+                query, update, upsert=upsert, return_document=ReturnDocument.AFTER
+            )
 
     async def clear_cart(self, user_id: str) -> bool:
         """Clear all items from cart"""
@@ -143,11 +210,33 @@ class CartModel:
         result = await self.collection.delete_one({"user_id": user_id})
         return result.deleted_count > 0
 
-    async def merge_cart_with_order(self, user_id: str) -> Optional[Dict]:
-        """Get cart items for order creation (then clear cart)"""
-        cart = await self.get_cart_by_user_id(user_id)
-        if cart and cart["items"]:
-            # Clear cart after getting items
-            await self.clear_cart(user_id)
-            return cart
-        return None
\ No newline at end of file
+    async def take_items(self, user_id: str, session=None) -> Optional[Dict]:
+        """
+        Atomically empty the cart and return it as it was (the checkout
+        snapshot). Returns None if the cart is missing or already empty.
+        """
+        return await self.collection.find_one_and_update(
+            {"user_id": user_id, "items.0": {"$exists": True}},
+            {
+                "$set": {
+                    "items": [],
+                    "total_amount": 0.0,
+                    "updated_at": datetime.now(timezone.utc)
+                }
+            },
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+
+    async def restore_items(self, user_id: str, items: List[Dict]) -> None:
+        """Put items taken by take_items back, e.g. when checkout fails without a transaction"""
+        pipeline = [
+            {
+                "$set": {
+                    "items": {"$concatArrays": [{"$ifNull": ["$items", []]}, {"$literal": items}]},
+                    "updated_at": datetime.now(timezone.utc)
+                }
+            },
+            _recompute_total()
+        ]
+        await self.collection.update_one({"user_id": user_id}, pipeline)
@@ -0,0 +1,157 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
+from app.config import settings
+from app.database import db
+from app.models.cart import CartModel
+from app.models.order import OrderModel, ProductNotFound
+from app.models.product import ProductModel
+from app.utils.indexes import register_indexes
+
+# Idempotency records expire on their own; the _id is "<user_id>:<key>"
+register_indexes(
+    "idempotency_keys",
+    IndexModel(
+        [("created_at", ASCENDING)],
+        expireAfterSeconds=settings.idempotency_key_ttl_seconds,
+        name="created_at_ttl"
+    )
+)
+
+
+class EmptyCart(Exception):
+    pass
+
+
+class CheckoutInProgress(Exception):
+    """A request with the same Idempotency-Key is still being processed"""
+
+
+class CheckoutOrderMissing(Exception):
+    """The order recorded for an Idempotency-Key no longer exists"""
+
+
+class CheckoutModel:
+    def __init__(self):
+        self.idempotency_keys = db.get_collection("idempotency_keys")
+        self.cart_model = CartModel()
+        self.order_model = OrderModel()
+        self.product_model = ProductModel()
+
+    async def checkout(self, user_id: str, checkout_data: Dict, idempotency_key: Optional[str] = None) -> Dict:
+        """
+        Turn the user's cart into an order: snapshot and empty the cart,
+        reserve stock in bulk and insert the order in one transaction.
+
+        With an idempotency key, a retry of a completed checkout returns the
+        order it created instead of running again, and a retry while the
+        first attempt is still running raises CheckoutInProgress. An attempt
+        that has not recorded its order after
+        settings.idempotency_checkout_timeout_seconds is taken to have
+        crashed, and the retry takes its record over.
+        """
+        record_id = None
+        lease = None
+        if idempotency_key:
+            record_id = f"{user_id}:{idempotency_key}"
+            lease = uuid.uuid4().hex
+            now = datetime.now(timezone.utc)
+            try:
+                await self.idempotency_keys.insert_one({
+                    "_id": record_id,
+                    "user_id": user_id,
+                    "lease": lease,
+                    "started_at": now,
+                    "created_at": now
+                })
+            except DuplicateKeyError:
+                if not await self._take_over(record_id, lease, now):
+                    record = await self.idempotency_keys.find_one({"_id": record_id})
+                    if record and record.get("order_id"):
+                        order = await self.order_model.get_order_by_id(record["order_id"])
+                        if order is None:
+                            raise CheckoutOrderMissing()
+                        return order
+                    raise CheckoutInProgress()
+
+        async def run_checkout(session):
+            cart = await self.cart_model.take_items(user_id, session=session)
+            if not cart:
+                raise EmptyCart()
+            try:
+                order = await self._place_cart_order(user_id, cart, checkout_data, session)
+                if record_id:
+                    result = await self.idempotency_keys.update_one(
+                        {"_id": record_id, "lease": lease},
+                        {"$set": {"order_id": str(order["_id"])}, "$unset": {"lease": ""}},
+                        session=session
+                    )
+                    if result.matched_count == 0:
+                        # Taken over by a retry after the timeout, which places the order instead
+                        raise CheckoutInProgress()
+                return order
+            except Exception:
+                if session is None:
+                    # No transaction to abort: give the items back
+                    await self.cart_model.restore_items(user_id, cart["items"])
+                raise
+
+        try:
+            return await db.run_in_transaction(run_checkout)
+        except Exception:
+            if record_id:
+                # Let the client retry a checkout that did not go through
+                await self.idempotency_keys.delete_one({"_id": record_id, "lease": lease})
+            raise
+
+    async def _take_over(self, record_id: str, lease: str, now: datetime) -> bool:
+        """Lease a record whose checkout never recorded an order in time. False if there is none."""
+        timeout = timedelta(seconds=settings.idempotency_checkout_timeout_seconds)
+        record = await self.idempotency_keys.find_one_and_update(
+            {
+                "_id": record_id,
+                "order_id": {"$exists": False},
+                # Records written before started_at existed have none and count as abandoned
+                "started_at": {"$not": {"$gte": now - timeout}}
+            },
+            {"$set": {"lease": lease, "started_at": now}}
+        )
+        return record is not None
+
+    async def _place_cart_order(self, user_id: str, cart: Dict, checkout_data: Dict, session) -> Dict:
+        product_ids = list({item["product_id"] for item in cart["items"]})
+        products = await self.product_model.get_products_by_ids(product_ids, session=session)
+
+        order_items = []
+        for item in cart["items"]:
+            product = products.get(item["product_id"])
+            if product is None:
+                raise ProductNotFound(item["product_id"])
+            images = product.get("images") or []
+            order_items.append({
+                "product_id": item["product_id"],
+                "name": product["name"],
+                "quantity": item["quantity"],
+                "price": item["price"],
+                "image": images[0] if images else None
+            })
+
+        items_price = sum(item["subtotal"] for item in cart["items"])
+        shipping_price = checkout_data.get("shipping_price", 0)
+        order_data = {
+            "order_items": order_items,
+            "shipping_address": checkout_data["shipping_address"],
+            "payment_method": checkout_data["payment_method"],
+            "items_price": items_price,
+            "shipping_price": shipping_price,
+            "total_price": items_price + shipping_price,
+            "user_id": user_id,
+            "status": "pending",
+            "is_paid": False,
+            "is_delivered": False
+        }
+        return await self.order_model.place_order(
+            order_data, self.product_model, session=session, products=products
+        )
@@ -0,0 +1,309 @@
+"""
+Sharded stock counters for hot products.
+
+A product with `stock_shards: N` keeps its sellable stock in N documents of
+the stock_shards collection instead of its own `stock` field, so concurrent
+orders for it update different documents instead of queueing on one. A
+decrement tries a random shard first and only looks at the others when that
+one is short. The product's `stock` becomes a display total that
+StockShardReconciler rewrites every settings.stock_shard_reconcile_interval_seconds,
+while also rebalancing the shards so no shard runs dry long before the rest.
+Shard writes leave the product document alone; its stock and updated_at
+(and so its ETag) change together when the reconciler writes a new total.
+
+While a product is sharded its `reserved` counter is not maintained: cart
+reservations take their quantity out of the shards and are tracked only by
+the reservation documents. Enabling shards zeroes the counter and disabling
+them rebuilds it from those documents; releases clamp it at 0 in between.
+"""
+import asyncio
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import ASCENDING, IndexModel
+
+from app.config import settings
+from app.database import db
+from app.utils.indexes import register_indexes, register_query
+
+register_indexes(
+    "stock_shards",
+    IndexModel([("product_id", ASCENDING), ("shard", ASCENDING)], unique=True, name="product_id_shard")
+)
+# The reconciler lists the sharded products; everything else is left out of the index
+register_indexes(
+    "products",
+    IndexModel([("stock_shards", ASCENDING)], sparse=True, name="stock_shards_sparse")
+)
+register_query("stock_shards", "get_shards", {"product_id": "probe"})
+register_query("products", "get_sharded_products", {"stock_shards": {"$gt": 0}})
+
+# A transfer between shards still recorded after this long was left by a crashed rebalance
+TRANSFER_REPAIR_AFTER_SECONDS = 60
+
+
+def _shard_id(product_id: str, shard: int) -> str:
+    return f"{product_id}:{shard}"
+
+
+def split_stock(stock: int, shards: int) -> List[int]:
+    """`stock` spread as evenly as possible over `shards` counters"""
+    base, extra = divmod(stock, shards)
+    return [base + (1 if shard < extra else 0) for shard in range(shards)]
+
+
+class ShardedProducts:
+    """
+    Which products are sharded and into how many shards, as last seen by this
+    worker. Refreshed by the reconciler; code that acts on a stale entry
+    notices (the product's guard or its shards no longer match) and looks
+    the product up again.
+    """
+
+    def __init__(self):
+        self.shards: Dict[str, int] = {}
+
+    def get(self, product_id: str) -> int:
+        return self.shards.get(product_id, 0)
+
+    def set(self, product_id: str, shards: int) -> None:
+        if shards:
+            self.shards[product_id] = shards
+        else:
+            self.shards.pop(product_id, None)
+
+    def replace(self, shards: Dict[str, int]) -> None:
+        self.shards = dict(shards)
+
+
+sharded_products = ShardedProducts()
+
+
+class StockShardModel:
+    def __init__(self):
+        self.collection = db.get_collection("stock_shards")
+
+    async def get_shards(self, product_id: str, session=None) -> List[dict]:
+        cursor = self.collection.find({"product_id": product_id}, session=session).sort("shard", ASCENDING)
+        return await cursor.to_list(length=None)
+
+    async def total(self, product_id: str, session=None) -> int:
+        return sum(shard["stock"] for shard in await self.get_shards(product_id, session=session))
+
+    async def totals(self) -> Dict[str, int]:
+        """Stock of every sharded product, summed over its shards"""
+        cursor = self.collection.aggregate([{"$group": {"_id": "$product_id", "stock": {"$sum": "$stock"}}}])
+        return {row["_id"]: row["stock"] async for row in cursor}
+
+    async def create(self, product_id: str, shards: int, stock: int, session=None) -> None:
+        await self.collection.insert_many(
+            [
+                {"_id": _shard_id(product_id, shard), "product_id": product_id, "shard": shard, "stock": count}
+                for shard, count in enumerate(split_stock(stock, shards))
+            ],
+            session=session
+        )
+
+    async def create_missing(self, product_id: str, shards: int, stock: int) -> None:
+        """Insert the shards `create` would that do not exist yet, leaving the others as they are"""
+        for shard, count in enumerate(split_stock(stock, shards)):
+            await self.collection.update_one(
+                {"_id": _shard_id(product_id, shard)},
+                {"$setOnInsert": {"product_id": product_id, "shard": shard, "stock": count}},
+                upsert=True
+            )
+
+    async def delete(self, product_id: str) -> int:
+        result = await self.collection.delete_many({"product_id": product_id})
+        return result.deleted_count
+
+    async def reset(self, product_id: str, shards: int, stock: int, session=None) -> None:
+        """Overwrite the shards with `stock` spread evenly, e.g. when an admin sets the stock"""
+        for shard, count in enumerate(split_stock(stock, shards)):
+            await self.collection.update_one(
+                {"_id": _shard_id(product_id, shard)}, {"$set": {"stock": count}}, session=session
+            )
+
+    async def drain(self, product_id: str, session=None) -> int:
+        """Delete the product's shards one by one and return the stock they held"""
+        drained = 0
+        for shard in await self.get_shards(product_id, session=session):
+            deleted = await self.collection.find_one_and_delete({"_id": shard["_id"]}, session=session)
+            if deleted is not None:
+                drained += deleted["stock"]
+        return drained
+
+    async def _take(self, shard_id: str, quantity: int, session=None) -> bool:
+        result = await self.collection.update_one(
+            {"_id": shard_id, "stock": {"$gte": quantity}}, {"$inc": {"stock": -quantity}}, session=session
+        )
+        return result.modified_count == 1
+
+    async def decrement(self, product_id: str, shards: int, quantity: int, session=None) -> bool:
+        """
+        Take `quantity` units out of the product's shards. A random shard is
+        tried first; if it is short, one read finds the shards that can
+        cover the quantity, and as a last resort it is gathered from several.
+        Returns False, having taken nothing (or, inside a transaction, for
+        the caller to abort), if the shards hold less than `quantity`.
+        """
+        if quantity <= 0:
+            return True
+        if await self._take(_shard_id(product_id, random.randrange(shards)), quantity, session):
+            return True
+
+        available = sorted(
+            await self.get_shards(product_id, session=session), key=lambda shard: shard["stock"], reverse=True
+        )
+        if sum(shard["stock"] for shard in available) < quantity:
+            return False
+        for shard in available:
+            if shard["stock"] < quantity:
+                break
+            if await self._take(shard["_id"], quantity, session):
+                return True
+
+        # No single shard has enough: gather the quantity from several
+        taken = []
+        remaining = quantity
+        for shard in available:
+            amount = min(shard["stock"], remaining)
+            if amount > 0 and await self._take(shard["_id"], amount, session):
+                taken.append((shard["_id"], amount))
+                remaining -= amount
+            if remaining == 0:
+                return True
+        if session is None:
+            for shard_id, amount in taken:
+                await self.collection.update_one({"_id": shard_id}, {"$inc": {"stock": amount}})
+        return False
+
+    async def increment(self, product_id: str, shards: int, quantity: int, session=None) -> bool:
+        """Put `quantity` units into a random shard. False if the product has no shards (any more)"""
+        if quantity <= 0:
+            return True
+        result = await self.collection.update_one(
+            {"_id": _shard_id(product_id, random.randrange(shards))}, {"$inc": {"stock": quantity}}, session=session
+        )
+        if result.matched_count:
+            return True
+        # The shard count may have changed; any shard of the product will do
+        result = await self.collection.update_one(
+            {"product_id": product_id}, {"$inc": {"stock": quantity}}, session=session
+        )
+        return result.matched_count == 1
+
+    async def rebalance(self, product_id: str) -> int:
+        """
+        Even out the product's shards and return its total stock. Stock is
+        moved with a conditional decrement of a full shard followed by an
+        increment of an empty one, so concurrent orders never see units that
+        do not exist and the total never changes. Each move is one
+        transaction; without transactions it is first recorded on the source
+        shard, and one a crash left half done is finished here once it is
+        TRANSFER_REPAIR_AFTER_SECONDS old.
+        """
+        shards = await self.get_shards(product_id)
+        stale = datetime.utcnow() - timedelta(seconds=TRANSFER_REPAIR_AFTER_SECONDS)
+        abandoned = [shard for shard in shards if "transfer" in shard and shard["transfer"]["at"] < stale]
+        for shard in abandoned:
+            await self._finish_transfer(shard["_id"], shard["transfer"])
+        if abandoned:
+            shards = await self.get_shards(product_id)
+
+        received = {transfer for shard in shards for transfer in shard.get("received", [])}
+        in_flight = [shard["transfer"] for shard in shards if "transfer" in shard]
+        total = sum(shard["stock"] for shard in shards) + sum(
+            transfer["amount"] for transfer in in_flight if transfer["id"] not in received
+        )
+        if not shards or in_flight:
+            # Another worker is moving stock; leave the shards to it this round
+            return total
+        targets = split_stock(total, len(shards))
+        surplus = [[shard["_id"], shard["stock"] - target]
+                   for shard, target in zip(shards, targets) if shard["stock"] > target]
+        deficit = [[shard["_id"], target - shard["stock"]]
+                   for shard, target in zip(shards, targets) if shard["stock"] < target]
+        while surplus and deficit:
+            source, target = surplus[0], deficit[0]
+            amount = min(source[1], target[1])
+            if not await self._move(source[0], target[0], amount):
+                # Sold down in the meantime; leave it for the next round
+                surplus.pop(0)
+                continue
+            source[1] -= amount
+            target[1] -= amount
+            if source[1] == 0:
+                surplus.pop(0)
+            if target[1] == 0:
+                deficit.pop(0)
+        return total
+
+    async def _move(self, source_id: str, target_id: str, amount: int) -> bool:
+        """Move `amount` units between two shards; False, moving nothing, if the source is short"""
+        async def move(session):
+            if session is not None:
+                if not await self._take(source_id, amount, session):
+                    return False
+                await self.collection.update_one({"_id": target_id}, {"$inc": {"stock": amount}}, session=session)
+                return True
+            # No transaction: record the transfer on the source with its decrement,
+            # so a crash before the target has the units is repaired by a later rebalance
+            transfer = {"id": uuid.uuid4().hex, "to": target_id, "amount": amount, "at": datetime.utcnow()}
+            result = await self.collection.update_one(
+                {"_id": source_id, "stock": {"$gte": amount}, "transfer": {"$exists": False}},
+                {"$inc": {"stock": -amount}, "$set": {"transfer": transfer}}
+            )
+            if result.modified_count == 0:
+                return False
+            await self._finish_transfer(source_id, transfer)
+            return True
+
+        return await db.run_in_transaction(move)
+
+    async def _finish_transfer(self, source_id: str, transfer: dict) -> None:
+        """Credit a recorded transfer to its target (at most once) and clear it"""
+        await self.collection.update_one(
+            {"_id": transfer["to"], "received": {"$ne": transfer["id"]}},
+            {"$inc": {"stock": transfer["amount"]}, "$push": {"received": transfer["id"]}}
+        )
+        await self.collection.update_one(
+            {"_id": source_id, "transfer.id": transfer["id"]}, {"$unset": {"transfer": ""}}
+        )
+        await self.collection.update_one({"_id": transfer["to"]}, {"$pull": {"received": transfer["id"]}})
+
+
+class StockShardReconciler:
+    """
+    Background task, started and stopped by the app lifespan, that refreshes
+    sharded_products, rebalances every sharded product and writes its total
+    back to the product document.
+    """
+
+    def __init__(self, product_model):
+        self.product_model = product_model
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await self.product_model.reconcile_stock_shards()
+            except Exception as e:
+                print(f"Stock shard reconcile failed: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=settings.stock_shard_reconcile_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,302 @@
+"""
+Durable background jobs for follow-up work that should not hold up a request.
+
+`await enqueue(type, payload)` inserts a job into the jobs collection (one
+write; pass the request's session to commit it with the rest of the
+request) and returns. JobWorkerPool, started and stopped by the app
+lifespan, runs settings.job_worker_concurrency workers that claim due jobs
+with a lease and run the handler registered for the job's type with
+@job_handler.
+
+A claim sets the job running and pushes its run_at to the end of the lease,
+so a job whose worker died becomes due again by itself; a worker renews the
+lease while its handler runs, and cancels the handler if the lease was lost
+so two workers never run the same job. A failed job is retried with
+exponential backoff until it has been attempted settings.job_max_attempts
+times, then left with status "failed", as is a job whose lease ran out on
+its last attempt. Finished jobs expire after settings.job_retention_seconds.
+"""
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+
+from app.config import settings
+from app.database import db
+from app.utils.indexes import register_indexes, register_query
+from app.utils.metrics import registry
+
+register_indexes(
+    "jobs",
+    # Claiming: the earliest due job among the pending and lease-expired ones
+    IndexModel([("status", ASCENDING), ("run_at", ASCENDING)], name="status_run_at"),
+    IndexModel(
+        [("finished_at", ASCENDING)],
+        expireAfterSeconds=settings.job_retention_seconds,
+        name="finished_at_ttl"
+    )
+)
+register_query(
+    "jobs", "claim_job",
+    {
+        "status": {"$in": ["pending", "running"]},
+        "run_at": {"$lte": datetime(2000, 1, 1)},
+        "$expr": {"$lt": ["$attempts", "$max_attempts"]},
+    },
+    sort={"run_at": 1}
+)
+
+JOBS_PROCESSED = registry.counter(
+    "jobs_processed_total", "Background jobs run, by type and result", ("type", "result")
+)
+JOB_DURATION = registry.histogram(
+    "job_duration_seconds", "Time spent running a background job", ("type",)
+)
+
+JobHandler = Callable[[dict], Awaitable[None]]
+JOB_HANDLERS: Dict[str, JobHandler] = {}
+
+# Set on enqueue so idle workers in this process pick the job up without waiting for the next poll
+_job_added: Optional[asyncio.Event] = None
+
+
+def job_handler(job_type: str):
+    """Register the coroutine function that runs jobs of `job_type` (it receives the payload)"""
+    def register(handler: JobHandler) -> JobHandler:
+        JOB_HANDLERS[job_type] = handler
+        return handler
+    return register
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter before attempt `attempts + 1`"""
+    delay = min(settings.job_retry_base_seconds * 2 ** (attempts - 1), settings.job_retry_max_seconds)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class JobModel:
+    def __init__(self):
+        self.collection = db.get_collection("jobs")
+
+    async def enqueue(
+        self, job_type: str, payload: dict, delay: float = 0.0,
+        max_attempts: Optional[int] = None, session=None
+    ) -> str:
+        now = datetime.now(timezone.utc)
+        result = await self.collection.insert_one(
+            {
+                "type": job_type,
+                "payload": payload,
+                "status": "pending",
+                "attempts": 0,
+                "max_attempts": max_attempts or settings.job_max_attempts,
+                "run_at": now + timedelta(seconds=delay),
+                "created_at": now,
+            },
+            session=session
+        )
+        if _job_added is not None:
+            _job_added.set()
+        return str(result.inserted_id)
+
+    async def claim(self, worker_id: str) -> Optional[dict]:
+        """Lease the earliest due job with attempts left, or return None if nothing is due"""
+        now = datetime.now(timezone.utc)
+        job = await self.collection.find_one_and_update(
+            {
+                "status": {"$in": ["pending", "running"]},
+                "run_at": {"$lte": now},
+                "$expr": {"$lt": ["$attempts", "$max_attempts"]},
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "run_at": now + timedelta(seconds=settings.job_lease_seconds),
+                    "lease": uuid.uuid4().hex,
+                    "worker": worker_id,
+                    "started_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None:
+            await self.fail_abandoned(now)
+        return job
+
+    async def fail_abandoned(self, now: datetime) -> int:
+        """Mark failed the jobs whose lease ran out on their last attempt. Returns how many."""
+        result = await self.collection.update_many(
+            {
+                "status": "running",
+                "run_at": {"$lte": now},
+                "$expr": {"$gte": ["$attempts", "$max_attempts"]},
+            },
+            {
+                "$set": {"status": "failed", "failed_at": now, "last_error": "lease expired on the last attempt"},
+                "$unset": {"lease": ""},
+            }
+        )
+        return result.modified_count
+
+    async def renew(self, job: dict) -> bool:
+        """Extend the lease; False if the job was taken over meanwhile"""
+        result = await self.collection.update_one(
+            {"_id": job["_id"], "lease": job["lease"]},
+            {"$set": {"run_at": datetime.now(timezone.utc) + timedelta(seconds=settings.job_lease_seconds)}}
+        )
+        return result.matched_count == 1
+
+    async def complete(self, job: dict) -> None:
+        now = datetime.now(timezone.utc)
+        await self.collection.update_one(
+            {"_id": job["_id"], "lease": job["lease"]},
+            {"$set": {"status": "done", "finished_at": now}, "$unset": {"lease": "", "run_at": ""}}
+        )
+
+    async def fail(self, job: dict, error: str) -> str:
+        """Schedule a retry, or give up after max_attempts. Returns the new status."""
+        now = datetime.now(timezone.utc)
+        if job["attempts"] >= job["max_attempts"]:
+            update = {"$set": {"status": "failed", "failed_at": now, "last_error": error}, "$unset": {"lease": ""}}
+            status = "failed"
+        else:
+            update = {
+                "$set": {
+                    "status": "pending",
+                    "run_at": now + timedelta(seconds=retry_delay(job["attempts"])),
+                    "last_error": error,
+                },
+                "$unset": {"lease": ""},
+            }
+            status = "pending"
+        await self.collection.update_one({"_id": job["_id"], "lease": job["lease"]}, update)
+        return status
+
+    async def release(self, job: dict) -> None:
+        """Hand an unfinished job back (on shutdown) without counting the attempt"""
+        await self.collection.update_one(
+            {"_id": job["_id"], "lease": job["lease"]},
+            {
+                "$set": {"status": "pending", "run_at": datetime.now(timezone.utc)},
+                "$inc": {"attempts": -1},
+                "$unset": {"lease": ""},
+            }
+        )
+
+    async def counts(self) -> Dict[str, int]:
+        cursor = self.collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])
+        return {row["_id"]: row["count"] async for row in cursor}
+
+
+async def enqueue(job_type: str, payload: dict, delay: float = 0.0, session=None) -> str:
+    """Queue a job and return its id without waiting for it to run"""
+    return await JobModel().enqueue(job_type, payload, delay=delay, session=session)
+
+
+class JobWorkerPool:
+    """
+    settings.job_worker_concurrency workers claiming and running jobs. stop()
+    lets running jobs finish for up to settings.job_drain_timeout_seconds,
+    then cancels them and hands their jobs back to the queue.
+    """
+
+    def __init__(self, concurrency: Optional[int] = None, model: Optional[JobModel] = None):
+        self.concurrency = concurrency or settings.job_worker_concurrency
+        self.model = model or JobModel()
+        self.worker_id = uuid.uuid4().hex[:12]
+        self._workers: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+
+    def start(self) -> None:
+        global _job_added
+        _job_added = asyncio.Event()
+        self._stopping.clear()
+        self._workers = [
+            asyncio.create_task(self._work(f"{self.worker_id}-{index}"))
+            for index in range(self.concurrency)
+        ]
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if _job_added is not None:
+            _job_added.set()
+        if not self._workers:
+            return
+        _, pending = await asyncio.wait(self._workers, timeout=settings.job_drain_timeout_seconds)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._workers = []
+
+    async def _wait_for_work(self) -> None:
+        try:
+            await asyncio.wait_for(_job_added.wait(), timeout=settings.job_poll_interval_seconds)
+        except asyncio.TimeoutError:
+            pass
+        _job_added.clear()
+
+    async def _work(self, worker_id: str) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = await self.model.claim(worker_id)
+            except Exception as e:
+                print(f"Job claim failed: {e}")
+                job = None
+            if job is None:
+                await self._wait_for_work()
+                continue
+            try:
+                await self._run(job)
+            except Exception as e:
+                # The lease runs out and another attempt picks the job up
+                print(f"Job {job['_id']} could not be finished: {e}")
+
+    async def _renew_lease(self, job: dict, work: asyncio.Task) -> None:
+        """Keep the lease while `work` runs; cancel it if the job was taken over"""
+        while True:
+            await asyncio.sleep(settings.job_lease_seconds / 2)
+            try:
+                if not await self.model.renew(job):
+                    print(f"Lost the lease on job {job['_id']}; cancelling it")
+                    work.cancel()
+                    return
+            except Exception as e:
+                print(f"Lease renewal failed for job {job['_id']}: {e}")
+
+    async def _call(self, job: dict) -> None:
+        handler = JOB_HANDLERS.get(job["type"])
+        if handler is None:
+            raise LookupError(f"No handler for job type {job['type']!r}")
+        await handler(job["payload"])
+
+    async def _run(self, job: dict) -> None:
+        job_type = job["type"]
+        work = asyncio.create_task(self._call(job))
+        renewal = asyncio.create_task(self._renew_lease(job, work))
+        start = time.perf_counter()
+        try:
+            await work
+        except asyncio.CancelledError:
+            if renewal.done():
+                # The lease was lost and another worker owns the job now
+                JOBS_PROCESSED.inc((job_type, "lost"))
+                return
+            # Shutting down mid-job: let another worker run it from the start
+            await asyncio.shield(self.model.release(job))
+            raise
+        except Exception as e:
+            status = await self.model.fail(job, repr(e))
+            JOBS_PROCESSED.inc((job_type, "failed" if status == "failed" else "retried"))
+            print(f"Job {job['_id']} ({job_type}) attempt {job['attempts']} failed: {e!r}")
+        else:
+            await self.model.complete(job)
+            JOBS_PROCESSED.inc((job_type, "done"))
+        finally:
+            renewal.cancel()
+            JOB_DURATION.observe((job_type,), time.perf_counter() - start)
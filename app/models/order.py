@@ -1,22 +1,305 @@
 from datetime import datetime,timezone
 from bson import ObjectId
 from app.database import db
+from app.models.job import JobModel, job_handler
+from app.models.product import ProductModel, catalog_cache
+from app.models.reservation import ReservationModel, reserved_quantities
+from app.models.sales import SalesRollupModel
+from app.models.user import UserModel
+from app.utils.indexes import register_indexes, register_query
+from app.utils.pagination import InvalidCursor, ascending_after, decode_cursor, descending_after, encode_cursor
+from app.utils.serialization import ORDER_PROJECTION
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument
+from pymongo.errors import PyMongoError
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from app.config import settings
+
+register_indexes(
+    "orders",
+    IndexModel(
+        [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+        name="user_id_created_at_id"
+    ),
+    # Admin export: date ranges in (created_at, _id) order, optionally by status
+    IndexModel([("created_at", ASCENDING), ("_id", ASCENDING)], name="created_at_id"),
+    IndexModel(
+        [("status", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+        name="status_created_at_id"
+    )
+)
+register_query("orders", "get_user_orders", {"user_id": "probe"}, sort={"created_at": -1, "_id": -1})
+register_query(
+    "orders", "export_orders",
+    {"created_at": {"$gte": datetime(2000, 1, 1)}},
+    sort={"created_at": 1, "_id": 1}
+)
+register_query(
+    "orders", "export_orders_by_status",
+    {"status": "probe", "created_at": {"$gte": datetime(2000, 1, 1)}},
+    sort={"created_at": 1, "_id": 1}
+)
+
+
+class ProductNotFound(Exception):
+    def __init__(self, product_id: str):
+        super().__init__(f"Product {product_id} not found")
+        self.product_id = product_id
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids: List[str]):
+        super().__init__(f"Insufficient stock for product {', '.join(product_ids)}")
+        self.product_ids = product_ids
+
+
+def order_quantities(order_items: List[dict]) -> Dict[str, int]:
+    """Total quantity per product id (an order may list a product twice)"""
+    quantities: Dict[str, int] = {}
+    for item in order_items:
+        quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+    return quantities
+
 
 class OrderModel:
     def __init__(self):
         self.collection = db.get_collection("orders")
+        self.sales = SalesRollupModel()
+        self.reservations = ReservationModel()
+        self.jobs = JobModel()
 
-    async def create_order(self, order_data: dict) -> str:
+    async def create_order(self, order_data: dict, session=None) -> str:
         order_data["created_at"] = datetime.now(timezone.utc)
-        result = await self.collection.insert_one(order_data)
+        # The sales rollups count the order when its record_sales job runs
+        order_data["sales_counted"] = False
+        result = await self.collection.insert_one(order_data, session=session)
+        await self._enqueue_follow_up(result.inserted_id, order_data["user_id"], session=session)
         return str(result.inserted_id)
 
+    async def _enqueue(self, job_type: str, payload: dict, session=None) -> None:
+        """
+        Queue a job for an order. Inside a transaction it commits with the
+        order; without one the order stands even if the job can't be queued.
+        """
+        if session is not None:
+            await self.jobs.enqueue(job_type, payload, session=session)
+            return
+        try:
+            await self.jobs.enqueue(job_type, payload)
+        except PyMongoError as e:
+            print(f"Could not queue {job_type} for order {payload['order_id']}: {e}")
+
+    async def _enqueue_follow_up(self, order_id: ObjectId, user_id: str, session=None) -> None:
+        await self._enqueue("order_placed", {"order_id": str(order_id), "user_id": user_id}, session=session)
+        # Off the order's transaction: every order $incs the same rollup documents
+        await self._enqueue("record_sales", {"order_id": str(order_id)}, session=session)
+
+    async def sync_sales(self, order_id: str) -> None:
+        """
+        Make the sales rollups count the order once, or not at all if it is
+        cancelled. `sales_counted` on the order says what the rollups hold
+        and flips in the same transaction as their $inc, so a retried job
+        never counts an order twice. Without transactions the flag goes
+        first and a failed $inc is left for the backfill to repair.
+        """
+        async def sync(session):
+            order = await self.collection.find_one(
+                {"_id": ObjectId(order_id)},
+                projection={"status": 1, "created_at": 1, "total_price": 1, "order_items": 1, "sales_counted": 1},
+                session=session
+            )
+            if order is None:
+                return
+            wanted = order.get("status") != "cancelled"
+            # Orders from before the flag were counted as they were placed and cancelled
+            if order.get("sales_counted", wanted) == wanted:
+                return
+            result = await self.collection.update_one(
+                {"_id": order["_id"], "status": order.get("status"), "sales_counted": {"$ne": wanted}},
+                {"$set": {"sales_counted": wanted}},
+                session=session
+            )
+            if result.modified_count == 0:
+                # Changed meanwhile; the job queued by that change syncs it
+                return
+            if session is not None:
+                await self.sales.record_order(order, session=session, sign=1 if wanted else -1)
+                return
+            try:
+                await self.sales.record_order(order, sign=1 if wanted else -1)
+            except PyMongoError as e:
+                print(f"Sales rollup update failed for order {order_id}: {e}")
+
+        await db.run_in_transaction(sync)
+
+    async def place_order(
+        self, order_data: dict, product_model: ProductModel,
+        session=None, products: Optional[Dict[str, dict]] = None
+    ) -> dict:
+        """
+        Validate, reserve stock for and insert an order in a constant number
+        of round trips: one $in query validates every line item, one
+        bulk_write decrements stock and one insert stores the order, all in
+        a single transaction. Without transaction support the decrements run
+        concurrently and are given back if any item is short.
+
+        The user's cart reservations for the ordered products are consumed:
+        reserved units come out of the reserved counter rather than stock.
+
+        Pass `session` to join a transaction the caller already started, and
+        `products` (from get_products_by_ids) if they were already fetched.
+
+        Returns the stored order document (with _id). Raises ProductNotFound
+        or InsufficientStock; in both cases nothing is written.
+        """
+        quantities = order_quantities(order_data["order_items"])
+        if products is None:
+            products = await product_model.get_products_by_ids(list(quantities), session=session)
+
+        missing = [product_id for product_id in quantities if product_id not in products]
+        if missing:
+            raise ProductNotFound(missing[0])
+
+        user_id = order_data["user_id"]
+        held = await self.reservations.held(user_id, list(quantities), session=session)
+        # A sharded product's document stock is only a periodic total; its shards decide below
+        shards = {product_id: products[product_id].get("stock_shards", 0) for product_id in quantities}
+        short = [product_id for product_id, quantity in quantities.items()
+                 if not shards[product_id]
+                 and products[product_id].get("stock", 0) + held.get(product_id, 0) < quantity]
+        if short:
+            raise InsufficientStock(short)
+
+        # Keep the category with each line so sales rollups can group by it
+        for item in order_data["order_items"]:
+            item["category"] = products[item["product_id"]].get("category")
+
+        async def write_order(session):
+            taken = await self.reservations.take(user_id, list(quantities), session=session)
+            reserved = {
+                product_id: min(quantity, quantities[product_id])
+                for product_id, quantity in reserved_quantities(taken).items()
+            }
+            if session is None:
+                short = await product_model.decrement_stock_each(quantities, reserved=reserved)
+                if short:
+                    await self.reservations.restore(taken)
+                    raise InsufficientStock(short)
+                try:
+                    order_id = await self.create_order(order_data)
+                except Exception:
+                    await product_model.restock(quantities, reserved=reserved)
+                    await self.reservations.restore(taken)
+                    raise
+                await self._release_surplus(taken, reserved, product_model)
+                return order_id
+
+            if not await product_model.decrement_stock_bulk(
+                quantities, session=session, reserved=reserved, shards=shards
+            ):
+                # Raising aborts the transaction and undoes the partial decrements
+                raise InsufficientStock(await self._short_products(quantities, product_model, session, reserved))
+            order_id = await self.create_order(order_data, session=session)
+            await self._release_surplus(taken, reserved, product_model, session)
+            return order_id
+
+        if session is not None:
+            order_id = await write_order(session)
+        else:
+            order_id = await db.run_in_transaction(write_order)
+        # Drop anything cached between the decrement and the commit
+        catalog_cache.invalidate(*quantities)
+        order_data["_id"] = ObjectId(order_id)
+        return order_data
+
+    async def _short_products(
+        self, quantities: Dict[str, int], product_model: ProductModel, session, reserved: Dict[str, int]
+    ) -> List[str]:
+        products = await product_model.get_products_by_ids(list(quantities), session=session)
+        stock = {product_id: product.get("stock", 0) for product_id, product in products.items()}
+        for product_id, product in products.items():
+            if product.get("stock_shards"):
+                stock[product_id] = await product_model.stock_shards.total(product_id, session=session)
+        return [product_id for product_id, quantity in quantities.items()
+                if stock.get(product_id, 0) + reserved.get(product_id, 0) < quantity
+                ] or list(quantities)
+
+    async def _release_surplus(
+        self, taken: List[dict], reserved: Dict[str, int], product_model: ProductModel, session=None
+    ) -> None:
+        """Units reserved beyond what was ordered go back to stock"""
+        await product_model.release_reserved(
+            {
+                product_id: quantity - reserved[product_id]
+                for product_id, quantity in reserved_quantities(taken).items()
+            },
+            session=session
+        )
+
     async def get_order_by_id(self, order_id: str) -> dict:
         return await self.collection.find_one({"_id": ObjectId(order_id)})
 
-    async def get_user_orders(self, user_id: str):
-        cursor = self.collection.find({"user_id": user_id}).sort("created_at", -1)
-        return await cursor.to_list(length=100)
+    async def get_user_orders(
+        self, user_id: str, limit: int = 100, cursor: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Newest-first order history, keyset-paginated on (created_at, _id).
+        Returns the page and the cursor of the next page (None on the last page).
+        """
+        query = {"user_id": user_id}
+        if cursor:
+            position = decode_cursor(cursor)
+            if position["created_at"] is None:
+                raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+            query.update(descending_after(position))
+
+        docs = await (
+            self.collection.find(query, ORDER_PROJECTION)
+            .sort([("created_at", DESCENDING), ("_id", DESCENDING)])
+            .limit(limit + 1)
+            .to_list(length=limit + 1)
+        )
+        orders = docs[:limit]
+        next_cursor = None
+        if len(docs) > limit:
+            next_cursor = encode_cursor(orders[-1]["_id"], orders[-1]["created_at"])
+        return orders, next_cursor
+
+    async def export_orders(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        status: Optional[str] = None,
+        after: Optional[dict] = None,
+        batch_size: Optional[int] = None
+    ) -> AsyncIterator[dict]:
+        """
+        Every order created in [start, end) with the given status, oldest
+        first in (created_at, _id) order. `after` ({"created_at", "_id"} of the
+        last order received) resumes an interrupted export. Documents are
+        pulled from the server `batch_size` at a time, so memory does not
+        grow with the size of the export.
+        """
+        conditions = []
+        if status:
+            conditions.append({"status": status})
+        created_at = {}
+        if start:
+            created_at["$gte"] = start
+        if end:
+            created_at["$lt"] = end
+        if created_at:
+            conditions.append({"created_at": created_at})
+        if after:
+            conditions.append(ascending_after(after))
+        query = {"$and": conditions} if len(conditions) > 1 else (conditions[0] if conditions else {})
+
+        cursor = (
+            self.collection.find(query, ORDER_PROJECTION)
+            .sort([("created_at", ASCENDING), ("_id", ASCENDING)])
+            .batch_size(batch_size or settings.order_export_batch_size)
+        )
+        async for order in cursor:
+            yield order
 
     async def update_order_status(self, order_id: str, status: str) -> bool:
         update_data = {
@@ -27,10 +310,20 @@ class OrderModel:
             update_data["is_delivered"] = True
             update_data["delivered_at"] = datetime.now(timezone.utc)
 
-        result = await self.collection.update_one(
-            {"_id": ObjectId(order_id)}, {"$set": update_data}
+        previous = await self.collection.find_one_and_update(
+            {"_id": ObjectId(order_id)},
+            {"$set": update_data},
+            projection={"status": 1, "created_at": 1, "total_price": 1, "order_items": 1},
+            return_document=ReturnDocument.BEFORE
         )
-        return result.modified_count > 0
+        if previous is None:
+            return False
+
+        # Cancelled orders do not count as sales; un-cancelling counts them again
+        was_cancelled = previous.get("status") == "cancelled"
+        if was_cancelled != (status == "cancelled"):
+            await self._enqueue("record_sales", {"order_id": order_id})
+        return True
 
     async def update_payment_status(self, order_id: str, is_paid: bool) -> bool:
         update_data = {
@@ -40,4 +333,24 @@ class OrderModel:
         result = await self.collection.update_one(
             {"_id": ObjectId(order_id)}, {"$set": update_data}
         )
-        return result.modified_count > 0
\ No newline at end of file
+        return result.modified_count > 0
+
+
+@job_handler("order_placed")
+async def order_placed(payload: dict) -> None:
+    """
+    Follow-up work for a new order, run by the job workers. The order
+    confirmation is logged; there is no mail transport in this service yet.
+    """
+    order = await OrderModel().get_order_by_id(payload["order_id"])
+    if order is None:
+        return
+    user = await UserModel().get_user_by_id(payload["user_id"])
+    email = user["email"] if user else "unknown recipient"
+    print(f"Order confirmation for order {order['_id']} ({order['total_price']:.2f}) to {email}")
+
+
+@job_handler("record_sales")
+async def record_sales(payload: dict) -> None:
+    """Bring the sales rollups in line with the order's status"""
+    await OrderModel().sync_sales(payload["order_id"])
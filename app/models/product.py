@@ -1,62 +1,782 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from bson import ObjectId
+from app.config import settings
 from app.database import db
-from typing import List, Optional
+from app.models.inventory import TRANSFER_REPAIR_AFTER_SECONDS, StockShardModel, sharded_products
+from app.utils.cache import TTLCache
+from app.utils.indexes import register_indexes, register_query
+from app.utils.pagination import decode_cursor, encode_cursor
+from app.utils.serialization import PRODUCT_PROJECTION
+from pymongo import ASCENDING, TEXT, IndexModel, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+import asyncio
+import time
+
+register_indexes(
+    "products",
+    # Category listings and keyset pages within a category
+    IndexModel([("category", ASCENDING), ("_id", ASCENDING)], name="category_id"),
+    # Full-text search; a name match ranks well above a description match
+    IndexModel(
+        [("name", TEXT), ("description", TEXT)],
+        weights={"name": 10, "description": 2},
+        name="name_description_text"
+    ),
+    # Bulk import upserts by SKU; products without one are not indexed
+    IndexModel(
+        [("sku", ASCENDING)],
+        unique=True,
+        partialFilterExpression={"sku": {"$type": "string"}},
+        name="sku_unique"
+    )
+)
+register_query("products", "get_all_products_by_category", {"category": "probe"})
+register_query(
+    "products", "get_products_page_by_category",
+    {"category": "probe", "_id": {"$gt": ObjectId("000000000000000000000000")}},
+    sort={"_id": 1}
+)
+register_query("products", "search_products", {"$text": {"$search": "probe"}})
+register_query("products", "import_upsert_by_sku", {"sku": "probe"})
+
+
+def _stock_update(stock: int, reserved: int, now: datetime) -> Union[dict, list]:
+    """
+    Update adding `stock` to a product's stock and `reserved` to its reserved
+    counter. The counter is clamped at 0: holds taken while the product was
+    sharded may be released after it no longer is, and were never counted.
+    """
+    if not reserved:
+        return {"$inc": {"stock": stock}, "$set": {"updated_at": now}}
+    return [{"$set": {
+        "stock": {"$add": ["$stock", stock]},
+        "reserved": {"$max": [0, {"$add": [{"$ifNull": ["$reserved", 0]}, reserved]}]},
+        "updated_at": now
+    }}]
+
+
+async def _run_all(calls: List[Callable[[], Awaitable]], session=None) -> list:
+    """Await the calls concurrently, or one by one inside a transaction (a session runs one operation at a time)"""
+    if session is None:
+        return await asyncio.gather(*[call() for call in calls])
+    return [await call() for call in calls]
+
+
+class CatalogCache:
+    """
+    Read-through cache for single products and list pages.
+
+    Every product write bumps `version`. Readers capture the version before
+    going to Mongo and only store the result if no write happened in the
+    meantime, so a slow read can never re-populate the cache with a document
+    that was already invalidated. Cached documents are shared between
+    requests and must be treated as read-only.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.products = TTLCache(
+            max_size=settings.product_cache_max_size,
+            ttl=settings.product_cache_ttl_seconds
+        )
+        self.pages = TTLCache(
+            max_size=settings.product_page_cache_max_size,
+            ttl=settings.product_cache_ttl_seconds
+        )
+
+    def invalidate(self, *product_ids: str) -> None:
+        self.version += 1
+        for product_id in product_ids:
+            self.products.invalidate(product_id)
+        self.pages.clear()
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "products": self.products.stats(),
+            "pages": self.pages.stats()
+        }
+
+
+catalog_cache = CatalogCache()
+
+
+class FacetCache:
+    """
+    In-memory catalog facets: product and in-stock counts per category and
+    per brand, and the price range.
+
+    The first read computes them with one $facet aggregation. Writes that
+    know exactly what changed (create, delete, a single stock decrement that
+    hits zero) adjust the counts in place; other writes mark the snapshot
+    dirty, and it is recomputed in the background at most once every
+    settings.facet_cache_refresh_seconds while readers keep getting the
+    previous one. Like CatalogCache, `version` guards against a slow recompute
+    overwriting changes that happened while it ran.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.facets: Optional[dict] = None
+        self.dirty = False
+        self.refreshed_at = 0.0
+        self.refreshes = 0
+        self._refresh: Optional[asyncio.Task] = None
+
+    async def get(self, compute: Callable[[], Awaitable[dict]]) -> dict:
+        if self.facets is None:
+            await self._run_refresh(compute)
+        elif self.dirty and time.monotonic() - self.refreshed_at >= settings.facet_cache_refresh_seconds:
+            self._start_refresh(compute)
+        return self.facets
+
+    def _start_refresh(self, compute) -> asyncio.Task:
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.ensure_future(self._recompute(compute))
+        return self._refresh
+
+    async def _run_refresh(self, compute) -> None:
+        # Concurrent first readers share one aggregation
+        await asyncio.shield(self._start_refresh(compute))
+
+    async def _recompute(self, compute) -> None:
+        version = self.version
+        self.dirty = False
+        try:
+            facets = await compute()
+        except Exception:
+            self.dirty = True
+            if self.facets is None:
+                raise
+            print("Facet refresh failed; serving the previous facets")
+            return
+        finally:
+            self.refreshed_at = time.monotonic()
+        self.facets = facets
+        self.refreshes += 1
+        if version != self.version:
+            self.dirty = True
+
+    def mark_dirty(self) -> None:
+        self.version += 1
+        self.dirty = True
+
+    def clear(self) -> None:
+        """Drop the snapshot so the next read recomputes it, e.g. after a bulk delete"""
+        self.version += 1
+        self.facets = None
+
+    def _bucket(self, group: str, name) -> dict:
+        return self.facets[group].setdefault(name, {"count": 0, "in_stock": 0})
+
+    def add(self, product: dict, sign: int = 1) -> None:
+        """Count a created product (sign=1) or uncount a deleted one (sign=-1)"""
+        self.version += 1
+        if self.facets is None:
+            return
+        in_stock = sign if product.get("stock", 0) > 0 else 0
+        for group, name in (("categories", product.get("category")), ("brands", product.get("brand"))):
+            bucket = self._bucket(group, name)
+            bucket["count"] += sign
+            bucket["in_stock"] += in_stock
+            if bucket["count"] <= 0:
+                del self.facets[group][name]
+        self.facets["total"] += sign
+        self.facets["in_stock"] += in_stock
+
+        price = self.facets["price"]
+        if sign > 0:
+            price["min"] = product["price"] if price["min"] is None else min(price["min"], product["price"])
+            price["max"] = product["price"] if price["max"] is None else max(price["max"], product["price"])
+        elif product.get("price") in (price["min"], price["max"]):
+            # The range may have shrunk; only a recompute can tell
+            self.dirty = True
+
+    def sold_out(self, product: dict) -> None:
+        """A product's stock just went from positive to zero"""
+        self.version += 1
+        if self.facets is None:
+            return
+        for group, name in (("categories", product.get("category")), ("brands", product.get("brand"))):
+            self._bucket(group, name)["in_stock"] -= 1
+        self.facets["in_stock"] -= 1
+
+    def snapshot(self) -> dict:
+        """The facets in response form: lists sorted by name"""
+        facets = self.facets
+        return {
+            "total": facets["total"],
+            "in_stock": facets["in_stock"],
+            "price": dict(facets["price"]),
+            **{
+                group: [
+                    {"name": name, **counts}
+                    for name, counts in sorted(facets[group].items(), key=lambda item: str(item[0]))
+                ]
+                for group in ("categories", "brands")
+            },
+        }
+
+    def stats(self) -> dict:
+        return {"version": self.version, "dirty": self.dirty, "refreshes": self.refreshes}
+
+
+facet_cache = FacetCache()
 
 class ProductModel:
     @property
     def collection(self):
         return db.get_collection("products")
 
+    @property
+    def stock_shards(self) -> StockShardModel:
+        return StockShardModel()
+
     async def create_product(self, product_data: dict) -> str:
         product_data["created_at"] = datetime.utcnow()
         product_data["updated_at"] = datetime.utcnow()
         result = await self.collection.insert_one(product_data)
+        catalog_cache.invalidate()
+        facet_cache.add(product_data)
         return str(result.inserted_id)
 
-    async def get_product_by_id(self, product_id: str) -> Optional[dict]:
-        return await self.collection.find_one({"_id": ObjectId(product_id)})
+    async def get_product_by_id(self, product_id: str, use_cache: bool = True) -> Optional[dict]:
+        """
+        Get a product, served from the catalog cache when possible.
+        Pass use_cache=False where the stock value has to be exact.
+        """
+        if use_cache:
+            cached = catalog_cache.products.get(product_id)
+            if cached is not None:
+                return cached
+
+        version = catalog_cache.version
+        product = await self.collection.find_one({"_id": ObjectId(product_id)})
+        if product is not None and version == catalog_cache.version:
+            catalog_cache.products.set(product_id, product)
+        return product
+
+    async def get_product_version(self, product_id: str) -> Optional[dict]:
+        """
+        Just the fields a product's HTTP validators are built from (_id,
+        updated_at, created_at): from the cache, else a projection-only query.
+        """
+        cached = catalog_cache.products.get(product_id)
+        if cached is not None:
+            return cached
+        return await self.collection.find_one(
+            {"_id": ObjectId(product_id)}, {"updated_at": 1, "created_at": 1}
+        )
 
     async def get_all_products(self, skip: int = 0, limit: int = 100, category: str = None):
+        key = ("list", skip, limit, category)
+        cached = catalog_cache.pages.get(key)
+        if cached is not None:
+            return cached
+
+        version = catalog_cache.version
         query = {} if not category else {"category": category}
-        cursor = self.collection.find(query).skip(skip).limit(limit)
-        return await cursor.to_list(length=limit)
+        cursor = self.collection.find(query, PRODUCT_PROJECTION).skip(skip).limit(limit)
+        products = await cursor.to_list(length=limit)
+        if version == catalog_cache.version:
+            catalog_cache.pages.set(key, products)
+        return products
+
+    async def get_products_page(
+        self, cursor: Optional[str] = None, limit: int = 100, category: str = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Keyset pagination on _id. Returns the page and the cursor of the next
+        page (None on the last page). Each page is an index range scan, so
+        page 10,000 costs the same as page 1. Raises InvalidCursor.
+        """
+        key = ("cursor", cursor, limit, category)
+        cached = catalog_cache.pages.get(key)
+        if cached is not None:
+            return cached
+
+        version = catalog_cache.version
+        query = {} if not category else {"category": category}
+        if cursor:
+            query["_id"] = {"$gt": decode_cursor(cursor)["_id"]}
+
+        # Fetch one extra document to know whether another page exists
+        docs = await self.collection.find(query, PRODUCT_PROJECTION).sort("_id", ASCENDING).limit(limit + 1).to_list(length=limit + 1)
+        products = docs[:limit]
+        next_cursor = encode_cursor(products[-1]["_id"]) if len(docs) > limit else None
+
+        page = (products, next_cursor)
+        if version == catalog_cache.version:
+            catalog_cache.pages.set(key, page)
+        return page
 
     async def update_product(self, product_id: str, update_data: dict) -> bool:
         update_data["updated_at"] = datetime.utcnow()
+        shards = await self._shards_of(product_id) if "stock" in update_data else 0
+        if shards:
+            # The shards hold a sharded product's stock; the document only shows the total
+            await self.stock_shards.reset(product_id, shards, update_data["stock"])
         result = await self.collection.update_one(
             {"_id": ObjectId(product_id)}, {"$set": update_data}
         )
+        catalog_cache.invalidate(product_id)
+        facet_cache.mark_dirty()
         return result.modified_count > 0
 
     async def delete_product(self, product_id: str) -> bool:
-        result = await self.collection.delete_one({"_id": ObjectId(product_id)})
-        return result.deleted_count > 0
+        deleted = await self.collection.find_one_and_delete(
+            {"_id": ObjectId(product_id)},
+            projection={"category": 1, "brand": 1, "stock": 1, "price": 1}
+        )
+        catalog_cache.invalidate(product_id)
+        if deleted is not None:
+            facet_cache.add(deleted, sign=-1)
+            await self.stock_shards.delete(product_id)
+        return deleted is not None
 
-    async def search_products(self, search_term: str):
-        cursor = self.collection.find({
-            "$or": [
-                {"name": {"$regex": search_term, "$options": "i"}},
-                {"description": {"$regex": search_term, "$options": "i"}}
-            ]
-        })
-        return await cursor.to_list(length=100)
+    async def search_products(self, search_term: str, skip: int = 0, limit: int = 100, category: str = None):
+        """
+        Full-text search over name and description using the text index,
+        ranked by relevance (textScore) and optionally limited to a category.
+        """
+        query = {"$text": {"$search": search_term}}
+        if category:
+            query["category"] = category
 
-    async def decrement_stock_atomic(self, product_id: str, quantity: int) -> Optional[dict]:
+        projection = {**PRODUCT_PROJECTION, "score": {"$meta": "textScore"}}
+        cursor = (
+            self.collection.find(query, projection)
+            .sort([("score", {"$meta": "textScore"})])
+            .skip(skip)
+            .limit(limit)
+        )
+        return await cursor.to_list(length=limit)
+
+    async def _shards_of(self, product_id: str, session=None) -> int:
+        """Look up whether the product is sharded now, updating sharded_products"""
+        product = await self.collection.find_one(
+            {"_id": ObjectId(product_id)}, {"stock_shards": 1}, session=session
+        )
+        shards = (product or {}).get("stock_shards") or 0
+        sharded_products.set(product_id, shards)
+        return shards
+
+    async def _route_stock(self, product_id: str, on_document, on_shards, session=None):
+        """
+        Apply a stock change to the product document or, for a sharded
+        product, to its shards. Document updates only match unsharded
+        products, so when the change fails because this worker's view of the
+        sharding was stale it is looked up and the change retried once.
+        """
+        shards = sharded_products.get(product_id)
+        result = await (on_shards(shards) if shards else on_document())
+        if not result:
+            fresh = await self._shards_of(product_id, session=session)
+            if fresh != shards:
+                result = await (on_shards(fresh) if fresh else on_document())
+        return result
+
+    async def decrement_stock_atomic(
+        self, product_id: str, quantity: int, reserved: int = 0, session=None
+    ) -> Optional[dict]:
         """
         Atomically decrement stock only if sufficient stock exists.
         Returns the updated product if successful, None if insufficient stock.
         This prevents race conditions during concurrent orders.
+        `reserved` units of the quantity come out of the product's reserved
+        counter (an order consuming a cart reservation), the rest out of stock.
+        A sharded product's stock is taken from its shards and only its id
+        and shard count are returned.
         """
-        result = await self.collection.find_one_and_update(
-            {
-                "_id": ObjectId(product_id),
-                "stock": {"$gte": quantity}  # Only update if stock >= quantity
-            },
-            {
-                "$inc": {"stock": -quantity},  # Atomically decrement
-                "$set": {"updated_at": datetime.utcnow()}
-            },
-            return_document=True  # Return the updated document
+        async def on_document():
+            result = await self.collection.find_one_and_update(
+                {
+                    "_id": ObjectId(product_id),
+                    "stock": {"$gte": quantity - reserved},  # Only update if stock covers the unreserved part
+                    "stock_shards": {"$exists": False}
+                },
+                _stock_update(reserved - quantity, -reserved, datetime.utcnow()),  # Atomically decrement
+                return_document=True,  # Return the updated document
+                session=session
+            )
+            catalog_cache.invalidate(product_id)
+            if result is not None and result["stock"] == 0 and quantity > reserved:
+                facet_cache.sold_out(result)
+            return result
+
+        async def on_shards(shards):
+            # Reserved units already left the shards when they were reserved
+            if await self.stock_shards.decrement(product_id, shards, quantity - reserved, session=session):
+                return {"_id": ObjectId(product_id), "stock_shards": shards}
+            return None
+
+        return await self._route_stock(product_id, on_document, on_shards, session=session)
+
+    async def reserve_stock(self, product_id: str, quantity: int, session=None) -> bool:
+        """Move `quantity` units from stock to the reserved counter if that much stock is left"""
+        async def on_document():
+            result = await self.collection.find_one_and_update(
+                {"_id": ObjectId(product_id), "stock": {"$gte": quantity}, "stock_shards": {"$exists": False}},
+                {"$inc": {"stock": -quantity, "reserved": quantity}, "$set": {"updated_at": datetime.utcnow()}},
+                projection={"stock": 1, "category": 1, "brand": 1},
+                return_document=True,
+                session=session
+            )
+            catalog_cache.invalidate(product_id)
+            if result is not None and result["stock"] == 0:
+                facet_cache.sold_out(result)
+            return result is not None
+
+        async def on_shards(shards):
+            return await self.stock_shards.decrement(product_id, shards, quantity, session=session)
+
+        return await self._route_stock(product_id, on_document, on_shards, session=session)
+
+    async def _give_back(self, product_id: str, stock: int, reserved: int, now: datetime, session=None) -> bool:
+        """Add `stock` units to the product's stock and `reserved` to its reserved counter"""
+        async def on_document():
+            result = await self.collection.update_one(
+                {"_id": ObjectId(product_id), "stock_shards": {"$exists": False}},
+                _stock_update(stock, reserved, now),
+                session=session
+            )
+            return result.matched_count == 1
+
+        async def on_shards(shards):
+            return await self.stock_shards.increment(product_id, shards, stock, session=session)
+
+        return await self._route_stock(product_id, on_document, on_shards, session=session)
+
+    async def release_reserved(self, quantities: Dict[str, int], session=None) -> None:
+        """Move reserved units back to stock, e.g. for an expired or removed cart item"""
+        quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+        if not quantities:
+            return
+        now = datetime.utcnow()
+        await _run_all([
+            lambda product_id=product_id, quantity=quantity: self._give_back(
+                product_id, quantity, -quantity, now, session=session
+            )
+            for product_id, quantity in quantities.items()
+        ], session)
+        catalog_cache.invalidate(*quantities)
+        facet_cache.mark_dirty()
+
+    async def get_products_by_ids(self, product_ids: List[str], session=None) -> Dict[str, dict]:
+        """Fetch several products in one $in query, keyed by string id. Bypasses the cache."""
+        cursor = self.collection.find(
+            {"_id": {"$in": [ObjectId(product_id) for product_id in product_ids]}},
+            session=session
         )
-        return result
\ No newline at end of file
+        return {str(product["_id"]): product async for product in cursor}
+
+    async def decrement_stock_bulk(
+        self, quantities: Dict[str, int], session=None, reserved: Optional[Dict[str, int]] = None,
+        shards: Optional[Dict[str, int]] = None
+    ) -> bool:
+        """
+        Decrement stock for several products with one bulk_write. Each update
+        only matches while stock covers the quantity not already `reserved`,
+        so the result is True only if every product had enough stock. Callers
+        must run this inside a transaction: on False the partial decrements
+        are rolled back by aborting it.
+
+        Sharded products (`shards`, product id -> shard count, defaults to
+        sharded_products) are decremented through their shards instead.
+        """
+        reserved = reserved or {}
+        if shards is None:
+            shards = {product_id: sharded_products.get(product_id) for product_id in quantities}
+        shards = {product_id: count for product_id, count in shards.items() if count and product_id in quantities}
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {
+                    "_id": ObjectId(product_id),
+                    "stock": {"$gte": quantity - reserved.get(product_id, 0)},
+                    "stock_shards": {"$exists": False}
+                },
+                _stock_update(reserved.get(product_id, 0) - quantity, -reserved.get(product_id, 0), now)
+            )
+            for product_id, quantity in quantities.items() if product_id not in shards
+        ]
+        for product_id, count in shards.items():
+            unreserved = quantities[product_id] - reserved.get(product_id, 0)
+            if not await self.stock_shards.decrement(product_id, count, unreserved, session=session):
+                return False
+        if not operations:
+            return True
+        result = await self.collection.bulk_write(operations, ordered=False, session=session)
+        catalog_cache.invalidate(*quantities)
+        facet_cache.mark_dirty()
+        return result.matched_count == len(operations)
+
+    async def decrement_stock_each(
+        self, quantities: Dict[str, int], reserved: Optional[Dict[str, int]] = None
+    ) -> List[str]:
+        """
+        Transaction-less variant of decrement_stock_bulk: issues the atomic
+        per-product decrements concurrently and, if any of them fails, puts
+        back the ones that succeeded. Returns the product ids that were short.
+        """
+        reserved = reserved or {}
+        product_ids = list(quantities)
+        results = await asyncio.gather(*[
+            self.decrement_stock_atomic(product_id, quantities[product_id], reserved.get(product_id, 0))
+            for product_id in product_ids
+        ])
+        short = [product_id for product_id, updated in zip(product_ids, results) if updated is None]
+        if short:
+            applied = [product_id for product_id, updated in zip(product_ids, results) if updated is not None]
+            await self.restock(
+                {product_id: quantities[product_id] for product_id in applied},
+                reserved={product_id: reserved[product_id] for product_id in applied if product_id in reserved}
+            )
+        return short
+
+    async def restock(
+        self, quantities: Dict[str, int], session=None, reserved: Optional[Dict[str, int]] = None
+    ) -> None:
+        """
+        Give stock back, e.g. to compensate a failed order. `reserved` units
+        of the quantity go back to the reserved counter instead.
+        """
+        if not quantities:
+            return
+        reserved = reserved or {}
+        now = datetime.utcnow()
+        await _run_all([
+            lambda product_id=product_id, quantity=quantity: self._give_back(
+                product_id, quantity - reserved.get(product_id, 0), reserved.get(product_id, 0), now, session=session
+            )
+            for product_id, quantity in quantities.items()
+        ], session)
+        catalog_cache.invalidate(*quantities)
+        facet_cache.mark_dirty()
+
+    async def enable_stock_shards(self, product_id: str, shards: int) -> Optional[int]:
+        """
+        Move a product's stock into `shards` counters. From the moment the
+        product is flagged, document decrements stop matching it; orders that
+        arrive before the shards exist are refused as short. The reserved
+        counter is zeroed: while sharded, holds are only tracked by the
+        reservation documents. Returns the stock moved, or None if the
+        product is missing or already sharded.
+
+        The flag comes with `stock_shards_pending` until the shards exist.
+        Without transactions a crash can leave it set; the reconciler then
+        creates the missing shards from the document's stock, which no
+        order changes once the product is flagged.
+        """
+        async def enable(session):
+            product = await self.collection.find_one_and_update(
+                {"_id": ObjectId(product_id), "stock_shards": {"$exists": False}},
+                {"$set": {
+                    "stock_shards": shards,
+                    "stock_shards_pending": datetime.utcnow(),
+                    "reserved": 0,
+                    "updated_at": datetime.utcnow()
+                }},
+                projection={"stock": 1},
+                session=session
+            )
+            if product is None:
+                return None
+            await self.stock_shards.create(product_id, shards, product.get("stock", 0), session=session)
+            await self.collection.update_one(
+                {"_id": ObjectId(product_id)}, {"$unset": {"stock_shards_pending": ""}}, session=session
+            )
+            return product.get("stock", 0)
+
+        stock = await db.run_in_transaction(enable)
+        if stock is not None:
+            sharded_products.set(product_id, shards)
+            catalog_cache.invalidate(product_id)
+        return stock
+
+    async def disable_stock_shards(self, product_id: str) -> Optional[int]:
+        """
+        Fold a sharded product's stock back into its document, and rebuild
+        its reserved counter from the reservations still held. Returns the
+        stock it ends up with, or None if the product was not sharded.
+        """
+        async def disable(session):
+            # Unflag first with stock 0, so no unit is counted twice while the shards drain.
+            # A conversion still pending holds its stock in the document: leave it to the reconciler
+            product = await self.collection.find_one_and_update(
+                {"_id": ObjectId(product_id), "stock_shards": {"$exists": True}, "stock_shards_pending": {"$exists": False}},
+                {"$unset": {"stock_shards": ""}, "$set": {"stock": 0, "updated_at": datetime.utcnow()}},
+                projection={"_id": 1},
+                session=session
+            )
+            if product is None:
+                return None
+            stock = await self.stock_shards.drain(product_id, session=session)
+            await self.collection.update_one(
+                {"_id": ObjectId(product_id)},
+                {
+                    "$inc": {"stock": stock},
+                    "$set": {"reserved": await self._held(product_id, session), "updated_at": datetime.utcnow()}
+                },
+                session=session
+            )
+            return stock
+
+        stock = await db.run_in_transaction(disable)
+        if stock is not None:
+            sharded_products.set(product_id, 0)
+            catalog_cache.invalidate(product_id)
+            facet_cache.mark_dirty()
+        return stock
+
+    async def _held(self, product_id: str, session=None) -> int:
+        """Units of the product held by cart reservations (a scan, for the rare disable_stock_shards)"""
+        cursor = db.get_collection("reservations").aggregate(
+            [{"$match": {"product_id": product_id}}, {"$group": {"_id": None, "quantity": {"$sum": "$quantity"}}}],
+            session=session
+        )
+        rows = await cursor.to_list(length=1)
+        return rows[0]["quantity"] if rows else 0
+
+    async def reconcile_stock_shards(self) -> List[dict]:
+        """
+        Refresh sharded_products, finish conversions enable_stock_shards left
+        half done, rebalance every sharded product's shards and write their
+        total to the product's `stock` so listings show it. Returns
+        {product_id, shards, stock} for each sharded product.
+        """
+        cursor = self.collection.find(
+            {"stock_shards": {"$gt": 0}}, {"stock_shards": 1, "stock_shards_pending": 1, "stock": 1}
+        )
+        products = [product async for product in cursor]
+        shards = {str(product["_id"]): product["stock_shards"] for product in products}
+        sharded_products.replace(shards)
+
+        stale = datetime.utcnow() - timedelta(seconds=TRANSFER_REPAIR_AFTER_SECONDS)
+        report = []
+        for product in products:
+            product_id, count = str(product["_id"]), product["stock_shards"]
+            if "stock_shards_pending" in product:
+                if product["stock_shards_pending"] >= stale:
+                    # Still being converted; its document stock is the source of the shards
+                    continue
+                await self.stock_shards.create_missing(product_id, count, product.get("stock", 0))
+                await self.collection.update_one(
+                    {"_id": product["_id"]}, {"$unset": {"stock_shards_pending": ""}}
+                )
+            stock = await self.stock_shards.rebalance(product_id)
+            previous = await self.collection.find_one_and_update(
+                {
+                    "_id": ObjectId(product_id),
+                    "stock_shards": {"$exists": True},
+                    "stock_shards_pending": {"$exists": False},
+                    "stock": {"$ne": stock}
+                },
+                # updated_at feeds the ETag and Last-Modified, so a new total is never answered with a 304
+                {"$set": {"stock": stock, "updated_at": datetime.utcnow()}},
+                projection={"stock": 1}
+            )
+            if previous is not None:
+                catalog_cache.invalidate(product_id)
+                if (previous.get("stock", 0) > 0) != (stock > 0):
+                    facet_cache.mark_dirty()
+            report.append({"product_id": product_id, "shards": count, "stock": stock})
+        return report
+
+    async def import_batch(self, products: List[dict]) -> Tuple[Dict[str, int], Dict[int, str]]:
+        """
+        Write a batch of validated products with one unordered bulk_write:
+        products with a SKU are upserted by it, the others are inserted
+        (the same batched insert insert_many(ordered=False) sends). A failing
+        row does not stop the rest. Returns the write counts and an error
+        message per failed index of `products`. SKUs must be unique within
+        the batch.
+
+        An imported `stock` counts every unit on hand: an existing product
+        keeps the units its cart reservations hold, and only the rest
+        becomes its stock. A sharded product's document stock is left to
+        the reconciler and the rest goes into its shards instead.
+        """
+        now = datetime.utcnow()
+        operations = []
+        sharded_stock: Dict[str, int] = {}
+        for product in products:
+            if product.get("sku"):
+                fields = {key: {"$literal": value} for key, value in product.items() if key != "stock"}
+                if "stock" in product:
+                    sharded_stock[product["sku"]] = product["stock"]
+                    fields["stock"] = {"$cond": [
+                        {"$gt": ["$stock_shards", 0]},
+                        "$stock",
+                        {"$max": [0, {"$subtract": [product["stock"], {"$ifNull": ["$reserved", 0]}]}]}
+                    ]}
+                operations.append(UpdateOne(
+                    {"sku": product["sku"]},
+                    # A pipeline, so stock can depend on the document; the values are $literal
+                    [{"$set": {**fields, "updated_at": now, "created_at": {"$ifNull": ["$created_at", now]}}}],
+                    upsert=True
+                ))
+            else:
+                operations.append(InsertOne({**product, "created_at": now, "updated_at": now}))
+
+        errors: Dict[int, str] = {}
+        try:
+            result = (await self.collection.bulk_write(operations, ordered=False)).bulk_api_result
+        except BulkWriteError as exc:
+            result = exc.details
+            for error in result.get("writeErrors", []):
+                errors[error["index"]] = error.get("errmsg", "write failed")
+        finally:
+            catalog_cache.invalidate()
+            facet_cache.mark_dirty()
+
+        if sharded_stock:
+            cursor = self.collection.find(
+                {"sku": {"$in": list(sharded_stock)}, "stock_shards": {"$gt": 0}}, {"sku": 1, "stock_shards": 1}
+            )
+            async for product in cursor:
+                product_id = str(product["_id"])
+                stock = max(0, sharded_stock[product["sku"]] - await self._held(product_id))
+                await self.stock_shards.reset(product_id, product["stock_shards"], stock)
+
+        counts = {
+            "inserted": result.get("nInserted", 0),
+            "upserted": result.get("nUpserted", 0),
+            "updated": result.get("nMatched", 0),
+        }
+        return counts, errors
+
+    async def compute_facets(self) -> dict:
+        """Category and brand counts, in-stock counts and price range in one $facet aggregation"""
+        in_stock = {"$sum": {"$cond": [{"$gt": ["$stock", 0]}, 1, 0]}}
+        pipeline = [
+            {"$project": {"category": 1, "brand": 1, "price": 1, "stock": 1}},
+            {"$facet": {
+                "categories": [{"$group": {"_id": "$category", "count": {"$sum": 1}, "in_stock": in_stock}}],
+                "brands": [{"$group": {"_id": "$brand", "count": {"$sum": 1}, "in_stock": in_stock}}],
+                "totals": [{"$group": {
+                    "_id": None,
+                    "total": {"$sum": 1},
+                    "in_stock": in_stock,
+                    "min": {"$min": "$price"},
+                    "max": {"$max": "$price"},
+                }}],
+            }},
+        ]
+        result = (await self.collection.aggregate(pipeline).to_list(length=1))[0]
+        totals = result["totals"][0] if result["totals"] else {"total": 0, "in_stock": 0, "min": None, "max": None}
+        return {
+            "total": totals["total"],
+            "in_stock": totals["in_stock"],
+            "price": {"min": totals["min"], "max": totals["max"]},
+            **{
+                group: {row["_id"]: {"count": row["count"], "in_stock": row["in_stock"]} for row in result[group]}
+                for group in ("categories", "brands")
+            },
+        }
+
+    async def get_facets(self) -> dict:
+        """Catalog facets from the in-memory facet cache"""
+        await facet_cache.get(self.compute_facets)
+        return facet_cache.snapshot()
@@ -0,0 +1,310 @@
+"""
+Stock reservations for cart items.
+
+Adding to the cart moves the quantity from a product's `stock` to its
+`reserved` counter and records a reservation for (user, product) that
+expires settings.reservation_ttl_seconds after the last change. Placing an
+order consumes the user's reservations; ReservationSweeper gives expired
+ones back to `stock` in batches.
+
+Expiry goes through a plain index on expires_at rather than a Mongo TTL
+index: a TTL delete would drop the reservation without returning its
+quantity to the product.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.config import settings
+from app.database import db
+from app.models.product import ProductModel
+from app.utils.indexes import register_indexes, register_query
+from app.utils.metrics import registry
+
+register_indexes(
+    "reservations",
+    IndexModel([("user_id", ASCENDING), ("product_id", ASCENDING)], unique=True, name="user_id_product_id"),
+    IndexModel([("expires_at", ASCENDING)], name="expires_at")
+)
+register_query("reservations", "get_user_reservations", {"user_id": "probe", "product_id": {"$in": ["probe"]}})
+register_query("reservations", "find_expired", {"expires_at": {"$lte": datetime(2000, 1, 1)}}, sort={"expires_at": 1})
+
+RESERVATIONS_EXPIRED = registry.counter(
+    "reservations_expired_total", "Expired cart reservations released by the sweeper"
+)
+
+
+class _HoldChanged(Exception):
+    """The reservation changed between reading and updating it"""
+
+
+def reserved_quantities(reservations: List[Dict]) -> Dict[str, int]:
+    return {reservation["product_id"]: reservation["quantity"] for reservation in reservations}
+
+
+class ReservationModel:
+    def __init__(self):
+        self.collection = db.get_collection("reservations")
+        self.product_model = ProductModel()
+
+    def _expires_at(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=settings.reservation_ttl_seconds)
+
+    async def reserve(self, user_id: str, product_id: str, quantity: int) -> bool:
+        """
+        Hold `quantity` more units of a product for the user and push the
+        reservation's expiry back. Returns False, holding nothing, if there
+        is not enough stock.
+        """
+        async def hold(session):
+            if not await self.product_model.reserve_stock(product_id, quantity, session=session):
+                return False
+            try:
+                await self.collection.update_one(
+                    {"user_id": user_id, "product_id": product_id},
+                    {
+                        "$inc": {"quantity": quantity},
+                        "$set": {"expires_at": self._expires_at()},
+                        "$setOnInsert": {"created_at": datetime.now(timezone.utc)}
+                    },
+                    upsert=True,
+                    session=session
+                )
+            except Exception:
+                if session is None:
+                    await self.product_model.release_reserved({product_id: quantity})
+                raise
+            return True
+
+        return await db.run_in_transaction(hold)
+
+    async def set_quantity(self, user_id: str, product_id: str, quantity: int) -> bool:
+        """
+        Make the user's reservation for a product exactly `quantity` (0
+        releases it). Returns False if growing it needs more stock than is
+        left. The reservation is only changed if it still holds what was
+        read, so concurrent updates of the same cart line are applied one
+        after the other instead of both applying their delta.
+        """
+        key = {"user_id": user_id, "product_id": product_id}
+        while True:
+            current = await self.collection.find_one(key, {"quantity": 1})
+            held = current["quantity"] if current else 0
+            if quantity == held:
+                return True
+            # A missing reservation must still be missing: the upsert then hits the unique index
+            expected = {**key, "quantity": held} if current else {**key, "quantity": {"$exists": False}}
+
+            async def change(session):
+                if quantity > held and not await self.product_model.reserve_stock(
+                    product_id, quantity - held, session=session
+                ):
+                    return False
+                try:
+                    if quantity == 0:
+                        result = await self.collection.delete_one(expected, session=session)
+                        changed = result.deleted_count == 1
+                    else:
+                        result = await self.collection.update_one(
+                            expected,
+                            {
+                                "$set": {"quantity": quantity, "expires_at": self._expires_at()},
+                                "$setOnInsert": {"created_at": datetime.now(timezone.utc)}
+                            },
+                            upsert=current is None,
+                            session=session
+                        )
+                        changed = result.matched_count == 1 or result.upserted_id is not None
+                    if not changed:
+                        raise _HoldChanged()
+                except (_HoldChanged, DuplicateKeyError):
+                    if session is None and quantity > held:
+                        await self.product_model.release_reserved({product_id: quantity - held})
+                    raise _HoldChanged()
+                if quantity < held:
+                    try:
+                        await self.product_model.release_reserved({product_id: held - quantity}, session=session)
+                    except Exception:
+                        if session is None:
+                            await self.restore([{**key, "quantity": held - quantity, "expires_at": self._expires_at()}])
+                        raise
+                return True
+
+            try:
+                return await db.run_in_transaction(change)
+            except _HoldChanged:
+                continue
+
+    async def release(self, user_id: str, product_id: str, quantity: Optional[int] = None) -> int:
+        """
+        Give back `quantity` units (all by default) of a reservation, or as
+        many as it still holds if that is fewer (the sweeper or an order may
+        have taken some). Returns the units released. The reservation and
+        the product's reserved counter change in one transaction.
+        """
+        key = {"user_id": user_id, "product_id": product_id}
+
+        async def give_back(session):
+            if quantity is None:
+                reservation = await self.collection.find_one_and_delete(key, session=session)
+                released = reservation["quantity"] if reservation else 0
+            else:
+                reservation = await self.collection.find_one_and_update(
+                    {**key, "quantity": {"$gt": 0}},
+                    [{"$set": {"quantity": {"$max": [0, {"$subtract": ["$quantity", quantity]}]}}}],
+                    return_document=ReturnDocument.BEFORE,
+                    session=session
+                )
+                released = min(reservation["quantity"], quantity) if reservation else 0
+                if reservation and reservation["quantity"] <= quantity:
+                    await self.collection.delete_one(
+                        {"_id": reservation["_id"], "quantity": {"$lte": 0}}, session=session
+                    )
+            if released:
+                try:
+                    await self.product_model.release_reserved({product_id: released}, session=session)
+                except Exception:
+                    if session is None:
+                        # No transaction to abort: hold the units again rather than leave them stranded
+                        await self.restore([{**reservation, "quantity": released}])
+                    raise
+            return released
+
+        return await db.run_in_transaction(give_back)
+
+    async def release_all(self, user_id: str) -> int:
+        """Release every reservation of a user, e.g. when the cart is cleared"""
+        reservations = await self.collection.find({"user_id": user_id}, {"_id": 1}).to_list(length=None)
+        return await self._release_by_ids([reservation["_id"] for reservation in reservations])
+
+    async def held(self, user_id: str, product_ids: List[str], session=None) -> Dict[str, int]:
+        """Quantity the user holds per product"""
+        cursor = self.collection.find(
+            {"user_id": user_id, "product_id": {"$in": product_ids}},
+            {"product_id": 1, "quantity": 1},
+            session=session
+        )
+        return reserved_quantities(await cursor.to_list(length=None))
+
+    async def take(self, user_id: str, product_ids: List[str], session=None) -> List[Dict]:
+        """
+        Remove the user's reservations for these products and return them, so
+        an order can consume their quantity. Inside a transaction a find and a
+        delete_many suffice; without one each reservation is claimed with
+        find_one_and_delete so the sweeper cannot release it at the same time.
+        """
+        query = {"user_id": user_id, "product_id": {"$in": product_ids}}
+        if session is not None:
+            reservations = await self.collection.find(query, session=session).to_list(length=None)
+            if reservations:
+                await self.collection.delete_many(
+                    {"_id": {"$in": [reservation["_id"] for reservation in reservations]}}, session=session
+                )
+            return reservations
+
+        candidates = await self.collection.find(query, {"_id": 1}).to_list(length=None)
+        claimed = await asyncio.gather(*[
+            self.collection.find_one_and_delete({"_id": candidate["_id"]}) for candidate in candidates
+        ])
+        return [reservation for reservation in claimed if reservation is not None]
+
+    async def restore(self, reservations: List[Dict]) -> None:
+        """Put reservations returned by take() back (their quantities are still counted as reserved)"""
+        for reservation in reservations:
+            await self.collection.update_one(
+                {"user_id": reservation["user_id"], "product_id": reservation["product_id"]},
+                {
+                    "$inc": {"quantity": reservation["quantity"]},
+                    "$max": {"expires_at": reservation["expires_at"]},
+                    "$setOnInsert": {"created_at": reservation.get("created_at")}
+                },
+                upsert=True
+            )
+
+    async def _release_by_ids(self, reservation_ids: List[ObjectId], expired_before: Optional[datetime] = None) -> int:
+        """
+        Delete reservations and give their quantities back to stock in one
+        bulk write, in one transaction. Without one each reservation is
+        claimed with find_one_and_delete, and put back if the stock write fails.
+        """
+        query = {"_id": {"$in": reservation_ids}}
+        if expired_before:
+            query["expires_at"] = {"$lte": expired_before}
+
+        async def give_back(session):
+            if session is not None:
+                claimed = await self.collection.find(query, session=session).to_list(length=None)
+                if claimed:
+                    await self.collection.delete_many(
+                        {"_id": {"$in": [reservation["_id"] for reservation in claimed]}}, session=session
+                    )
+            else:
+                claimed = await asyncio.gather(*[
+                    self.collection.find_one_and_delete({**query, "_id": reservation_id})
+                    for reservation_id in reservation_ids
+                ])
+                claimed = [reservation for reservation in claimed if reservation is not None]
+            quantities: Dict[str, int] = {}
+            for reservation in claimed:
+                quantities[reservation["product_id"]] = quantities.get(reservation["product_id"], 0) + reservation["quantity"]
+            try:
+                await self.product_model.release_reserved(quantities, session=session)
+            except Exception:
+                if session is None:
+                    await self.restore(claimed)
+                raise
+            return len(claimed)
+
+        return await db.run_in_transaction(give_back)
+
+    async def release_expired(self, batch_size: int) -> int:
+        """Release up to `batch_size` expired reservations found through the expires_at index"""
+        now = datetime.now(timezone.utc)
+        expired = await (
+            self.collection.find({"expires_at": {"$lte": now}}, {"_id": 1})
+            .sort("expires_at", ASCENDING)
+            .limit(batch_size)
+            .to_list(length=batch_size)
+        )
+        if not expired:
+            return 0
+        return await self._release_by_ids([reservation["_id"] for reservation in expired], expired_before=now)
+
+
+class ReservationSweeper:
+    """Background task, started and stopped by the app lifespan, that releases expired reservations"""
+
+    def __init__(self, model: Optional[ReservationModel] = None):
+        self.model = model or ReservationModel()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        batch_size = settings.reservation_sweep_batch_size
+        while not self._stopping.is_set():
+            try:
+                released = await self.model.release_expired(batch_size)
+                RESERVATIONS_EXPIRED.inc(amount=released)
+            except Exception as e:
+                print(f"Reservation sweep failed: {e}")
+                released = 0
+            # A full batch means there is a backlog: keep going without waiting
+            if released < batch_size:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=settings.reservation_sweep_interval_seconds)
+                except asyncio.TimeoutError:
+                    pass
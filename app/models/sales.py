@@ -0,0 +1,227 @@
+"""
+Hourly and daily sales rollups.
+
+One document per (granularity, start) period in `sales_rollups` holds the
+revenue, order count and units of the orders created in it, plus units and
+revenue per product and per category. A record_sales job updates an order's
+two periods with $inc after it is created or cancelled, outside the order's
+transaction, so dashboards read a handful of small documents instead of
+aggregating `orders`. backfill() rebuilds the rollups
+from `orders` with an aggregation pipeline:
+
+    python -m app.models.sales [--start 2024-01-01] [--end 2024-02-01]
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from pymongo import ASCENDING, IndexModel, UpdateOne
+
+from app.database import db
+from app.utils.indexes import register_indexes, register_query
+
+GRANULARITIES = ("hour", "day")
+UNCATEGORIZED = "uncategorized"
+
+register_indexes(
+    "sales_rollups",
+    IndexModel([("granularity", ASCENDING), ("start", ASCENDING)], unique=True, name="granularity_start")
+)
+register_query(
+    "sales_rollups", "get_rollups",
+    {"granularity": "day", "start": {"$gte": datetime(2000, 1, 1)}},
+    sort={"start": 1}
+)
+
+# Product ids and category names become field names, where "." and "$" would
+# be read as paths and operators, so they are swapped for their full-width forms
+_KEY_ESCAPES = {".": "．", "$": "＄"}
+
+
+def _encode_key(name: str) -> str:
+    for char, escaped in _KEY_ESCAPES.items():
+        name = name.replace(char, escaped)
+    return name
+
+
+def _decode_key(name: str) -> str:
+    for char, escaped in _KEY_ESCAPES.items():
+        name = name.replace(escaped, char)
+    return name
+
+
+def _as_utc(moment: datetime) -> datetime:
+    """Naive UTC, the way pymongo returns stored datetimes"""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def period_start(moment: datetime, granularity: str) -> datetime:
+    moment = _as_utc(moment).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == "day" else moment
+
+
+def _order_increments(order: dict, sign: int) -> Dict[str, float]:
+    increments = {
+        "orders": sign,
+        "revenue": sign * order.get("total_price", 0),
+        "units": 0,
+    }
+    for item in order.get("order_items", []):
+        units = sign * item["quantity"]
+        revenue = units * item["price"]
+        increments["units"] += units
+        for group, key in (("products", item["product_id"]), ("categories", item.get("category") or UNCATEGORIZED)):
+            prefix = f"{group}.{_encode_key(key)}"
+            increments[f"{prefix}.units"] = increments.get(f"{prefix}.units", 0) + units
+            increments[f"{prefix}.revenue"] = increments.get(f"{prefix}.revenue", 0) + revenue
+    return increments
+
+
+def _decode_rollup(doc: dict) -> dict:
+    doc.pop("_id", None)
+    for group in ("products", "categories"):
+        doc[group] = {_decode_key(key): value for key, value in doc.get(group, {}).items()}
+    return doc
+
+
+class SalesRollupModel:
+    def __init__(self):
+        self.collection = db.get_collection("sales_rollups")
+
+    async def record_order(self, order: dict, session=None, sign: int = 1) -> None:
+        """
+        Add an order to the hourly and daily rollups of its created_at (one
+        bulk_write). sign=-1 takes it out again, e.g. when it is cancelled.
+        """
+        increments = _order_increments(order, sign)
+        await self.collection.bulk_write(
+            [
+                UpdateOne(
+                    {"granularity": granularity, "start": period_start(order["created_at"], granularity)},
+                    {"$inc": increments},
+                    upsert=True
+                )
+                for granularity in GRANULARITIES
+            ],
+            ordered=False,
+            session=session
+        )
+
+    async def get_rollups(self, granularity: str, start: datetime, end: datetime) -> List[dict]:
+        """Rollup documents for the periods starting in [start, end), oldest first"""
+        cursor = self.collection.find(
+            {"granularity": granularity, "start": {"$gte": start, "$lt": end}}
+        ).sort("start", ASCENDING)
+        return [_decode_rollup(doc) async for doc in cursor]
+
+    async def backfill(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[str, int]:
+        """
+        Rebuild the rollups of [start, end), widened to whole days, from
+        `orders`. Run it while no orders are being placed in that range; live
+        $inc updates that land during the rebuild can be overwritten. Needs
+        MongoDB 5.0+ ($dateTrunc).
+        """
+        if start:
+            start = period_start(start, "day")
+        if end:
+            day = period_start(end, "day")
+            end = day if day == _as_utc(end) else day + timedelta(days=1)
+        orders = db.get_collection("orders")
+        match: Dict = {"status": {"$ne": "cancelled"}}
+        created_at = {}
+        if start:
+            created_at["$gte"] = start
+        if end:
+            created_at["$lt"] = end
+        if created_at:
+            match["created_at"] = created_at
+
+        rebuilt = {}
+        for granularity in GRANULARITIES:
+            period_filter: Dict = {"granularity": granularity}
+            if created_at:
+                period_filter["start"] = created_at
+            await self.collection.delete_many(period_filter)
+
+            with_period = [
+                {"$match": match},
+                {"$project": {
+                    "start": {"$dateTrunc": {"date": "$created_at", "unit": granularity}},
+                    "total_price": 1,
+                    "order_items": 1,
+                }},
+            ]
+            merge = {
+                "$merge": {
+                    "into": "sales_rollups",
+                    "on": ["granularity", "start"],
+                    "whenMatched": "merge",
+                    "whenNotMatched": "insert",
+                }
+            }
+            # Order totals first, then the per-product and per-category breakdowns
+            await orders.aggregate(with_period + [
+                {"$group": {
+                    "_id": "$start",
+                    "orders": {"$sum": 1},
+                    "revenue": {"$sum": "$total_price"},
+                    "units": {"$sum": {"$sum": "$order_items.quantity"}},
+                }},
+                {"$project": {"_id": 0, "granularity": {"$literal": granularity}, "start": "$_id",
+                              "orders": 1, "revenue": 1, "units": 1}},
+                merge,
+            ]).to_list(length=None)
+            for group, key in (("products", "$order_items.product_id"),
+                               ("categories", {"$ifNull": ["$order_items.category", UNCATEGORIZED]})):
+                await orders.aggregate(with_period + [
+                    {"$unwind": "$order_items"},
+                    {"$group": {
+                        "_id": {"start": "$start", "key": key},
+                        "units": {"$sum": "$order_items.quantity"},
+                        "revenue": {"$sum": {"$multiply": ["$order_items.quantity", "$order_items.price"]}},
+                    }},
+                    {"$group": {
+                        "_id": "$_id.start",
+                        "entries": {"$push": {
+                            "k": {"$replaceAll": {
+                                "input": {"$replaceAll": {"input": "$_id.key", "find": ".", "replacement": "．"}},
+                                "find": {"$literal": "$"}, "replacement": "＄",
+                            }},
+                            "v": {"units": "$units", "revenue": "$revenue"},
+                        }},
+                    }},
+                    {"$project": {"_id": 0, "granularity": {"$literal": granularity}, "start": "$_id",
+                                  group: {"$arrayToObject": "$entries"}}},
+                    merge,
+                ]).to_list(length=None)
+            rebuilt[granularity] = await self.collection.count_documents(period_filter)
+
+        # What the rollups now hold, so record_sales jobs do not count these orders again
+        for counted, status in ((True, {"$ne": "cancelled"}), (False, "cancelled")):
+            await orders.update_many({**match, "status": status}, {"$set": {"sales_counted": counted}})
+        return rebuilt
+
+
+def _parse_date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+async def _main(start: Optional[datetime], end: Optional[datetime]) -> None:
+    await db.connect()
+    try:
+        rebuilt = await SalesRollupModel().backfill(start, end)
+    finally:
+        await db.disconnect()
+    for granularity, count in rebuilt.items():
+        print(f"{granularity:5} {count} periods")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the sales rollups from orders")
+    parser.add_argument("--start", type=_parse_date)
+    parser.add_argument("--end", type=_parse_date)
+    args = parser.parse_args()
+    asyncio.run(_main(args.start, args.end))
@@ -0,0 +1,150 @@
+"""
+Revocation of stateless access tokens.
+
+With settings.stateless_auth, access tokens carry the user's claims and
+their token_version, and get_current_user trusts them without reading the
+users collection. Revoking a user's tokens increments token_version and
+records (user_id, version) in token_revocations: every token with a lower
+version is revoked. Each worker keeps those pairs in memory and pulls new
+ones every settings.token_revocation_refresh_seconds. A pair only matters
+while tokens issued before it can still be valid, so the records expire
+after the token lifetime and the set stays small; a plain dict is already
+compact at that size, with no false positives as a Bloom filter would have.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+
+from app.config import settings
+from app.database import db
+from app.utils.indexes import register_indexes, register_query
+
+# Revocations outlive every token issued before them, with a minute of clock skew
+REVOCATION_RETENTION_SECONDS = settings.access_token_expire_minutes * 60 + 60
+
+register_indexes(
+    "token_revocations",
+    IndexModel(
+        [("revoked_at", ASCENDING)],
+        expireAfterSeconds=REVOCATION_RETENTION_SECONDS,
+        name="revoked_at_ttl"
+    )
+)
+register_query("token_revocations", "revocations_since", {"revoked_at": {"$gt": datetime(2000, 1, 1)}})
+
+
+class RevocationSet:
+    """user_id -> lowest token_version still valid, as last pulled by this worker"""
+
+    def __init__(self):
+        self.min_version: Dict[str, int] = {}
+        self.revoked_at: Dict[str, datetime] = {}
+        self.refreshed_until: Optional[datetime] = None
+
+    def is_revoked(self, user_id: str, version: int) -> bool:
+        return version < self.min_version.get(user_id, 0)
+
+    def add(self, user_id: str, version: int, revoked_at: datetime) -> None:
+        if version > self.min_version.get(user_id, 0):
+            self.min_version[user_id] = version
+            self.revoked_at[user_id] = revoked_at
+
+    def prune(self, now: datetime) -> None:
+        """Forget revocations older than any token that could still be valid"""
+        cutoff = now - timedelta(seconds=REVOCATION_RETENTION_SECONDS)
+        for user_id in [user_id for user_id, at in self.revoked_at.items() if at < cutoff]:
+            del self.min_version[user_id]
+            del self.revoked_at[user_id]
+
+    def __len__(self) -> int:
+        return len(self.min_version)
+
+
+token_revocations = RevocationSet()
+
+
+class TokenRevocationModel:
+    def __init__(self):
+        self.collection = db.get_collection("token_revocations")
+        self.users = db.get_collection("users")
+
+    async def revoke_user_tokens(self, user_id: str) -> Optional[int]:
+        """
+        Revoke every token issued to the user so far. Returns the new
+        token_version, or None if the user does not exist.
+        """
+        user = await self.users.find_one_and_update(
+            {"_id": ObjectId(user_id)},
+            {"$inc": {"token_version": 1}},
+            projection={"token_version": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if user is None:
+            return None
+        await self.record(user_id, user["token_version"])
+        return user["token_version"]
+
+    async def record(self, user_id: str, version: int) -> None:
+        """Revoke the user's tokens with a version below `version` (all workers see it on their next refresh)"""
+        now = datetime.now(timezone.utc)
+        await self.collection.update_one(
+            {"_id": user_id},
+            {"$max": {"version": version}, "$set": {"revoked_at": now}},
+            upsert=True
+        )
+        token_revocations.add(user_id, version, now)
+
+    async def refresh(self, revocations: RevocationSet = token_revocations) -> int:
+        """Pull the revocations recorded since the last refresh. Returns how many were read."""
+        now = datetime.now(timezone.utc)
+        query = {}
+        if revocations.refreshed_until is not None:
+            # Overlap a little so a write racing the previous refresh is not missed
+            query = {"revoked_at": {"$gt": revocations.refreshed_until - timedelta(seconds=5)}}
+        count = 0
+        async for record in self.collection.find(query):
+            revoked_at = record["revoked_at"]
+            if revoked_at.tzinfo is None:
+                revoked_at = revoked_at.replace(tzinfo=timezone.utc)
+            revocations.add(record["_id"], record["version"], revoked_at)
+            count += 1
+        revocations.refreshed_until = now
+        revocations.prune(now)
+        return count
+
+
+class RevocationRefresher:
+    """Background task, started and stopped by the app lifespan in stateless_auth mode"""
+
+    def __init__(self, model: Optional[TokenRevocationModel] = None):
+        self.model = model or TokenRevocationModel()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def start(self) -> None:
+        # Load the full set before the first request is served
+        await self.model.refresh()
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=settings.token_revocation_refresh_seconds)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping.is_set():
+                return
+            try:
+                await self.model.refresh()
+            except Exception as e:
+                print(f"Token revocation refresh failed: {e}")
@@ -2,7 +2,27 @@ from datetime import datetime,timezone,UTC
 from unittest import result
 from bson import ObjectId
 from app.Schemas import user
+from app.config import settings
 from app.database import db
+from app.models.token_revocation import TokenRevocationModel
+from app.utils.cache import TTLCache
+from app.utils.indexes import register_indexes, register_query
+from pymongo import ASCENDING, IndexModel
+
+register_indexes(
+  "users",
+  IndexModel([("email", ASCENDING)], unique=True, name="email_unique")
+)
+register_query("users", "get_user_by_email", {"email": "probe@example.com"})
+
+# Authenticated users resolved by get_current_user, keyed by user id (token "sub")
+user_cache = TTLCache(
+  max_size=settings.user_cache_max_size,
+  ttl=settings.user_cache_ttl_seconds
+)
+
+# Fields embedded in stateless access tokens (see app.utils.security.user_claims)
+TOKEN_CLAIM_FIELDS = {"email", "username", "full_name", "is_admin", "created_at"}
 
 class UserModel:
   def __init__(self):
@@ -37,12 +57,19 @@ class UserModel:
     result = await self.collection.update_one(
       {"_id": ObjectId(user_id)}, {"$set": update_data}
     )
+    user_cache.invalidate(user_id)
+    if settings.stateless_auth and result.modified_count and TOKEN_CLAIM_FIELDS & set(update_data):
+      # Tokens carry these fields; the old ones must stop being trusted
+      await TokenRevocationModel().revoke_user_tokens(user_id)
     return result.modified_count > 0
 
   async def delete_user(self,user_id:str) -> bool:
-    result = await self.collection.delete_one(
-      {"_id":ObjectId(user_id)}
+    deleted = await self.collection.find_one_and_delete(
+      {"_id":ObjectId(user_id)}, projection={"token_version": 1}
     )
-    return result.deleted_count > 0
+    user_cache.invalidate(user_id)
+    if deleted is not None and settings.stateless_auth:
+      await TokenRevocationModel().record(user_id, deleted.get("token_version", 0) + 1)
+    return deleted is not None
 
 
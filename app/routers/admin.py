@@ -0,0 +1,249 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from typing import Literal, Optional
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from app.config import settings
+from app.models.job import JobModel
+from app.models.order import OrderModel
+from app.models.product import ProductModel
+from app.models.sales import SalesRollupModel, period_start
+from app.models.token_revocation import TokenRevocationModel
+from app.Schemas.order import OrderStatus
+from app.utils.dependencies import get_admin_user
+from app.utils.query_stats import query_stats
+from app.utils.serialization import stream_orders_csv, stream_orders_ndjson
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Default window and the most periods one dashboard request may read
+SALES_DEFAULT_WINDOW = {"hour": timedelta(hours=48), "day": timedelta(days=30)}
+SALES_MAX_PERIODS = 5000
+
+
+async def get_order_model():
+  return OrderModel()
+
+async def get_sales_model():
+  return SalesRollupModel()
+
+async def get_product_model():
+  return ProductModel()
+
+async def get_job_model():
+  return JobModel()
+
+
+async def sales_window(
+  granularity: Literal["hour", "day"] = "day",
+  start: Optional[datetime] = None,
+  end: Optional[datetime] = None
+):
+  end = end or datetime.utcnow()
+  start = period_start(start or end - SALES_DEFAULT_WINDOW[granularity], granularity)
+  step = timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+  if (period_start(end, granularity) - start) / step > SALES_MAX_PERIODS:
+    raise HTTPException(
+      status_code=status.HTTP_400_BAD_REQUEST,
+      detail=f"At most {SALES_MAX_PERIODS} {granularity} periods per request"
+    )
+  return granularity, start, end
+
+
+@router.get("/query-stats")
+async def get_query_stats(
+  limit: Optional[int] = Query(None, ge=1, le=1000),
+  current_user: dict = Depends(get_admin_user)
+):
+  """Mongo commands aggregated by shape, the most total time first"""
+  return {
+    "slow_query_ms": settings.slow_query_ms,
+    "commands": query_stats.table(limit)
+  }
+
+
+@router.delete("/query-stats")
+async def reset_query_stats(current_user: dict = Depends(get_admin_user)):
+  query_stats.reset()
+  return {"message": "Query stats reset"}
+
+
+@router.get("/jobs")
+async def get_job_counts(
+  current_user: dict = Depends(get_admin_user),
+  job_model: JobModel = Depends(get_job_model)
+):
+  """Background jobs by status (pending, running, done, failed)"""
+  return await job_model.counts()
+
+
+@router.post("/users/{user_id}/revoke-tokens")
+async def revoke_user_tokens(user_id: str, current_user: dict = Depends(get_admin_user)):
+  """Invalidate every stateless access token issued to the user so far"""
+  if not ObjectId.is_valid(user_id):
+    raise HTTPException(
+      status_code=status.HTTP_404_NOT_FOUND,
+      detail="User not found"
+    )
+  version = await TokenRevocationModel().revoke_user_tokens(user_id)
+  if version is None:
+    raise HTTPException(
+      status_code=status.HTTP_404_NOT_FOUND,
+      detail="User not found"
+    )
+  return {"user_id": user_id, "token_version": version}
+
+
+@router.put("/products/{product_id}/stock-shards")
+async def enable_stock_shards(
+  product_id: str,
+  shards: int = Query(settings.stock_shard_default_count, ge=2, le=settings.stock_shard_max_count),
+  current_user: dict = Depends(get_admin_user),
+  product_model: ProductModel = Depends(get_product_model)
+):
+  """Flag a hot product: spread its stock over `shards` counters"""
+  if not ObjectId.is_valid(product_id):
+    raise HTTPException(
+      status_code=status.HTTP_404_NOT_FOUND,
+      detail="Product not found"
+    )
+  stock = await product_model.enable_stock_shards(product_id, shards)
+  if stock is None:
+    raise HTTPException(
+      status_code=status.HTTP_409_CONFLICT,
+      detail="Product not found or already sharded"
+    )
+  return {"product_id": product_id, "shards": shards, "stock": stock}
+
+
+@router.delete("/products/{product_id}/stock-shards")
+async def disable_stock_shards(
+  product_id: str,
+  current_user: dict = Depends(get_admin_user),
+  product_model: ProductModel = Depends(get_product_model)
+):
+  """Move a sharded product's stock back into its document"""
+  if not ObjectId.is_valid(product_id):
+    raise HTTPException(
+      status_code=status.HTTP_404_NOT_FOUND,
+      detail="Product not found"
+    )
+  stock = await product_model.disable_stock_shards(product_id)
+  if stock is None:
+    raise HTTPException(
+      status_code=status.HTTP_404_NOT_FOUND,
+      detail="Product is not sharded"
+    )
+  return {"product_id": product_id, "stock": stock}
+
+
+@router.get("/inventory/stock-shards")
+async def get_stock_shards(
+  current_user: dict = Depends(get_admin_user),
+  product_model: ProductModel = Depends(get_product_model)
+):
+  """Total stock of every sharded product, summed over its shards"""
+  totals = await product_model.stock_shards.totals()
+  return [{"product_id": product_id, "stock": stock} for product_id, stock in totals.items()]
+
+
+@router.post("/inventory/stock-shards/reconcile")
+async def reconcile_stock_shards(
+  current_user: dict = Depends(get_admin_user),
+  product_model: ProductModel = Depends(get_product_model)
+):
+  """Rebalance the shards and write the totals to the products now rather than at the next interval"""
+  return await product_model.reconcile_stock_shards()
+
+
+@router.get("/orders/export")
+async def export_orders(
+  format: Literal["ndjson", "csv"] = "ndjson",
+  start: Optional[datetime] = Query(None, description="created_at >= start"),
+  end: Optional[datetime] = Query(None, description="created_at < end"),
+  order_status: Optional[OrderStatus] = Query(None, alias="status"),
+  after_created_at: Optional[datetime] = Query(None, description="resume after this order's created_at"),
+  after_id: Optional[str] = Query(None, description="resume after this order's _id"),
+  current_user: dict = Depends(get_admin_user),
+  order_model: OrderModel = Depends(get_order_model)
+):
+  """
+  Stream every matching order, oldest first. If the download breaks off,
+  request it again with after_created_at/after_id of the last order received.
+  """
+  after = None
+  if after_created_at is not None or after_id is not None:
+    try:
+      if after_created_at is None:
+        raise InvalidId("after_created_at is missing")
+      after = {"created_at": after_created_at, "_id": ObjectId(after_id)}
+    except (InvalidId, TypeError):
+      raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="after_created_at and a valid after_id must be given together"
+      )
+
+  batch_size = settings.order_export_batch_size
+  orders = order_model.export_orders(
+    start=start,
+    end=end,
+    status=order_status.value if order_status else None,
+    after=after,
+    batch_size=batch_size
+  )
+  stream = stream_orders_csv if format == "csv" else stream_orders_ndjson
+  return StreamingResponse(
+    stream(orders, batch_size),
+    media_type=EXPORT_MEDIA_TYPES[format],
+    headers={"Content-Disposition": f'attachment; filename="orders.{format}"'}
+  )
+
+
+@router.get("/sales")
+async def get_sales(
+  window: tuple = Depends(sales_window),
+  current_user: dict = Depends(get_admin_user),
+  sales_model: SalesRollupModel = Depends(get_sales_model)
+):
+  """Revenue, orders and units per hour or day, read from the rollups only"""
+  granularity, start, end = window
+  periods = await sales_model.get_rollups(granularity, start, end)
+  totals = {
+    key: sum(period.get(key, 0) for period in periods)
+    for key in ("orders", "revenue", "units")
+  }
+  return {"granularity": granularity, "start": start, "end": end, "totals": totals, "periods": periods}
+
+
+@router.get("/sales/top")
+async def get_top_sellers(
+  by: Literal["products", "categories"] = "products",
+  limit: int = Query(10, ge=1, le=100),
+  window: tuple = Depends(sales_window),
+  current_user: dict = Depends(get_admin_user),
+  sales_model: SalesRollupModel = Depends(get_sales_model)
+):
+  """Best selling products or categories by revenue over the window"""
+  granularity, start, end = window
+  totals = {}
+  for period in await sales_model.get_rollups(granularity, start, end):
+    for key, values in period.get(by, {}).items():
+      entry = totals.setdefault(key, {"units": 0, "revenue": 0})
+      entry["units"] += values.get("units", 0)
+      entry["revenue"] += values.get("revenue", 0)
+  ranked = sorted(totals.items(), key=lambda item: item[1]["revenue"], reverse=True)[:limit]
+  return [{"key": key, **values} for key, values in ranked]
+
+
+@router.post("/sales/backfill")
+async def backfill_sales(
+  start: Optional[datetime] = None,
+  end: Optional[datetime] = None,
+  current_user: dict = Depends(get_admin_user),
+  sales_model: SalesRollupModel = Depends(get_sales_model)
+):
+  """Rebuild the rollups (whole days in [start, end), everything by default) from orders"""
+  return {"periods": await sales_model.backfill(start, end)}
@@ -1,12 +1,19 @@
 from os import access
 import token
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, Request, status, Depends
 from fastapi.security import HTTPBearer
 from app.models.user import UserModel
 from app.Schemas.user import UserCreate, UserResponse, UserLogin, Token
 from app.utils.dependencies import get_current_user
-from app.utils.security import verify_password, get_password_hash, create_access_token
+from app.utils.rate_limit import check_auth_rate_limit, retry_after_header
+from app.utils.security import (
+    PasswordHasherBusy,
+    create_access_token,
+    get_password_hash_async,
+    verify_password_async,
+)
 from datetime import timedelta
+from app.config import settings
 from app.database import db
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
@@ -24,8 +31,29 @@ def get_user_model():
             detail="Database connection error"
         )
 
+def password_hasher_busy():
+    """503 returned when the bcrypt pool is saturated"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication service is busy, please retry",
+        headers={"Retry-After": "1"}
+    )
+
+def too_many_attempts(retry_after: float):
+    """429 returned when an email or client IP ran out of attempts"""
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many attempts, please retry later",
+        headers={"Retry-After": retry_after_header(retry_after)}
+    )
+
 @router.post("/register", response_model= UserResponse)
-async def register(user: UserCreate, user_model: UserModel = Depends(get_user_model)):
+async def register(request: Request, user: UserCreate, user_model: UserModel = Depends(get_user_model)):
+  # Throttle before any database or bcrypt work
+  retry_after = await check_auth_rate_limit("register", request, user.email)
+  if retry_after:
+    raise too_many_attempts(retry_after)
+
   existing_user = await user_model.get_user_by_email(user.email)
   if existing_user:
     raise HTTPException(
@@ -34,7 +62,10 @@ async def register(user: UserCreate, user_model: UserModel = Depends(get_user_mo
     )
 
   user_data = user.model_dump()
-  user_data["password"] =get_password_hash(user.password)
+  try:
+    user_data["password"] = await get_password_hash_async(user.password)
+  except PasswordHasherBusy:
+    raise password_hasher_busy()
 
   user_id = await user_model.create_user(user_data)
   new_user = await user_model.get_user_by_id(user_id)
@@ -46,19 +77,33 @@ async def register(user: UserCreate, user_model: UserModel = Depends(get_user_mo
 
 @router.post("/login", response_model=Token)
 async def login(
+   request: Request,
    user_credentials: UserLogin,
    user_model: UserModel = Depends(get_user_model)):
 
+   # Throttle before the user lookup and bcrypt so a credential-stuffing burst stays cheap
+   retry_after = await check_auth_rate_limit("login", request, user_credentials.email)
+   if retry_after:
+      raise too_many_attempts(retry_after)
+
    user = await user_model.get_user_by_email(user_credentials.email)
-   if not user or not verify_password(user_credentials.password, user["password"]):
+   try:
+      password_ok = user is not None and await verify_password_async(
+         user_credentials.password, user["password"]
+      )
+   except PasswordHasherBusy:
+      raise password_hasher_busy()
+
+   if not password_ok:
       raise HTTPException(
          status_code=status.HTTP_401_UNAUTHORIZED,
          detail="incorrect user id or password"
       )
-   access_token_expire = timedelta(minutes= 30)
+   access_token_expire = timedelta(minutes=settings.access_token_expire_minutes)
    access_token = create_access_token(
     data={"sub":str(user["_id"])},
-    expires_delta=access_token_expire
+    expires_delta=access_token_expire,
+    user=user
     )
    user_dict = user.copy()
    user_dict["id"] = str(user_dict.pop("_id"))
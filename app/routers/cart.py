@@ -1,8 +1,12 @@
-from fastapi import APIRouter, HTTPException, status, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, status, Depends, Header
+from typing import List, Optional
 from app.models.cart import CartModel
+from app.models.checkout import CheckoutInProgress, CheckoutModel, CheckoutOrderMissing, EmptyCart
+from app.models.order import InsufficientStock, ProductNotFound
 from app.models.product import ProductModel
-from app.Schemas.cart import CartResponse, CartItemAdd, CartItemUpdate
+from app.models.reservation import ReservationModel
+from app.Schemas.cart import CartResponse, CartItemAdd, CartItemUpdate, CartCheckout
+from app.Schemas.order import OrderResponse
 from app.utils.dependencies import get_current_user
 
 router = APIRouter(prefix="/cart", tags=["cart"])
@@ -17,18 +21,22 @@ async def get_product_model():
 async def get_cart_model():
   return CartModel()
 
+
+async def get_checkout_model():
+  return CheckoutModel()
+
+
+async def get_reservation_model():
+  return ReservationModel()
+
 @router.get("/", response_model=CartResponse)
 async def get_cart(
     current_user: dict = Depends(get_current_user),
     cart_model: CartModel = Depends(get_cart_model)
     ):
     """Get current user's cart"""
-    cart = await cart_model.get_cart_by_user_id(current_user.id)
-
-    if not cart:
-        # Create cart if doesn't exist
-        await cart_model.create_cart(current_user.id)
-        cart = await cart_model.get_cart_by_user_id(current_user.id)
+    # Creates the cart if it doesn't exist yet
+    cart = await cart_model.get_or_create_cart(current_user.id)
 
     cart_dict = cart.copy()
     cart_dict["id"] = str(cart_dict.pop("_id"))
@@ -39,10 +47,11 @@ async def add_item_to_cart(
     item: CartItemAdd,
     product_model: ProductModel = Depends(get_product_model),
     current_user: dict = Depends(get_current_user),
-    cart_model: CartModel = Depends(get_cart_model)
+    cart_model: CartModel = Depends(get_cart_model),
+    reservation_model: ReservationModel = Depends(get_reservation_model)
 ):
-    """Add item to cart"""
-    # Verify product exists and has stock
+    """Add item to cart, reserving its stock until the reservation expires"""
+    # Verify product exists
     product = await product_model.get_product_by_id(item.product_id)
     if not product:
         raise HTTPException(
@@ -50,22 +59,25 @@ async def add_item_to_cart(
             detail="Product not found"
         )
 
-    if product["stock"] < item.quantity:
+    # Move the quantity from stock to reserved; fails if there is not enough stock
+    if not await reservation_model.reserve(current_user.id, item.product_id, item.quantity):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Insufficient stock"
         )
 
-    # Add to cart
-    await cart_model.add_item_to_cart(
-        current_user.id,
-        item.product_id,
-        item.quantity,
-        product["price"]
-    )
+    # Add to cart; the updated cart comes back from the same write
+    try:
+        cart = await cart_model.add_item_to_cart(
+            current_user.id,
+            item.product_id,
+            item.quantity,
+            product["price"]
+        )
+    except Exception:
+        await reservation_model.release(current_user.id, item.product_id, item.quantity)
+        raise
 
-    # Return updated cart
-    cart = await cart_model.get_cart_by_user_id(current_user.id)
     cart_dict = cart.copy()
     cart_dict["id"] = str(cart_dict.pop("_id"))
     return CartResponse(**cart_dict)
@@ -75,22 +87,37 @@ async def update_cart_item(
     product_id: str,
     item_update: CartItemUpdate,
     current_user: dict = Depends(get_current_user),
-    cart_model: CartModel = Depends(get_cart_model)
+    cart_model: CartModel = Depends(get_cart_model),
+    reservation_model: ReservationModel = Depends(get_reservation_model)
 ):
-    """Update item quantity in cart"""
-    updated = await cart_model.update_item_quantity(
+    """Update item quantity in cart, growing or shrinking its reservation to match"""
+    # Checked first so no stock is reserved for a product that is not in the cart
+    if not await cart_model.has_item(current_user.id, product_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Item not found in cart"
+        )
+
+    if not await reservation_model.set_quantity(current_user.id, product_id, max(item_update.quantity, 0)):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Insufficient stock"
+        )
+
+    cart = await cart_model.update_item_quantity(
         current_user.id,
         product_id,
         item_update.quantity
     )
 
-    if not updated:
+    if not cart:
+        # Removed from the cart meanwhile, so nothing may stay reserved for it
+        await reservation_model.release(current_user.id, product_id)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Item not found in cart"
         )
 
-    cart = await cart_model.get_cart_by_user_id(current_user.id)
     cart_dict = cart.copy()
     cart_dict["id"] = str(cart_dict.pop("_id"))
     return CartResponse(**cart_dict)
@@ -99,21 +126,22 @@ async def update_cart_item(
 async def remove_item_from_cart(
     product_id: str,
     current_user: dict = Depends(get_current_user),
-    cart_model: CartModel = Depends(get_cart_model)
+    cart_model: CartModel = Depends(get_cart_model),
+    reservation_model: ReservationModel = Depends(get_reservation_model)
 ):
-    """Remove item from cart"""
-    updated = await cart_model.remove_item_from_cart(
+    """Remove item from cart and release its reservation"""
+    cart = await cart_model.remove_item_from_cart(
         current_user.id,
         product_id
     )
+    await reservation_model.release(current_user.id, product_id)
 
-    if not updated:
+    if not cart:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Item not found in cart"
         )
 
-    cart = await cart_model.get_cart_by_user_id(current_user.id)
     cart_dict = cart.copy()
     cart_dict["id"] = str(cart_dict.pop("_id"))
     return CartResponse(**cart_dict)
@@ -121,33 +149,59 @@ async def remove_item_from_cart(
 @router.delete("/clear", response_model=dict)
 async def clear_cart(
     current_user: dict = Depends(get_current_user),
-    cart_model: CartModel = Depends(get_cart_model)
+    cart_model: CartModel = Depends(get_cart_model),
+    reservation_model: ReservationModel = Depends(get_reservation_model)
     ):
-    """Clear all items from cart"""
+    """Clear all items from cart and release their reservations"""
     await cart_model.clear_cart(current_user.id)
+    await reservation_model.release_all(current_user.id)
     return {"message": "Cart cleared successfully"}
 
-@router.post("/checkout", response_model=dict)
+@router.post("/checkout", response_model=OrderResponse)
 async def checkout_cart(
+    checkout: CartCheckout,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
     current_user: dict = Depends(get_current_user),
-    cart_model: CartModel = Depends(get_cart_model)
+    checkout_model: CheckoutModel = Depends(get_checkout_model)
     ):
-    """Convert cart to order (placeholder - you'll implement this)"""
-    cart = await cart_model.get_cart_by_user_id(current_user.id)
-
-    if not cart or not cart["items"]:
+    """
+    Convert cart to order: the cart is emptied, its stock reservations
+    consumed and the order created in one transaction. Retrying with the same Idempotency-Key
+    returns the order from the first successful attempt.
+    """
+    try:
+        order = await checkout_model.checkout(
+            current_user.id,
+            checkout.model_dump(),
+            idempotency_key
+        )
+    except EmptyCart:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Cart is empty"
         )
+    except CheckoutInProgress:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A checkout with this Idempotency-Key is already in progress"
+        )
+    except CheckoutOrderMissing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="The order created with this Idempotency-Key no longer exists"
+        )
+    except ProductNotFound as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Product {e.product_id} not found"
+        )
+    except InsufficientStock as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Insufficient stock for product {', '.join(e.product_ids)}. Order not placed."
+        )
 
-    # Here you would typically:
-    # 1. Create order from cart items
-    # 2. Clear the cart
-    # 3. Return order details
-
-    return {
-        "message": "Checkout initiated",
-        "cart_items": cart["items"],
-        "total_amount": cart["total_amount"]
-    }
\ No newline at end of file
+    order_dict = order.copy()
+    order_dict["_id"] = str(order_dict["_id"])
+    order_dict["id"] = order_dict["_id"]
+    return OrderResponse(**order_dict)
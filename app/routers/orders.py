@@ -1,10 +1,13 @@
 from itertools import product
-from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Response
 from typing import List, Optional
 from app.models.product import ProductModel
-from app.models.order import OrderModel
+from app.models.order import InsufficientStock, OrderModel, ProductNotFound
 from app.Schemas.order import OrderCreate, OrderResponse
 from app.utils.dependencies import get_current_user
+from app.utils.pagination import InvalidCursor
+from app.utils.serialization import RawJSONResponse, serialize_orders
+from app.config import settings
 from datetime import datetime, timezone
 
 router = APIRouter(prefix="/orders", tags=["orders"])
@@ -23,41 +26,24 @@ async def create_order(
   product_model: ProductModel = Depends(get_product_model),
   order_model: OrderModel = Depends(get_order_model)
 ):
-  # Step 1: Validate all products exist (basic check)
-  for item in order.order_items:
-    product = await product_model.get_product_by_id(item.product_id)
-    if not product:
-      raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND,
-        detail= f"Product {item.product_id} not found"
-      )
-
-  # Step 2: Create the order in pending state
   order_data = order.model_dump()
   order_data["user_id"] = current_user.id
   order_data["status"] = "pending"
 
-  order_id = await order_model.create_order(order_data)
-  new_order = await order_model.get_order_by_id(order_id)
-
-  # Step 3: Atomically decrement stock for all items
-  # This prevents race conditions - stock check and update happen atomically
-  for item in order.order_items:
-    updated_product = await product_model.decrement_stock_atomic(
-      item.product_id,
-      item.quantity
+  # Validates every item, decrements stock and inserts the order atomically
+  try:
+    new_order = await order_model.place_order(order_data, product_model)
+  except ProductNotFound as e:
+    raise HTTPException(
+      status_code=status.HTTP_404_NOT_FOUND,
+      detail= f"Product {e.product_id} not found"
+    )
+  except InsufficientStock as e:
+    raise HTTPException(
+      status_code=status.HTTP_400_BAD_REQUEST,
+      detail=f"Insufficient stock for product {', '.join(e.product_ids)}. Order not placed."
     )
 
-    # If decrement failed, it means insufficient stock (race condition occurred)
-    if not updated_product:
-      # Rollback: cancel the order
-      await order_model.update_order_status(order_id, "cancelled")
-      raise HTTPException(
-        status_code=status.HTTP_400_BAD_REQUEST,
-        detail=f"Insufficient stock for product {item.product_id}. Order cancelled."
-      )
-
-  # Step 4: Return the created order
   order_dict = new_order.copy()
   order_dict["_id"] = str(order_dict["_id"])  # Convert ObjectId to string
   order_dict["id"] = order_dict["_id"]         # Set id field (already string now)
@@ -65,10 +51,22 @@ async def create_order(
 
 @router.get("/", response_model= List[OrderResponse])
 async def get_my_orders(
+  response: Response,
+  limit: int = Query(100, ge=1, le=500),
+  cursor: Optional[str] = None,
   current_user : dict = Depends(get_current_user),
   order_model: OrderModel = Depends(get_order_model)
 ):
-  orders = await order_model.get_user_orders(current_user.id)
+  """Newest orders first; the next page's cursor is returned in the X-Next-Cursor header"""
+  try:
+    orders, next_cursor = await order_model.get_user_orders(current_user.id, limit=limit, cursor=cursor)
+  except InvalidCursor as e:
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+  headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+  if settings.fast_serialization:
+    return RawJSONResponse(serialize_orders(orders), headers=headers)
+  response.headers.update(headers)
 
   order_responses =[]
   for order in orders:
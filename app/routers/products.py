@@ -1,11 +1,19 @@
 from itertools import product
 from math import prod
-from fastapi import APIRouter, HTTPException, status, Depends, Query
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, Response
+from typing import List, Literal, Optional
 from app import routers
 from app.models.product import ProductModel
 from app.Schemas.product import ProductCreate,ProductUpdate, ProductResponse
 from app.utils.dependencies import get_admin_user, get_current_user
+from app.utils.http_cache import (
+  has_validators, is_not_modified, list_validators, not_modified, product_etag, product_version,
+  validator_headers
+)
+from app.utils.pagination import InvalidCursor
+from app.utils.product_import import ProductImporter, format_for_content_type
+from app.utils.serialization import RawJSONResponse, serialize_products
+from app.config import settings
 
 router = APIRouter(prefix="/products", tags=["products"])
 
@@ -14,17 +22,44 @@ async def get_product_model():
 
 @router.get("/", response_model= List[ProductResponse])
 async def get_products(
+  request: Request,
+  response: Response,
   skip: int = Query(0, ge=0),
   limit: int = Query(100,ge=1,le=1000),
   category: Optional[str] = None,
   search: Optional[str] = None,
+  cursor: Optional[str] = None,
   product_model: ProductModel = Depends(get_product_model)
   ):
-
+  """
+  List products. Without `skip` the listing is keyset-paginated: the cursor
+  for the next page comes back in the X-Next-Cursor header (absent on the
+  last page) and is passed back as `cursor`. `skip` is still honoured for
+  older clients but gets slower the deeper the page.
+  """
+
+  next_cursor = None
   if search:
-    products = await product_model.search_products(search)
-  else:
+    products = await product_model.search_products(search, skip=skip, limit=limit, category=category)
+  elif skip:
     products = await product_model.get_all_products(skip,limit=limit,category=category)
+  else:
+    try:
+      products, next_cursor = await product_model.get_products_page(cursor, limit=limit, category=category)
+    except InvalidCursor as e:
+      raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+  # Validators come from the page's ids and updated_at, so a match skips serialization
+  etag, last_modified = list_validators(products, next_cursor)
+  if is_not_modified(request.headers, etag, last_modified):
+    return not_modified(etag, last_modified)
+
+  headers = validator_headers(etag, last_modified)
+  if next_cursor:
+    headers["X-Next-Cursor"] = next_cursor
+  if settings.fast_serialization:
+    return RawJSONResponse(serialize_products(products), headers=headers)
+  response.headers.update(headers)
 
   # converting objectId to string id
 
@@ -36,8 +71,27 @@ async def get_products(
 
   return product_responses
 
+@router.get("/facets")
+async def get_product_facets(product_model: ProductModel = Depends(get_product_model)):
+  """Product and in-stock counts per category and brand, and the price range"""
+  return await product_model.get_facets()
+
 @router.get("/{product_id}", response_model=ProductResponse)
-async def get_product(product_id:str,product_model: ProductModel = Depends(get_product_model)):
+async def get_product(
+  product_id:str,
+  request: Request,
+  response: Response,
+  product_model: ProductModel = Depends(get_product_model)
+):
+  # A conditional request is answered from updated_at alone when nothing changed
+  if has_validators(request.headers):
+    current = await product_model.get_product_version(product_id)
+    if current is not None:
+      version = product_version(current)
+      etag = product_etag(product_id, version)
+      if is_not_modified(request.headers, etag, version):
+        return not_modified(etag, version)
+
   product = await product_model.get_product_by_id(product_id)
   if not product:
     raise HTTPException(
@@ -45,6 +99,8 @@ async def get_product(product_id:str,product_model: ProductModel = Depends(get_p
       detail=" product not found "
     )
 
+  version = product_version(product)
+  response.headers.update(validator_headers(product_etag(product_id, version), version))
   product_dict = product.copy()
   product_dict["id"] = str(product_dict.pop("_id"))
   return ProductResponse(**product_dict)
@@ -64,6 +120,22 @@ async def create_product(
   product_dict["id"] = str(product_dict.pop("_id"))
   return ProductResponse(**product_dict)
 
+@router.post("/import")
+async def import_products(
+  request: Request,
+  format: Optional[Literal["ndjson", "csv"]] = Query(None, description="default: from the Content-Type"),
+  batch_size: Optional[int] = Query(None, ge=1, le=10000),
+  current_user: dict = Depends(get_admin_user),
+  product_model: ProductModel = Depends(get_product_model)
+):
+  """
+  Stream an NDJSON or CSV catalog in the request body. Rows with a sku are
+  upserted by it, the rest are inserted; invalid rows are reported by line.
+  """
+  fmt = format or format_for_content_type(request.headers.get("content-type"))
+  importer = ProductImporter(product_model, batch_size)
+  return await importer.run(request.stream(), fmt)
+
 @router.put("/{product_id}", response_model=ProductResponse)
 async def update_product(
     product: ProductCreate,
@@ -1,6 +1,8 @@
 import asyncio
 from fastapi import APIRouter, HTTPException
-from app.models.product import ProductModel
+from app.models.inventory import sharded_products
+from app.models.product import ProductModel, catalog_cache, facet_cache
+from app.models.reservation import ReservationModel
 # Using app.Schemas based on directory listing
 from app.Schemas.product import ProductCreate 
 from typing import List
@@ -86,6 +88,12 @@ async def clear_products():
     
     try:
         result = await product_model.collection.delete_many({})
+        # Shards and cart holds of the deleted products would otherwise be orphaned
+        await product_model.stock_shards.collection.delete_many({})
+        await ReservationModel().collection.delete_many({})
+        sharded_products.replace({})
+        catalog_cache.invalidate()
+        facet_cache.clear()
         return {
             "message": f"Successfully cleared {result.deleted_count} products",
             "deleted_count": result.deleted_count
@@ -99,7 +107,8 @@ async def get_categories():
     product_model = ProductModel()
     
     try:
-        categories = await product_model.collection.distinct("category")
+        facets = await product_model.get_facets()
+        categories = [category["name"] for category in facets["categories"]]
         return {"categories": categories, "count": len(categories)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching categories: {str(e)}")
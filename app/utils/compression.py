@@ -0,0 +1,240 @@
+"""
+Negotiated response compression (zstd, brotli, gzip).
+
+CompressionMiddleware picks the encoding from Accept-Encoding (client
+q-values first, then the order of settings.compression_encodings) and
+compresses responses of compressible media types above
+settings.compression_minimum_size. Streaming responses are compressed chunk
+by chunk. Bodies that carry an ETag - the catalog reads - are cached
+compressed by (ETag, encoding), so a hot page is compressed once rather than
+once per client; their ETag is sent weak, as the bytes now depend on the
+encoding. brotli and zstandard are optional: an encoding whose library is
+not installed is never offered.
+"""
+import gzip
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.config import settings
+from app.utils.cache import TTLCache
+from app.utils.metrics import registry
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/x-ndjson", "application/javascript",
+    "application/xml", "text/",
+)
+
+COMPRESSION_RESPONSES = registry.counter(
+    "http_compression_responses_total", "Responses sent compressed, by encoding", ("encoding",)
+)
+COMPRESSION_BYTES_IN = registry.counter(
+    "http_compression_bytes_in_total", "Response bytes before compression", ("encoding",)
+)
+COMPRESSION_BYTES_OUT = registry.counter(
+    "http_compression_bytes_out_total", "Response bytes after compression", ("encoding",)
+)
+COMPRESSION_BYTES_SAVED = registry.counter(
+    "http_compression_bytes_saved_total", "Bytes not sent thanks to compression", ("encoding",)
+)
+COMPRESSION_CPU = registry.counter(
+    "http_compression_cpu_seconds_total", "CPU time spent compressing responses", ("encoding",)
+)
+COMPRESSION_CACHE = registry.counter(
+    "http_compression_cache_total", "Lookups of compressed bodies by ETag", ("result",)
+)
+
+
+class _GzipStream:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliStream:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _ZstdStream:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def _codecs() -> Dict[str, dict]:
+    codecs = {
+        "gzip": {
+            "compress": lambda data: gzip.compress(data, compresslevel=settings.compression_gzip_level, mtime=0),
+            "stream": lambda: _GzipStream(settings.compression_gzip_level),
+        },
+    }
+    if brotli is not None:
+        codecs["br"] = {
+            "compress": lambda data: brotli.compress(data, quality=settings.compression_brotli_quality),
+            "stream": lambda: _BrotliStream(settings.compression_brotli_quality),
+        }
+    if zstandard is not None:
+        compressor = zstandard.ZstdCompressor(level=settings.compression_zstd_level)
+        codecs["zstd"] = {
+            "compress": compressor.compress,
+            "stream": lambda: _ZstdStream(settings.compression_zstd_level),
+        }
+    return codecs
+
+
+def negotiate(accept_encoding: Optional[str], encodings: List[str]) -> Optional[str]:
+    """The best of `encodings` (in server preference order) the client accepts, or None"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def _compressible(headers: Headers) -> bool:
+    content_type = headers.get("content-type", "")
+    return "content-encoding" not in headers and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware; see the module docstring"""
+
+    def __init__(self, app):
+        self.app = app
+        self.codecs = _codecs()
+        self.encodings = [
+            name.strip() for name in settings.compression_encodings.split(",") if name.strip() in self.codecs
+        ]
+        self.cache = TTLCache(
+            max_size=settings.compression_cache_max_size,
+            ttl=settings.compression_cache_ttl_seconds
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"), self.encodings)
+        codec = self.codecs.get(encoding)
+        start_message = None
+        stream = None
+        passthrough = False
+
+        def observe(size_in: int, size_out: int, cpu: float) -> None:
+            COMPRESSION_BYTES_IN.inc((encoding,), size_in)
+            COMPRESSION_BYTES_OUT.inc((encoding,), size_out)
+            COMPRESSION_BYTES_SAVED.inc((encoding,), size_in - size_out)
+            COMPRESSION_CPU.inc((encoding,), cpu)
+
+        async def send_compressed(message):
+            nonlocal start_message, stream, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            if passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if stream is not None:
+                cpu = time.thread_time()
+                data = stream.compress(body) if body else b""
+                if not more_body:
+                    data += stream.finish()
+                observe(len(body), len(data), time.thread_time() - cpu)
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+                return
+
+            # First body message: decide what to do with the whole response
+            headers = MutableHeaders(scope=start_message)
+            compressible = start_message["status"] == 200 and _compressible(headers)
+            if compressible:
+                headers.add_vary_header("Accept-Encoding")
+            small = not more_body and len(body) < settings.compression_minimum_size
+            if codec is None or not compressible or small:
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            del headers["content-length"]
+            headers["content-encoding"] = encoding
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["etag"] = f"W/{etag}"
+            COMPRESSION_RESPONSES.inc((encoding,))
+
+            if more_body:
+                stream = codec["stream"]()
+                await send(start_message)
+                await send_compressed(message)
+                return
+
+            key = (etag, encoding) if etag else None
+            data = self.cache.get(key) if key else None
+            if key:
+                COMPRESSION_CACHE.inc(("hit" if data is not None else "miss",))
+            if data is None:
+                cpu = time.thread_time()
+                data = codec["compress"](body)
+                observe(len(body), len(data), time.thread_time() - cpu)
+                if key:
+                    self.cache.set(key, data)
+            else:
+                observe(len(body), len(data), 0.0)
+            headers["content-length"] = str(len(data))
+            await send(start_message)
+            await send({"type": "http.response.body", "body": data})
+
+        await self.app(scope, receive, send_compressed)
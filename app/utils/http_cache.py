@@ -0,0 +1,130 @@
+"""
+HTTP validators (ETag / Last-Modified) and per-route Cache-Control.
+
+ETags are strong and derived from what the representation is built from -
+product ids and their updated_at - never from the bytes, so they can be
+checked before a body is fetched or serialized and are identical across
+worker processes. CacheControlMiddleware sets the Cache-Control header by
+route template: the public catalog reads get the configured policies, every
+other response is sent with no-store so that a CDN never keeps per-user data.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import Response
+
+from app.config import settings
+from app.utils.metrics import route_template
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def _utc(moment: Optional[datetime]) -> Optional[datetime]:
+    if moment is None:
+        return None
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment.astimezone(timezone.utc)
+
+
+def product_version(product: Dict) -> Optional[datetime]:
+    return _utc(product.get("updated_at") or product.get("created_at"))
+
+
+def product_etag(product_id: str, version: Optional[datetime]) -> str:
+    return make_etag("product", product_id, version, settings.fast_serialization)
+
+
+def list_validators(products: Iterable[Dict], *extra) -> Tuple[str, Optional[datetime]]:
+    """ETag and Last-Modified of a list page, from the ids and versions of its products"""
+    versions = [(str(product["_id"]), product_version(product)) for product in products]
+    last_modified = max((version for _, version in versions if version), default=None)
+    return make_etag("list", versions, extra, settings.fast_serialization), last_modified
+
+
+def http_date(moment: datetime) -> str:
+    return format_datetime(_utc(moment), usegmt=True)
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime] = None) -> Dict[str, str]:
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # GET and HEAD use the weak comparison: a W/ prefix does not matter
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in tags
+
+
+def is_not_modified(headers, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """
+    Evaluate If-None-Match, or If-Modified-Since when there is no
+    If-None-Match, against the current validators.
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have whole seconds
+    return _utc(last_modified).replace(microsecond=0) <= since
+
+
+def has_validators(headers) -> bool:
+    return "if-none-match" in headers or "if-modified-since" in headers
+
+
+def not_modified(etag: str, last_modified: Optional[datetime] = None) -> Response:
+    return Response(status_code=304, headers=validator_headers(etag, last_modified))
+
+
+def _public_policies() -> Dict[Tuple[str, str], str]:
+    catalog = settings.cache_control_catalog
+    return {
+        ("GET", "/products/"): catalog,
+        ("GET", "/products/facets"): catalog,
+        ("GET", "/products/{product_id}"): settings.cache_control_product,
+        ("GET", "/seed/categories"): catalog,
+    }
+
+
+class CacheControlMiddleware:
+    """Pure ASGI middleware adding Cache-Control (unless the handler set one) by route template"""
+
+    def __init__(self, app):
+        self.app = app
+        self.policies = _public_policies()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cache_control(message):
+            if message["type"] == "http.response.start":
+                headers = message["headers"] = list(message.get("headers", []))
+                if not any(name.lower() == b"cache-control" for name, _ in headers):
+                    policy = None
+                    if message["status"] in (200, 304):
+                        method = "GET" if scope["method"] == "HEAD" else scope["method"]
+                        policy = self.policies.get((method, route_template(scope)))
+                    headers.append((b"cache-control", (policy or "no-store").encode("latin-1")))
+            await send(message)
+
+        await self.app(scope, receive, send_with_cache_control)
@@ -0,0 +1,131 @@
+"""
+Index registry.
+
+Each model module declares the indexes its queries rely on with
+`register_indexes` and the query shapes it sends with `register_query`.
+The FastAPI lifespan applies the indexes on startup, and the plan check
+(`python -m app.utils.indexes`) runs explain() on every registered query and
+fails when one is answered with a collection scan.
+"""
+import asyncio
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+from pymongo import IndexModel
+
+from app.database import db
+
+
+@dataclass
+class QueryShape:
+    collection: str
+    name: str
+    filter: dict
+    sort: Optional[dict] = None
+    projection: Optional[dict] = field(default=None)
+
+
+INDEX_REGISTRY: Dict[str, List[IndexModel]] = {}
+QUERY_REGISTRY: List[QueryShape] = []
+
+
+def register_indexes(collection: str, *indexes: IndexModel) -> None:
+    INDEX_REGISTRY.setdefault(collection, []).extend(indexes)
+
+
+def register_query(collection: str, name: str, filter: dict, sort: Optional[dict] = None,
+                   projection: Optional[dict] = None) -> None:
+    """Record a representative query so the plan check can explain() it"""
+    QUERY_REGISTRY.append(QueryShape(collection, name, filter, sort, projection))
+
+
+def _load_models() -> None:
+    # Models register their indexes at import time
+    import app.models.cart  # noqa: F401
+    import app.models.inventory  # noqa: F401
+    import app.models.job  # noqa: F401
+    import app.models.checkout  # noqa: F401
+    import app.models.order  # noqa: F401
+    import app.models.product  # noqa: F401
+    import app.models.reservation  # noqa: F401
+    import app.models.sales  # noqa: F401
+    import app.models.token_revocation  # noqa: F401
+    import app.models.user  # noqa: F401
+
+
+async def ensure_indexes() -> None:
+    """Create every registered index (a no-op for indexes that already exist)"""
+    _load_models()
+    for collection, indexes in INDEX_REGISTRY.items():
+        names = await db.get_collection(collection).create_indexes(indexes)
+        print(f"Indexes on {collection}: {', '.join(names)}")
+
+
+def _plan_stages(plan) -> Iterator[str]:
+    """Yield every stage name in a (possibly nested) explain plan"""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+async def explain_query(shape: QueryShape) -> dict:
+    command = {"find": shape.collection, "filter": shape.filter}
+    if shape.sort:
+        command["sort"] = shape.sort
+    if shape.projection:
+        command["projection"] = shape.projection
+    return await db.database.command(
+        {"explain": command, "verbosity": "queryPlanner"}
+    )
+
+
+async def find_collection_scans() -> List[dict]:
+    """Explain every registered query and return the ones whose winning plan is a COLLSCAN"""
+    _load_models()
+    problems = []
+    for shape in QUERY_REGISTRY:
+        explain = await explain_query(shape)
+        stages = set(_plan_stages(explain["queryPlanner"]["winningPlan"]))
+        if "COLLSCAN" in stages:
+            problems.append({
+                "collection": shape.collection,
+                "query": shape.name,
+                "stages": sorted(stages),
+            })
+    return problems
+
+
+async def verify_query_plans() -> None:
+    problems = await find_collection_scans()
+    if problems:
+        details = "; ".join(f"{p['collection']}.{p['query']}" for p in problems)
+        raise RuntimeError(f"Queries answered by a collection scan: {details}")
+
+
+async def _main(create: bool) -> int:
+    await db.connect()
+    try:
+        if create:
+            await ensure_indexes()
+        problems = await find_collection_scans()
+    finally:
+        await db.disconnect()
+
+    for shape in QUERY_REGISTRY:
+        failed = any(p["query"] == shape.name and p["collection"] == shape.collection for p in problems)
+        print(f"{'COLLSCAN' if failed else 'ok':8} {shape.collection}.{shape.name}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    # Run as a script this file is __main__, while the models register their
+    # indexes and queries on app.utils.indexes: use that module's registries
+    import importlib
+    indexes = importlib.import_module("app.utils.indexes")
+    sys.exit(asyncio.run(indexes._main(create="--no-create" not in sys.argv)))
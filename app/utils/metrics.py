@@ -0,0 +1,240 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Request metrics are recorded by MetricsMiddleware per route template (e.g.
+/products/{product_id}), never per raw path, so label cardinality stays
+bounded. Dependencies can report the time they took with
+record_dependency_time; the middleware then records it separately from the
+handler time. Metrics are per worker process - scrape every worker.
+"""
+import time
+from contextvars import ContextVar
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DEPENDENCY_TIMINGS_KEY = "app.dependency_timings"
+
+# Scope of the request being served, for code that only sees the context (e.g. pymongo listeners)
+current_request_scope: ContextVar = ContextVar("current_request_scope", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, labels: Tuple = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def reset(self) -> None:
+        self._values.clear()
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+            for labels, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, labels: Tuple = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+    def set(self, labels: Tuple, value: float) -> None:
+        self._values[labels] = value
+
+
+class CallbackGauge(Metric):
+    """Gauge whose samples are read from `callback` (labels tuple -> value) at scrape time"""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str], callback: Callable[[], Dict[Tuple, float]]):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+            for labels, value in sorted(self.callback().items())
+        ]
+
+
+class CallbackCounter(CallbackGauge):
+    """Counter read from `callback`, for totals that another component already keeps"""
+    type = "counter"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, labels: Tuple, value: float) -> None:
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def reset(self) -> None:
+        self._values.clear()
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        bucket_labels = self.label_names + ("le",)
+        for labels, series in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(bucket_labels, labels + (_format_value(bound),))} {cumulative}"
+                )
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def callback_gauge(self, name: str, documentation: str, labels: Sequence[str], callback) -> CallbackGauge:
+        return self.register(CallbackGauge(name, documentation, labels, callback))
+
+    def callback_counter(self, name: str, documentation: str, labels: Sequence[str], callback) -> CallbackCounter:
+        return self.register(CallbackCounter(name, documentation, labels, callback))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    "http_requests_total", "HTTP requests by method, route template and status code",
+    ("method", "route", "status")
+)
+REQUESTS_IN_FLIGHT = registry.gauge("http_requests_in_flight", "HTTP requests currently being served")
+REQUEST_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "Total time to serve a request",
+    ("method", "route", "status")
+)
+HANDLER_LATENCY = registry.histogram(
+    "http_handler_duration_seconds", "Time spent serving a request outside of timed dependencies",
+    ("method", "route")
+)
+DEPENDENCY_LATENCY = registry.histogram(
+    "http_dependency_duration_seconds", "Time spent resolving a dependency such as get_current_user",
+    ("method", "route", "dependency")
+)
+
+
+def record_dependency_time(scope: dict, name: str, seconds: float) -> None:
+    """Called by dependencies to report how long they took for the current request"""
+    timings = scope.get(DEPENDENCY_TIMINGS_KEY)
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def route_template(scope: dict) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "<unmatched>"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request count, in-flight requests and latencies"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+        scope[DEPENDENCY_TIMINGS_KEY] = {}
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        scope_token = current_request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_request_scope.reset(scope_token)
+            REQUESTS_IN_FLIGHT.dec()
+            elapsed = time.perf_counter() - start
+            method, route = scope["method"], route_template(scope)
+            status = str(status_code)
+
+            REQUESTS.inc((method, route, status))
+            REQUEST_LATENCY.observe((method, route, status), elapsed)
+            dependency_total = 0.0
+            for name, seconds in scope[DEPENDENCY_TIMINGS_KEY].items():
+                DEPENDENCY_LATENCY.observe((method, route, name), seconds)
+                dependency_total += seconds
+            HANDLER_LATENCY.observe((method, route), max(elapsed - dependency_total, 0.0))
@@ -0,0 +1,59 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(last_id: ObjectId, created_at: Optional[datetime] = None) -> str:
+    """Opaque keyset cursor pointing just past the given document"""
+    payload = {"id": str(last_id)}
+    if created_at is not None:
+        payload["ts"] = created_at.isoformat()
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    Decode a cursor made by encode_cursor into {"_id": ObjectId, "created_at": datetime|None}.
+    Raises InvalidCursor for anything that was not produced by encode_cursor.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if not isinstance(payload, dict):
+            raise ValueError("cursor payload is not an object")
+        created_at = payload.get("ts")
+        return {
+            "_id": ObjectId(payload["id"]),
+            "created_at": datetime.fromisoformat(created_at) if created_at else None,
+        }
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+
+
+def descending_after(cursor: dict) -> dict:
+    """Filter for documents after `cursor` in (created_at desc, _id desc) order"""
+    return {
+        "$or": [
+            {"created_at": {"$lt": cursor["created_at"]}},
+            {"created_at": cursor["created_at"], "_id": {"$lt": cursor["_id"]}},
+        ]
+    }
+
+
+def ascending_after(cursor: dict) -> dict:
+    """Filter for documents after `cursor` in (created_at asc, _id asc) order"""
+    return {
+        "$or": [
+            {"created_at": {"$gt": cursor["created_at"]}},
+            {"created_at": cursor["created_at"], "_id": {"$gt": cursor["_id"]}},
+        ]
+    }
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import deque
+from typing import Dict
+
+from pymongo import monitoring
+
+
+def _percentile(ordered, pct: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """
+    Connection pool statistics from pymongo's CMAP events.
+
+    pymongo emits the events synchronously on the thread that checks the
+    connection out (Motor's executor threads), so the checkout wait time is
+    measured with a thread-local start timestamp.
+    """
+
+    def __init__(self, samples: int = 1000):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._waits = deque(maxlen=samples)
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.checked_out = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    # Pool events
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    # Connection events
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        with self._lock:
+            self.checked_out += 1
+            if started is not None:
+                self._waits.append(time.perf_counter() - started)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            open_connections = self.connections_created - self.connections_closed
+            return {
+                "open": open_connections,
+                "in_use": self.checked_out,
+                "available": max(open_connections - self.checked_out, 0),
+                "created": self.connections_created,
+                "closed": self.connections_closed,
+                "checkout_failures": self.checkout_failures,
+                "pool_clears": self.pool_clears,
+                "checkout_wait_ms": {
+                    "samples": len(waits),
+                    "p50": round(_percentile(waits, 50) * 1000, 3),
+                    "p99": round(_percentile(waits, 99) * 1000, 3),
+                    "max": round(waits[-1] * 1000, 3) if waits else 0.0,
+                },
+            }
+
+
+pool_monitor = PoolMonitor()
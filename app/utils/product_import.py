@@ -0,0 +1,211 @@
+"""
+Streaming bulk product import from NDJSON or CSV.
+
+Rows are parsed as the bytes arrive, validated against ProductCreate and
+written in batches of settings.product_import_batch_size, so memory stays
+bounded by one batch whatever the size of the upload. Rows with a `sku` are
+upserted by it; the others are inserted. CSV files need a header row; list
+fields such as `images` are separated by "|".
+
+Besides POST /products/import there is a CLI:
+
+    python -m app.utils.product_import catalog.ndjson [--format csv] [--batch-size 5000]
+"""
+import argparse
+import asyncio
+import codecs
+import csv
+import sys
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+
+import orjson
+from pydantic import ValidationError
+
+from app.Schemas.product import ProductCreate
+from app.config import settings
+from app.database import db
+from app.models.product import ProductModel
+from app.utils.indexes import ensure_indexes
+
+FORMATS = ("ndjson", "csv")
+CSV_LIST_FIELDS = ("images",)
+CSV_LIST_SEPARATOR = "|"
+
+
+def format_for_content_type(content_type: Optional[str]) -> str:
+    return "csv" if content_type and "csv" in content_type.lower() else "ndjson"
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream as UTF-8 and yield it line by line, line endings included"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.splitlines(keepends=True)
+        # The last piece may be a partial line (or a "\r" whose "\n" is in the next chunk)
+        pending = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def _csv_row(header: List[str], values: List[str]) -> Dict:
+    if len(values) != len(header):
+        raise ValueError(f"expected {len(header)} columns, got {len(values)}")
+    row = {}
+    for name, value in zip(header, values):
+        if name in CSV_LIST_FIELDS:
+            row[name] = [item for item in value.split(CSV_LIST_SEPARATOR) if item]
+        elif value != "":
+            row[name] = value
+    # Empty cells mean "not set"; brand is the one nullable field without a default
+    row.setdefault("brand", None)
+    return row
+
+
+async def iter_rows(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Tuple[int, Union[Dict, str]]]:
+    """Yield (line number, row dict) for every record, or (line number, error message)"""
+    line_no = 0
+    if fmt == "ndjson":
+        async for line in iter_lines(chunks):
+            line_no += 1
+            if not line.strip():
+                continue
+            try:
+                row = orjson.loads(line)
+            except orjson.JSONDecodeError as exc:
+                yield line_no, f"invalid JSON: {exc}"
+                continue
+            yield line_no, row if isinstance(row, dict) else "expected a JSON object"
+        return
+
+    header: Optional[List[str]] = None
+    record, record_line = "", 0
+    async for line in iter_lines(chunks):
+        line_no += 1
+        if not record:
+            record_line = line_no
+        record += line
+        # A quoted field may contain line breaks: wait for the closing quote
+        if record.count('"') % 2:
+            continue
+        text, record = record, ""
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        try:
+            yield record_line, _csv_row(header, values)
+        except ValueError as exc:
+            yield record_line, str(exc)
+    if record.strip():
+        yield record_line, "unterminated quoted field"
+
+
+def _validation_message(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc']) or 'row'}: {error['msg']}"
+        for error in exc.errors()
+    )
+
+
+class ProductImporter:
+    def __init__(self, product_model, batch_size: Optional[int] = None, max_errors: Optional[int] = None):
+        self.product_model = product_model
+        self.batch_size = batch_size or settings.product_import_batch_size
+        self.max_errors = settings.product_import_max_errors if max_errors is None else max_errors
+        self.summary = {"rows": 0, "inserted": 0, "upserted": 0, "updated": 0, "failed": 0, "errors": []}
+        self._batch: List[Tuple[int, dict]] = []
+        self._batch_skus = set()
+
+    def _error(self, line: int, message: str) -> None:
+        self.summary["failed"] += 1
+        if len(self.summary["errors"]) < self.max_errors:
+            self.summary["errors"].append({"line": line, "error": message})
+
+    async def _flush(self) -> None:
+        if not self._batch:
+            return
+        batch, self._batch, self._batch_skus = self._batch, [], set()
+        counts, errors = await self.product_model.import_batch([product for _, product in batch])
+        for key, value in counts.items():
+            self.summary[key] += value
+        for index, message in sorted(errors.items()):
+            self._error(batch[index][0], message)
+
+    async def add(self, line: int, row: Union[Dict, str]) -> None:
+        self.summary["rows"] += 1
+        if isinstance(row, str):
+            self._error(line, row)
+            return
+        try:
+            product = ProductCreate.model_validate(row).model_dump()
+        except ValidationError as exc:
+            self._error(line, _validation_message(exc))
+            return
+
+        # Two upserts of one SKU in an unordered batch would race each other
+        sku = product.get("sku")
+        if sku and sku in self._batch_skus:
+            await self._flush()
+        if sku:
+            self._batch_skus.add(sku)
+        self._batch.append((line, product))
+        if len(self._batch) >= self.batch_size:
+            await self._flush()
+
+    async def run(self, chunks: AsyncIterator[bytes], fmt: str) -> Dict:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported import format: {fmt}")
+        start = time.perf_counter()
+        async for line, row in iter_rows(chunks, fmt):
+            await self.add(line, row)
+        await self._flush()
+
+        elapsed = time.perf_counter() - start
+        self.summary["errors_truncated"] = self.summary["failed"] > len(self.summary["errors"])
+        self.summary["elapsed_seconds"] = round(elapsed, 3)
+        self.summary["rows_per_second"] = round(self.summary["rows"] / elapsed, 1) if elapsed else 0.0
+        return self.summary
+
+
+async def read_file(path: str, chunk_size: int = 1 << 20) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def import_file(path: str, fmt: Optional[str] = None, batch_size: Optional[int] = None) -> Dict:
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "ndjson")
+    await db.connect()
+    try:
+        # Upserts by SKU rely on the unique sku index
+        await ensure_indexes()
+        return await ProductImporter(ProductModel(), batch_size).run(read_file(path), fmt)
+    finally:
+        await db.disconnect()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Bulk import products from NDJSON or CSV")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    parser.add_argument("--batch-size", type=int)
+    args = parser.parse_args()
+
+    summary = asyncio.run(import_file(args.path, args.format, args.batch_size))
+    print(orjson.dumps(summary, option=orjson.OPT_INDENT_2).decode())
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
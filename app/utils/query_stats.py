@@ -0,0 +1,165 @@
+"""
+Mongo command monitoring.
+
+QueryStats is a pymongo CommandListener registered on the client in
+app.database. It aggregates every command by shape - database, collection,
+operation and the normalized keys of its filter - and logs commands slower
+than settings.slow_query_ms together with the route that issued them.
+
+The route comes from the request scope the metrics middleware puts in a
+context variable; Motor copies the context into its executor threads, which
+is where pymongo emits these events.
+"""
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+from app.config import settings
+from app.utils.metrics import current_request_scope, route_template
+
+logger = logging.getLogger("app.slow_queries")
+
+# Handshake, heartbeat and session housekeeping commands are not interesting here
+IGNORED_COMMANDS = {
+    "hello", "ismaster", "isMaster", "ping", "buildinfo", "buildInfo", "endSessions",
+    "saslStart", "saslContinue", "killCursors", "abortTransaction", "commitTransaction",
+}
+
+# Where each command keeps its collection name and its filter
+FILTER_FIELDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+}
+
+
+def _filter_shape(query) -> str:
+    """Normalize a filter to its sorted keys and operators, dropping the values"""
+    if not isinstance(query, dict):
+        return ""
+    parts = []
+    for key in sorted(query):
+        value = query[key]
+        if key in ("$and", "$or", "$nor") and isinstance(value, list):
+            parts.append(f"{key}[{'|'.join(sorted({_filter_shape(q) for q in value}))}]")
+        elif isinstance(value, dict) and value and all(str(k).startswith("$") for k in value):
+            parts.append(f"{key}({','.join(sorted(value))})")
+        else:
+            parts.append(key)
+    return ",".join(parts)
+
+
+def command_shape(command_name: str, command: dict) -> Tuple[str, str]:
+    """(collection, normalized filter) for a command document"""
+    collection = command.get(command_name)
+    if not isinstance(collection, str):
+        collection = command.get("collection", "") if command_name == "getMore" else ""
+
+    if command_name in FILTER_FIELDS:
+        shape = _filter_shape(command.get(FILTER_FIELDS[command_name]))
+    elif command_name == "update":
+        shape = _filter_shape((command.get("updates") or [{}])[0].get("q"))
+    elif command_name == "delete":
+        shape = _filter_shape((command.get("deletes") or [{}])[0].get("q"))
+    elif command_name == "aggregate":
+        stages = command.get("pipeline") or []
+        match = stages[0].get("$match") if stages and isinstance(stages[0], dict) else None
+        shape = ">".join(next(iter(stage)) for stage in stages if isinstance(stage, dict) and stage)
+        if match is not None:
+            shape = f"{_filter_shape(match)} {shape}"
+    else:
+        shape = ""
+    return collection, shape
+
+
+def _documents_returned(command_name: str, reply) -> int:
+    if not isinstance(reply, dict):
+        return 0
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if command_name == "findAndModify":
+        return 1 if reply.get("value") else 0
+    return int(reply.get("n", 0) or 0)
+
+
+class QueryStats(monitoring.CommandListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Tuple, Tuple] = {}
+        self._stats: Dict[Tuple, Dict] = {}
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        collection, shape = command_shape(event.command_name, event.command)
+        scope = current_request_scope.get()
+        route = f"{scope['method']} {route_template(scope)}" if scope else "<background>"
+        key = (event.database_name, collection, event.command_name, shape)
+        with self._lock:
+            self._in_flight[(event.connection_id, event.request_id)] = (key, route)
+
+    def succeeded(self, event):
+        self._finish(event, _documents_returned(event.command_name, event.reply), failed=False)
+
+    def failed(self, event):
+        self._finish(event, 0, failed=True)
+
+    def _finish(self, event, documents: int, failed: bool):
+        with self._lock:
+            pending = self._in_flight.pop((event.connection_id, event.request_id), None)
+            if pending is None:
+                return
+            key, route = pending
+            duration_ms = event.duration_micros / 1000
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = {
+                    "count": 0, "failures": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "documents_returned": 0, "slow": 0, "routes": {},
+                }
+            stats["count"] += 1
+            stats["failures"] += failed
+            stats["total_ms"] += duration_ms
+            stats["max_ms"] = max(stats["max_ms"], duration_ms)
+            stats["documents_returned"] += documents
+            stats["routes"][route] = stats["routes"].get(route, 0) + 1
+            slow = duration_ms >= settings.slow_query_ms
+            stats["slow"] += slow
+
+        if slow:
+            database, collection, operation, shape = key
+            logger.warning(
+                "Slow Mongo command %s on %s.%s {%s} took %.1f ms (route %s)",
+                operation, database, collection, shape, duration_ms, route
+            )
+
+    def table(self, limit: Optional[int] = None) -> List[Dict]:
+        """Aggregated stats per command shape, most total time first"""
+        with self._lock:
+            rows = [
+                {
+                    "database": database,
+                    "collection": collection,
+                    "operation": operation,
+                    "filter_keys": shape,
+                    **stats,
+                    "routes": dict(stats["routes"]),
+                    "total_ms": round(stats["total_ms"], 3),
+                    "max_ms": round(stats["max_ms"], 3),
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 3),
+                }
+                for (database, collection, operation, shape), stats in self._stats.items()
+            ]
+        rows.sort(key=lambda row: row["total_ms"], reverse=True)
+        return rows[:limit] if limit else rows
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+query_stats = QueryStats()
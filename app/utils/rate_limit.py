@@ -0,0 +1,202 @@
+"""
+Token-bucket rate limiting for the auth endpoints.
+
+Each bucket holds up to `burst` tokens and refills at `per_minute` tokens a
+minute; a request takes one token or is refused with the time until the
+next one. A bucket that has refilled completely is indistinguishable from a
+missing one, so buckets are dropped once they are full again - idle keys
+cost nothing.
+
+Two backends, picked with settings.rate_limit_backend:
+
+- "memory": per process, the default for a single worker.
+- "sqlite": a local SQLite file (settings.rate_limit_sqlite_path) shared by
+  every worker on the host, so the limits hold across processes.
+"""
+import asyncio
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from app.config import settings
+from app.utils.metrics import registry
+
+RATE_LIMITED = registry.counter(
+    "auth_rate_limited_total", "Requests refused by the auth rate limiter", ("action", "scope")
+)
+
+
+@dataclass(frozen=True)
+class Limit:
+    burst: int
+    per_minute: float
+
+    @property
+    def per_second(self) -> float:
+        return self.per_minute / 60
+
+
+def _refill(tokens: float, updated: float, now: float, limit: Limit) -> float:
+    return min(limit.burst, tokens + (now - updated) * limit.per_second)
+
+
+def _take(tokens: float, limit: Limit, now: float) -> Tuple[float, float, float]:
+    """(tokens left, seconds to wait (0 if allowed), time the bucket is full again)"""
+    if tokens >= 1:
+        tokens -= 1
+        wait = 0.0
+    else:
+        wait = (1 - tokens) / limit.per_second
+    full_at = now + (limit.burst - tokens) / limit.per_second
+    return tokens, wait, full_at
+
+
+class MemoryBackend:
+    def __init__(self, max_buckets: int, sweep_interval: float = 60.0):
+        self.max_buckets = max_buckets
+        self.sweep_interval = sweep_interval
+        # key -> (tokens, updated, full_at), least recently used first
+        self._buckets: "OrderedDict[str, Tuple[float, float, float]]" = OrderedDict()
+        self._next_sweep = time.monotonic() + sweep_interval
+        self._next_overflow_sweep = 0.0
+
+    async def take(self, key: str, limit: Limit) -> float:
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self.evict_idle(now)
+
+        bucket = self._buckets.pop(key, None)
+        tokens = limit.burst if bucket is None else _refill(bucket[0], bucket[1], now, limit)
+        tokens, wait, full_at = _take(tokens, limit, now)
+        self._buckets[key] = (tokens, now, full_at)
+        if len(self._buckets) > self.max_buckets and now >= self._next_overflow_sweep:
+            # Make room with buckets that are full again before dropping live
+            # ones; at most once a second, so a flood of new keys is not a scan each
+            self.evict_idle(now)
+            self._next_overflow_sweep = now + 1.0
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        idle = [key for key, (_, _, full_at) in self._buckets.items() if full_at <= now]
+        for key in idle:
+            del self._buckets[key]
+        self._next_sweep = now + self.sweep_interval
+        return len(idle)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SQLiteBackend:
+    """Buckets in a local SQLite file; BEGIN IMMEDIATE serializes workers on the host"""
+
+    def __init__(self, path: str, sweep_interval: float = 60.0):
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at)")
+        self._next_sweep = 0.0
+
+    def _take(self, key: str, limit: Limit) -> float:
+        with self._lock:
+            # Wall-clock time: it has to mean the same thing in every process
+            now = time.time()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if now >= self._next_sweep:
+                    self._conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+                    self._next_sweep = now + self.sweep_interval
+                row = self._conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = limit.burst if row is None else _refill(row[0], row[1], now, limit)
+                tokens, wait, full_at = _take(tokens, limit, now)
+                self._conn.execute(
+                    "INSERT INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, "
+                    "updated = excluded.updated, full_at = excluded.full_at",
+                    (key, tokens, now, full_at)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return wait
+
+    async def take(self, key: str, limit: Limit) -> float:
+        return await asyncio.to_thread(self._take, key, limit)
+
+
+class RateLimiter:
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def check(self, action: str, keys: Dict[str, str], limits: Dict[str, Limit]) -> float:
+        """
+        Take a token from the bucket of each (scope, key) pair in order, e.g.
+        {"ip": ..., "email": ...}, stopping at the first that refuses so a
+        refused request does not use up the later buckets. Returns 0 if the
+        request may proceed, otherwise the seconds until it may be retried.
+        """
+        for scope, key in keys.items():
+            wait = await self.backend.take(f"{action}:{scope}:{key}", limits[scope])
+            if wait > 0:
+                RATE_LIMITED.inc((action, scope))
+                return wait
+        return 0.0
+
+
+AUTH_LIMITS = {
+    "login": {
+        "email": Limit(settings.login_rate_limit_email_burst, settings.login_rate_limit_email_per_minute),
+        "ip": Limit(settings.login_rate_limit_ip_burst, settings.login_rate_limit_ip_per_minute),
+    },
+    "register": {
+        "email": Limit(settings.register_rate_limit_email_burst, settings.register_rate_limit_email_per_minute),
+        "ip": Limit(settings.register_rate_limit_ip_burst, settings.register_rate_limit_ip_per_minute),
+    },
+}
+
+_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        if settings.rate_limit_backend == "sqlite":
+            backend = SQLiteBackend(settings.rate_limit_sqlite_path)
+        else:
+            backend = MemoryBackend(settings.rate_limit_max_buckets)
+        _limiter = RateLimiter(backend)
+    return _limiter
+
+
+def client_ip(request) -> str:
+    if settings.rate_limit_trust_forwarded_for:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def check_auth_rate_limit(action: str, request, email: str) -> float:
+    """Seconds to wait before `action` (login/register) may be retried; 0 if allowed"""
+    if not settings.rate_limit_enabled:
+        return 0.0
+    # The IP first: a client flooding other people's emails is stopped before it drains their buckets
+    keys = {"ip": client_ip(request), "email": email.strip().lower()}
+    return await get_rate_limiter().check(action, keys, AUTH_LIMITS[action])
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
@@ -1,3 +1,5 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import jwt
@@ -7,6 +9,15 @@ from app.config import settings
 # use built-in bcrypt directly
 import bcrypt
 
+
+class PasswordHasherBusy(Exception):
+    """Raised when the bcrypt pool queue is full or the wait for a worker timed out"""
+
+
+_hash_executor: Optional[ThreadPoolExecutor] = None
+_hash_slots: Optional[asyncio.Semaphore] = None
+_hash_waiting = 0
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
 
@@ -14,9 +25,84 @@ def get_password_hash(password: str) -> str:
     password = password.encode('utf-8')[:72]          # truncate
     return bcrypt.hashpw(password, bcrypt.gensalt()).decode()
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+def _get_hash_executor() -> ThreadPoolExecutor:
+    global _hash_executor, _hash_slots
+    if _hash_executor is None:
+        _hash_executor = ThreadPoolExecutor(
+            max_workers=settings.password_hash_workers,
+            thread_name_prefix="bcrypt"
+        )
+        _hash_slots = asyncio.Semaphore(settings.password_hash_workers)
+    return _hash_executor
+
+async def _run_bcrypt(func, *args):
+    """
+    Run a bcrypt call in the dedicated pool. At most `password_hash_workers`
+    calls run at once and at most `password_hash_max_queue` wait for a slot;
+    anything beyond that, or waiting longer than the queue timeout, raises
+    PasswordHasherBusy instead of piling up behind the event loop.
+    """
+    global _hash_waiting
+    executor = _get_hash_executor()
+
+    if not _hash_slots.locked():
+        # A worker is free: acquire returns immediately
+        await _hash_slots.acquire()
+    else:
+        if _hash_waiting >= settings.password_hash_max_queue:
+            raise PasswordHasherBusy()
+
+        _hash_waiting += 1
+        try:
+            await asyncio.wait_for(
+                _hash_slots.acquire(),
+                timeout=settings.password_hash_queue_timeout_seconds
+            )
+        except asyncio.TimeoutError:
+            raise PasswordHasherBusy()
+        finally:
+            _hash_waiting -= 1
+
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, func, *args)
+    finally:
+        _hash_slots.release()
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_bcrypt(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_bcrypt(get_password_hash, password)
+
+async def shutdown_password_executor():
+    """Let running bcrypt calls finish, waiting in a thread so the event loop keeps serving"""
+    global _hash_executor, _hash_slots
+    if _hash_executor is not None:
+        executor, _hash_executor, _hash_slots = _hash_executor, None, None
+        await asyncio.to_thread(executor.shutdown, wait=True)
+
+def user_claims(user: dict) -> dict:
+    """What a stateless token carries to rebuild UserResponse, plus the user's token_version"""
+    return {
+        "email": user["email"],
+        "username": user["username"],
+        "full_name": user.get("full_name"),
+        "is_admin": bool(user.get("is_admin", False)),
+        "created_at": user["created_at"].isoformat(),
+        "ver": user.get("token_version", 0),
+    }
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, user: Optional[dict] = None):
+    """
+    Sign a token for `data` (the "sub"). With settings.stateless_auth and the
+    user document given, the user's claims are embedded as well.
+    """
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=settings.access_token_expire_minutes))
-    return jwt.encode({**data, "exp": expire}, settings.secret_key, algorithm=settings.algorithm)
+    claims = {**data}
+    if user is not None and settings.stateless_auth:
+        claims.update(user_claims(user))
+    return jwt.encode({**claims, "exp": expire}, settings.secret_key, algorithm=settings.algorithm)
 
 def decode_access_token(token: str):
     try:
@@ -0,0 +1,124 @@
+"""
+Fast JSON path for list endpoints.
+
+The regular path copies every Mongo document, builds a Pydantic model per
+document and lets FastAPI validate the list a second time against the
+response_model. Here documents are fetched with a projection of just the
+response fields, `_id` and defaults are fixed up in one pass and the list is
+encoded straight to bytes with orjson (which handles datetimes natively).
+The output matches the response models' JSON, field order aside.
+"""
+import csv
+import io
+from typing import AsyncIterator, Dict, Iterable, List
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import Response
+
+# Fields of ProductResponse (plus updated_at, used for cache validators)
+PRODUCT_PROJECTION = {
+    "name": 1, "description": 1, "price": 1, "category": 1, "brand": 1, "stock": 1,
+    "images": 1, "rating": 1, "num_reviews": 1, "sku": 1, "created_at": 1, "updated_at": 1,
+}
+PRODUCT_DEFAULTS = {"brand": None, "stock": 0, "images": [], "rating": 0, "num_reviews": 0, "sku": None}
+
+# Fields of OrderResponse; array and sub-document paths keep nested fields in check too
+ORDER_PROJECTION = {
+    "order_items.product_id": 1, "order_items.name": 1, "order_items.quantity": 1,
+    "order_items.price": 1, "order_items.image": 1, "shipping_address": 1,
+    "payment_method": 1, "items_price": 1, "shipping_price": 1, "total_price": 1,
+    "user_id": 1, "status": 1, "is_paid": 1, "paid_at": 1, "is_delivered": 1,
+    "delivered_at": 1, "created_at": 1,
+}
+ORDER_DEFAULTS = {"shipping_price": 0, "is_paid": False, "paid_at": None,
+                  "is_delivered": False, "delivered_at": None}
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+def serialize_products(products: Iterable[Dict]) -> bytes:
+    """Encode product documents as a ProductResponse list"""
+    items: List[Dict] = []
+    for product in products:
+        item = {**PRODUCT_DEFAULTS, **product}
+        item["id"] = str(item.pop("_id"))
+        item.pop("updated_at", None)
+        item.pop("score", None)
+        items.append(item)
+    return dumps(items)
+
+
+def _order_item(order: Dict) -> Dict:
+    item = {**ORDER_DEFAULTS, **order}
+    item["_id"] = str(item["_id"])
+    item["order_items"] = [{"image": None, **line} for line in item.get("order_items", [])]
+    item["shipping_address"] = {"phone_no": None, **item.get("shipping_address", {})}
+    return item
+
+
+def serialize_orders(orders: Iterable[Dict]) -> bytes:
+    """Encode order documents as an OrderResponse list (keyed by "_id" like the model's alias)"""
+    return dumps([_order_item(order) for order in orders])
+
+
+# One row per order; line items are packed as product_id:quantity:price separated by "|"
+ORDER_CSV_COLUMNS = [
+    "_id", "created_at", "user_id", "status", "payment_method", "is_paid", "paid_at",
+    "is_delivered", "delivered_at", "items_price", "shipping_price", "total_price",
+    "full_name", "address", "city", "postal_code", "country", "phone_no", "items",
+]
+
+
+def _order_csv_row(order: Dict) -> List:
+    item = _order_item(order)
+    address = item["shipping_address"]
+    row = [item.get(column) for column in ORDER_CSV_COLUMNS[:12]]
+    row += [address.get(column) for column in ORDER_CSV_COLUMNS[12:18]]
+    row.append("|".join(f"{line['product_id']}:{line['quantity']}:{line['price']}" for line in item["order_items"]))
+    return ["" if value is None else value.isoformat() if hasattr(value, "isoformat") else value for value in row]
+
+
+async def stream_orders_ndjson(orders: AsyncIterator[Dict], chunk_size: int) -> AsyncIterator[bytes]:
+    """One OrderResponse JSON object per line, yielded `chunk_size` orders at a time"""
+    lines: List[bytes] = []
+    async for order in orders:
+        lines.append(dumps(_order_item(order)))
+        if len(lines) >= chunk_size:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+async def stream_orders_csv(orders: AsyncIterator[Dict], chunk_size: int) -> AsyncIterator[bytes]:
+    """A header row, then one row per order (see ORDER_CSV_COLUMNS), `chunk_size` orders at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(ORDER_CSV_COLUMNS)
+    rows = 0
+    async for order in orders:
+        writer.writerow(_order_csv_row(order))
+        rows += 1
+        if rows >= chunk_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    yield buffer.getvalue().encode()
+
+
+class RawJSONResponse(Response):
+    """Response for bodies that are already encoded JSON bytes"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return content
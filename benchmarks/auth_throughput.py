@@ -0,0 +1,104 @@
+"""
+Authenticated request throughput with and without database access in auth.
+
+Starts the API with uvicorn against a throwaway database on a local MongoDB
+once per mode, logs a user in and has --concurrency clients call
+POST /auth/me (nothing but get_current_user) for --duration seconds:
+
+- database:  user cache disabled, every request reads the users collection
+- cached:    the default in-process user cache
+- stateless: STATELESS_AUTH=true, claims come from the token itself
+
+    python -m benchmarks.auth_throughput --concurrency 64 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+from pymongo import MongoClient
+
+from benchmarks.common import summarize
+from benchmarks.loadtest import wait_until_healthy
+
+MODES = {
+    "database": {"USER_CACHE_MAX_SIZE": "0"},
+    "cached": {},
+    "stateless": {"STATELESS_AUTH": "true"},
+}
+
+
+def start_server(args, mode_env: dict) -> subprocess.Popen:
+    env = {**os.environ, "MONGODB_URL": args.mongodb_url, "DATABASE_NAME": args.database,
+           "RATE_LIMIT_ENABLED": "false", **mode_env}
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        env=env,
+    )
+
+
+async def drive(base_url: str, credentials: dict, args) -> dict:
+    await wait_until_healthy(base_url)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+        await client.post("/auth/register", json={**credentials, "username": "bench"})
+        response = await client.post("/auth/login", json=credentials)
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        latencies = []
+        statuses = {}
+
+        async def caller(stop_at: float):
+            while time.perf_counter() < stop_at:
+                start = time.perf_counter()
+                response = await client.post("/auth/me", headers=headers)
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[caller(started + args.duration) for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+    return {
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "statuses": statuses,
+        "latency": summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mongodb-url", default=os.environ.get("MONGODB_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default=f"bench_auth_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    args = parser.parse_args()
+
+    credentials = {"email": "bench-auth@example.com", "password": "benchmark-password"}
+    base_url = f"http://127.0.0.1:{args.port}"
+    client = MongoClient(args.mongodb_url)
+    report = {"concurrency": args.concurrency, "duration_s": args.duration, "workers": args.workers, "modes": {}}
+    try:
+        for mode in args.modes:
+            server = start_server(args, MODES[mode])
+            try:
+                report["modes"][mode] = asyncio.run(drive(base_url, credentials, args))
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+    finally:
+        client.drop_database(args.database)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
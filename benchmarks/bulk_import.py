@@ -0,0 +1,85 @@
+"""
+Bulk product import throughput (rows/sec) on a generated 1M-row catalog.
+
+Writes an NDJSON or CSV file of products with unique SKUs (plus a sprinkling
+of invalid rows), then imports it twice into a throwaway database with the
+same code path as POST /products/import: the first pass inserts every
+product, the second upserts the same SKUs again. No server is needed:
+
+    python -m benchmarks.bulk_import --rows 1000000 --format ndjson --batch-size 1000 5000
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import tempfile
+import uuid
+
+import orjson
+from pymongo import MongoClient
+
+from benchmarks.search_catalog import make_product
+
+FIELDS = ["sku", "name", "description", "price", "category", "brand", "stock", "images"]
+
+
+def write_catalog(path: str, rows: int, fmt: str, invalid_every: int) -> None:
+    rng = random.Random(7)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f) if fmt == "csv" else None
+        if writer:
+            writer.writerow(FIELDS)
+        for i in range(rows):
+            product = make_product(rng)
+            product["sku"] = f"SKU-{i:08d}"
+            if invalid_every and i % invalid_every == 0:
+                product["price"] = -1
+            if writer:
+                writer.writerow([product["sku"], product["name"], product["description"], product["price"],
+                                 product["category"], product["brand"], product["stock"], ""])
+            else:
+                f.write(orjson.dumps({field: product[field] for field in FIELDS}).decode() + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mongodb-url", default=os.environ.get("MONGODB_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default=f"bench_import_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1000])
+    parser.add_argument("--invalid-every", type=int, default=1000, help="make every Nth row invalid (0: none)")
+    args = parser.parse_args()
+
+    # The app reads its settings at import time
+    os.environ["MONGODB_URL"] = args.mongodb_url
+    os.environ["DATABASE_NAME"] = args.database
+    from app.utils.product_import import import_file
+
+    client = MongoClient(args.mongodb_url)
+    path = os.path.join(tempfile.mkdtemp(), f"catalog.{args.format}")
+    report = {"rows": args.rows, "format": args.format, "runs": []}
+    try:
+        write_catalog(path, args.rows, args.format, args.invalid_every)
+        report["file_mb"] = round(os.path.getsize(path) / 2**20, 1)
+        for batch_size in args.batch_size:
+            client[args.database].products.drop()
+            for phase in ("insert", "upsert"):
+                summary = asyncio.run(import_file(path, args.format, batch_size))
+                report["runs"].append({
+                    "batch_size": batch_size,
+                    "phase": phase,
+                    **{key: summary[key] for key in ("rows", "inserted", "upserted", "updated", "failed",
+                                                     "elapsed_seconds", "rows_per_second")},
+                })
+    finally:
+        client.drop_database(args.database)
+        if os.path.exists(path):
+            os.remove(path)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+500 clients check out the same scarce product at once.
+
+Needs a running server plus direct access to its MongoDB. The script creates
+a product with --stock units and --clients users whose carts each hold one
+unit, fires every checkout concurrently (each with an Idempotency-Key) and
+then replays a sample of them with the same key. It exits non-zero if any
+invariant is broken:
+
+* exactly `stock` checkouts succeed and the product ends at 0 stock
+* exactly `stock` orders exist and the losers' carts are left intact
+* replays return the original order instead of creating a new one
+
+    python -m benchmarks.checkout_contention --clients 500 --stock 25
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from pymongo import MongoClient
+
+from app.utils.security import create_access_token
+from benchmarks.common import BASE_URL, summarize
+
+CHECKOUT = {
+    "shipping_address": {
+        "full_name": "Bench User", "address": "1 Bench St", "city": "Bench",
+        "postal_code": "00000", "country": "Nowhere",
+    },
+    "payment_method": "credit_card",
+    "shipping_price": 5,
+}
+
+
+async def checkout(client: httpx.AsyncClient, token: str, key: str, latencies: list):
+    start = time.perf_counter()
+    response = await client.post(
+        "/cart/checkout", json=CHECKOUT,
+        headers={"Authorization": f"Bearer {token}", "Idempotency-Key": key},
+    )
+    latencies.append(time.perf_counter() - start)
+    return response
+
+
+async def run(base_url: str, tokens: list, replays: int):
+    latencies: list = []
+    limits = httpx.Limits(max_connections=len(tokens))
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        keys = [uuid.uuid4().hex for _ in tokens]
+        responses = await asyncio.gather(*[
+            checkout(client, token, key, latencies) for token, key in zip(tokens, keys)
+        ])
+        winners = [i for i, r in enumerate(responses) if r.status_code == 200]
+        replayed = await asyncio.gather(*[
+            checkout(client, tokens[i], keys[i], []) for i in winners[:replays]
+        ])
+    same_order = all(
+        replay.status_code == 200 and replay.json()["id"] == responses[i].json()["id"]
+        for i, replay in zip(winners, replayed)
+    )
+    statuses: dict = {}
+    for response in responses:
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return winners, statuses, same_order, summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--mongodb-url", default=os.environ.get("MONGODB_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default=os.environ.get("DATABASE_NAME", "ecommerce"))
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--stock", type=int, default=25)
+    parser.add_argument("--replays", type=int, default=10)
+    args = parser.parse_args()
+
+    database = MongoClient(args.mongodb_url)[args.database]
+    tag = f"bench-{uuid.uuid4().hex[:8]}"
+    now = datetime.now(timezone.utc)
+    product_id = database.products.insert_one({
+        "name": f"{tag} flash sale", "description": tag, "price": 10.0, "category": tag,
+        "brand": "Bench", "stock": args.stock, "images": [], "rating": 0, "num_reviews": 0,
+        "created_at": now, "updated_at": now,
+    }).inserted_id
+    user_ids = database.users.insert_many([
+        {"email": f"{tag}-{i}@example.com", "username": f"{tag}-{i}", "password": "!",
+         "is_admin": False, "created_at": now, "updated_at": now}
+        for i in range(args.clients)
+    ]).inserted_ids
+    database.carts.insert_many([
+        {"user_id": str(user_id), "created_at": now, "updated_at": now, "total_amount": 10.0,
+         "items": [{"product_id": str(product_id), "quantity": 1, "price": 10.0, "subtotal": 10.0}]}
+        for user_id in user_ids
+    ])
+    tokens = [create_access_token({"sub": str(u)}, expires_delta=timedelta(hours=1)) for u in user_ids]
+    user_id_strings = [str(u) for u in user_ids]
+
+    try:
+        winners, statuses, same_order, latency = asyncio.run(run(args.base_url, tokens, args.replays))
+        final_stock = database.products.find_one({"_id": product_id})["stock"]
+        orders = database.orders.count_documents({"user_id": {"$in": user_id_strings}})
+        full_carts = database.carts.count_documents({"user_id": {"$in": user_id_strings}, "items.0": {"$exists": True}})
+        checks = {
+            "successes_equal_stock": len(winners) == args.stock,
+            "stock_exhausted": final_stock == 0,
+            "orders_equal_stock": orders == args.stock,
+            "losing_carts_intact": full_carts == args.clients - args.stock,
+            "replays_return_same_order": same_order,
+        }
+        print(json.dumps({
+            "clients": args.clients, "stock": args.stock, "statuses": statuses,
+            "final_stock": final_stock, "orders": orders, "checkout_latency": latency,
+            "checks": checks,
+        }, indent=2))
+    finally:
+        database.orders.delete_many({"user_id": {"$in": user_id_strings}})
+        database.carts.delete_many({"user_id": {"$in": user_id_strings}})
+        database.idempotency_keys.delete_many({"user_id": {"$in": user_id_strings}})
+        database.users.delete_many({"_id": {"$in": user_ids}})
+        database.products.delete_one({"_id": product_id})
+
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
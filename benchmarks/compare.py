@@ -0,0 +1,47 @@
+"""
+Compare two load test reports route by route.
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+Prints the change in throughput and p50/p95/p99 latency per route and exits
+non-zero when any route's p99 got worse by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+
+
+def change(before: float, after: float) -> float:
+    return round((after - before) / before * 100, 1) if before else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed p99 regression in percent")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    regressions = []
+    print(f"{'route':36} " + " ".join(f"{metric:>18}" for metric in METRICS))
+    for route in sorted(set(before["routes"]) & set(after["routes"])):
+        old, new = before["routes"][route], after["routes"][route]
+        cells = [f"{new[m]:>10} ({change(old[m], new[m]):+.1f}%)" for m in METRICS]
+        print(f"{route:36} " + " ".join(f"{cell:>18}" for cell in cells))
+        if change(old["p99_ms"], new["p99_ms"]) > args.threshold:
+            regressions.append(route)
+
+    if regressions:
+        print(f"\np99 regressed by more than {args.threshold}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
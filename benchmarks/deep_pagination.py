@@ -0,0 +1,77 @@
+"""
+Page 1 vs page 10,000 of the product listing: skip/limit vs keyset cursor.
+
+Talks to MongoDB directly with the same query shapes ProductModel uses:
+
+    python -m benchmarks.deep_pagination --page-size 20 --deep-page 10000
+
+The catalog needs page_size * deep_page documents; it is seeded on first run.
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from pymongo import ASCENDING, IndexModel, MongoClient
+
+from benchmarks.common import summarize
+from benchmarks.search_catalog import make_product
+
+
+def seed(collection, count: int, batch_size: int = 10000) -> None:
+    rng = random.Random(7)
+    collection.drop()
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        collection.insert_many([make_product(rng) for _ in range(size)], ordered=False)
+    collection.create_indexes([IndexModel([("category", ASCENDING), ("_id", ASCENDING)], name="category_id")])
+
+
+def skip_page(collection, page: int, page_size: int, last_id=None):
+    return list(collection.find({}).skip((page - 1) * page_size).limit(page_size))
+
+
+def keyset_page(collection, page: int, page_size: int, last_id=None):
+    query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+    return list(collection.find(query).sort("_id", ASCENDING).limit(page_size + 1))
+
+
+def measure(fetch, collection, page, page_size, last_id, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fetch(collection, page, page_size, last_id)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mongodb-url", default=os.environ.get("MONGODB_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="bench_pagination")
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--deep-page", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    needed = args.page_size * args.deep_page
+    collection = MongoClient(args.mongodb_url)[args.database]["products"]
+    if collection.estimated_document_count() < needed:
+        seed(collection, needed)
+
+    # The cursor a client would hold after walking to the deep page
+    before_deep = collection.find({}, {"_id": 1}).sort("_id", ASCENDING) \
+        .skip((args.deep_page - 1) * args.page_size - 1).limit(1).next()["_id"]
+
+    report = {"page_size": args.page_size, "products": collection.estimated_document_count()}
+    for name, fetch in (("skip", skip_page), ("cursor", keyset_page)):
+        report[name] = {
+            "page_1": measure(fetch, collection, 1, args.page_size, None, args.repeat),
+            f"page_{args.deep_page}": measure(fetch, collection, args.deep_page, args.page_size, before_deep, args.repeat),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
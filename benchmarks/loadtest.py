@@ -0,0 +1,317 @@
+"""
+Reproducible mixed-traffic load test for every router.
+
+Starts the API with uvicorn against a throwaway database on a local MongoDB,
+seeds it with a configurable number of products and users, then runs
+virtual users that browse and search products, add/update/remove cart
+items, place orders and log in. Prints (or writes with --output) a JSON
+report with throughput and p50/p95/p99 latency per route so runs can be
+diffed across commits:
+
+    python -m benchmarks.loadtest --products 20000 --users 200 --duration 60 --output before.json
+
+Pass --base-url to drive an already running server instead; it must be
+started against the same --mongodb-url/--database so the seed data is
+visible to it, and with RATE_LIMIT_ENABLED=false.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import bcrypt
+import httpx
+from pymongo import MongoClient
+
+from benchmarks.common import summarize
+from benchmarks.search_catalog import CATEGORIES, NOUNS, WORDS, make_product
+
+PASSWORD = "load-test-password"
+
+# Relative weight of each action a virtual user picks between requests
+ACTIONS = {
+    "browse": 30,
+    "browse_category": 10,
+    "next_page": 8,
+    "product_detail": 20,
+    "search": 10,
+    "view_cart": 6,
+    "cart_add": 8,
+    "cart_update": 3,
+    "cart_remove": 2,
+    "create_order": 2,
+    "order_history": 2,
+    "login": 1,
+}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[int, int]] = {}
+        self.errors: Dict[str, int] = {}
+
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[route] = self.errors.get(route, 0) + 1
+            return None
+        self.latencies.setdefault(route, []).append(time.perf_counter() - start)
+        statuses = self.statuses.setdefault(route, {})
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        return response
+
+    def report(self, elapsed: float) -> dict:
+        routes = {}
+        for route in sorted(set(self.latencies) | set(self.errors)):
+            latencies = self.latencies.get(route, [])
+            routes[route] = {
+                **summarize(latencies),
+                "throughput_rps": round(len(latencies) / elapsed, 2),
+                "statuses": {str(code): n for code, n in sorted(self.statuses.get(route, {}).items())},
+                "transport_errors": self.errors.get(route, 0),
+            }
+        every = [value for latencies in self.latencies.values() for value in latencies]
+        return {"total": {**summarize(every), "throughput_rps": round(len(every) / elapsed, 2)}, "routes": routes}
+
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, email: str, product_ids: List[str], rng: random.Random):
+        self.client = client
+        self.recorder = recorder
+        self.email = email
+        self.product_ids = product_ids
+        self.rng = rng
+        self.headers: Dict[str, str] = {}
+        self.cart: List[str] = []
+        self.next_cursor = None
+
+    async def login(self):
+        response = await self.recorder.request(
+            self.client, "POST /auth/login", "POST", "/auth/login",
+            json={"email": self.email, "password": PASSWORD},
+        )
+        if response is not None and response.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def browse(self):
+        response = await self.recorder.request(self.client, "GET /products", "GET", "/products/", params={"limit": 20})
+        if response is not None:
+            self.next_cursor = response.headers.get("X-Next-Cursor")
+
+    async def browse_category(self):
+        await self.recorder.request(
+            self.client, "GET /products?category", "GET", "/products/",
+            params={"limit": 20, "category": self.rng.choice(CATEGORIES)},
+        )
+
+    async def next_page(self):
+        if not self.next_cursor:
+            return await self.browse()
+        response = await self.recorder.request(
+            self.client, "GET /products?cursor", "GET", "/products/",
+            params={"limit": 20, "cursor": self.next_cursor},
+        )
+        if response is not None:
+            self.next_cursor = response.headers.get("X-Next-Cursor")
+
+    async def product_detail(self):
+        product_id = self.rng.choice(self.product_ids)
+        await self.recorder.request(self.client, "GET /products/{product_id}", "GET", f"/products/{product_id}")
+
+    async def search(self):
+        term = f"{self.rng.choice(WORDS)} {self.rng.choice(NOUNS)}"
+        await self.recorder.request(
+            self.client, "GET /products?search", "GET", "/products/", params={"search": term, "limit": 20},
+        )
+
+    async def view_cart(self):
+        await self.recorder.request(self.client, "GET /cart", "GET", "/cart/", headers=self.headers)
+
+    async def cart_add(self):
+        product_id = self.rng.choice(self.product_ids)
+        response = await self.recorder.request(
+            self.client, "POST /cart/items", "POST", "/cart/items",
+            json={"product_id": product_id, "quantity": 1}, headers=self.headers,
+        )
+        if response is not None and response.status_code == 200 and product_id not in self.cart:
+            self.cart.append(product_id)
+
+    async def cart_update(self):
+        if not self.cart:
+            return await self.cart_add()
+        product_id = self.rng.choice(self.cart)
+        await self.recorder.request(
+            self.client, "PUT /cart/items/{product_id}", "PUT", f"/cart/items/{product_id}",
+            json={"quantity": self.rng.randint(1, 3)}, headers=self.headers,
+        )
+
+    async def cart_remove(self):
+        if not self.cart:
+            return await self.cart_add()
+        product_id = self.cart.pop()
+        await self.recorder.request(
+            self.client, "DELETE /cart/items/{product_id}", "DELETE", f"/cart/items/{product_id}",
+            headers=self.headers,
+        )
+
+    async def create_order(self):
+        items = [
+            {"product_id": product_id, "name": "item", "quantity": 1, "price": 10.0}
+            for product_id in self.rng.sample(self.product_ids, self.rng.randint(1, 3))
+        ]
+        await self.recorder.request(
+            self.client, "POST /orders", "POST", "/orders/", headers=self.headers,
+            json={
+                "order_items": items,
+                "shipping_address": {
+                    "full_name": "Load Test", "address": "1 Load St", "city": "Load",
+                    "postal_code": "00000", "country": "Nowhere",
+                },
+                "payment_method": "credit_card",
+                "items_price": 10.0 * len(items),
+                "shipping_price": 1,
+                "total_price": 10.0 * len(items) + 1,
+            },
+        )
+
+    async def order_history(self):
+        await self.recorder.request(self.client, "GET /orders", "GET", "/orders/", headers=self.headers)
+
+    async def run(self, stop_at: float, think_time: float):
+        await self.login()
+        names, weights = zip(*ACTIONS.items())
+        while time.perf_counter() < stop_at:
+            action = self.rng.choices(names, weights)[0]
+            await getattr(self, action)()
+            if think_time:
+                await asyncio.sleep(self.rng.uniform(0, think_time))
+
+
+def seed(database, products: int, users: int, batch_size: int = 10000):
+    rng = random.Random(2024)
+    for start in range(0, products, batch_size):
+        batch = [make_product(rng) for _ in range(min(batch_size, products - start))]
+        for product in batch:
+            product["stock"] = 10 ** 6
+        database.products.insert_many(batch, ordered=False)
+
+    password_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt()).decode()
+    now = datetime.now(timezone.utc)
+    emails = [f"load-{i}@example.com" for i in range(users)]
+    database.users.insert_many([
+        {"email": email, "username": email.split("@")[0], "password": password_hash,
+         "is_admin": False, "created_at": now, "updated_at": now}
+        for email in emails
+    ])
+    product_ids = [str(p["_id"]) for p in database.products.find({}, {"_id": 1}).limit(5000)]
+    return emails, product_ids
+
+
+def start_server(args) -> subprocess.Popen:
+    # Every virtual user logs in from 127.0.0.1, which the auth rate limiter would throttle
+    env = {**os.environ, "MONGODB_URL": args.mongodb_url, "DATABASE_NAME": args.database,
+           "RATE_LIMIT_ENABLED": "false"}
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        env=env,
+    )
+
+
+async def wait_until_healthy(base_url: str, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=5) as client:
+        while time.perf_counter() < deadline:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server at {base_url} did not become healthy")
+
+
+async def drive(base_url: str, emails: List[str], product_ids: List[str], args) -> dict:
+    await wait_until_healthy(base_url)
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        virtual_users = [
+            VirtualUser(client, recorder, emails[i % len(emails)], product_ids, random.Random(args.seed + i))
+            for i in range(args.concurrency)
+        ]
+        started = time.perf_counter()
+        stop_at = started + args.duration
+        await asyncio.gather(*[vu.run(stop_at, args.think_time) for vu in virtual_users])
+        elapsed = time.perf_counter() - started
+    return recorder.report(elapsed)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mongodb-url", default=os.environ.get("MONGODB_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default=f"bench_loadtest_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--base-url", help="drive an already running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50, help="number of virtual users")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--think-time", type=float, default=0.0, help="max random pause between actions (s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded database")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongodb_url)
+    database = client[args.database]
+    emails, product_ids = seed(database, args.products, args.users)
+
+    server = None if args.base_url else start_server(args)
+    base_url = args.base_url or f"http://127.0.0.1:{args.port}"
+    try:
+        results = asyncio.run(drive(base_url, emails, product_ids, args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if not args.keep:
+            client.drop_database(args.database)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "products": args.products, "users": args.users, "concurrency": args.concurrency,
+            "duration_s": args.duration, "workers": args.workers, "think_time_s": args.think_time,
+            "seed": args.seed, "actions": ACTIONS,
+        },
+        **results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+p99 latency of GET /products while a burst of logins is running.
+
+Run against a server started with `RATE_LIMIT_ENABLED=false uvicorn app.main:app`
+(the burst comes from one IP, so the auth rate limiter would otherwise
+refuse it before bcrypt runs):
+
+    python -m benchmarks.login_burst --login-concurrency 32 --duration 20
+
+With bcrypt on the event loop the /products tail tracks the login burst;
+with the dedicated pool it should stay close to the idle baseline.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+
+from benchmarks.common import BASE_URL, summarize
+
+
+async def probe_products(client: httpx.AsyncClient, stop_at: float, latencies: list):
+    while time.perf_counter() < stop_at:
+        start = time.perf_counter()
+        await client.get("/products/", params={"limit": 20})
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+
+
+async def login_loop(client: httpx.AsyncClient, stop_at: float, credentials: dict, statuses: dict):
+    while time.perf_counter() < stop_at:
+        response = await client.post("/auth/login", json=credentials)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def run_phase(base_url: str, duration: float, login_concurrency: int, credentials: dict):
+    latencies: list = []
+    statuses: dict = {}
+    limits = httpx.Limits(max_connections=login_concurrency + 4)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+        stop_at = time.perf_counter() + duration
+        tasks = [probe_products(client, stop_at, latencies)]
+        tasks += [login_loop(client, stop_at, credentials, statuses) for _ in range(login_concurrency)]
+        await asyncio.gather(*tasks)
+    return {"products": summarize(latencies), "login_statuses": statuses}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--login-concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    credentials = {
+        "email": f"bench-{uuid.uuid4().hex[:8]}@example.com",
+        "password": "benchmark-password",
+    }
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=30) as client:
+        await client.post("/auth/register", json={**credentials, "username": "bench"})
+
+    report = {
+        "idle": await run_phase(args.base_url, args.duration, 0, credentials),
+        "during_logins": await run_phase(args.base_url, args.duration, args.login_concurrency, credentials),
+        "login_concurrency": args.login_concurrency,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
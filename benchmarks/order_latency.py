@@ -0,0 +1,97 @@
+"""
+POST /orders latency for 1-, 10- and 50-item orders.
+
+Needs a running server plus direct access to its MongoDB: the script inserts
+a throwaway user and benchmark products (with plenty of stock) into the
+server's database, mints a token for the user and removes everything again
+when it is done.
+
+    python -m benchmarks.order_latency --repeat 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from pymongo import MongoClient
+
+from app.utils.security import create_access_token
+from benchmarks.common import BASE_URL, summarize
+
+ORDER_SIZES = (1, 10, 50)
+
+
+def make_order(products: list, size: int) -> dict:
+    items = [
+        {"product_id": str(p["_id"]), "name": p["name"], "quantity": 1, "price": p["price"]}
+        for p in products[:size]
+    ]
+    items_price = sum(item["price"] for item in items)
+    return {
+        "order_items": items,
+        "shipping_address": {
+            "full_name": "Bench User", "address": "1 Bench St", "city": "Bench",
+            "postal_code": "00000", "country": "Nowhere",
+        },
+        "payment_method": "credit_card",
+        "items_price": items_price,
+        "shipping_price": 1,
+        "total_price": items_price + 1,
+    }
+
+
+async def run(base_url: str, token: str, products: list, repeat: int) -> dict:
+    report = {}
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=60) as client:
+        for size in ORDER_SIZES:
+            order = make_order(products, size)
+            latencies = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                response = await client.post("/orders/", json=order)
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+            report[f"{size}_items"] = summarize(latencies)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--mongodb-url", default=os.environ.get("MONGODB_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default=os.environ.get("DATABASE_NAME", "ecommerce"))
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    database = MongoClient(args.mongodb_url)[args.database]
+    tag = f"bench-{uuid.uuid4().hex[:8]}"
+    now = datetime.now(timezone.utc)
+    user_id = database.users.insert_one({
+        "email": f"{tag}@example.com", "username": tag, "password": "!", "is_admin": False,
+        "created_at": now, "updated_at": now,
+    }).inserted_id
+    products = [
+        {"name": f"{tag} item {i}", "description": tag, "price": 10.0 + i, "category": tag,
+         "brand": "Bench", "stock": 10 ** 6, "images": [], "rating": 0, "num_reviews": 0,
+         "created_at": now, "updated_at": now}
+        for i in range(max(ORDER_SIZES))
+    ]
+    database.products.insert_many(products)
+
+    try:
+        token = create_access_token({"sub": str(user_id)}, expires_delta=timedelta(hours=1))
+        report = asyncio.run(run(args.base_url, token, products, args.repeat))
+        print(json.dumps(report, indent=2))
+    finally:
+        database.products.delete_many({"category": tag})
+        database.orders.delete_many({"user_id": str(user_id)})
+        database.users.delete_one({"_id": user_id})
+
+
+if __name__ == "__main__":
+    main()
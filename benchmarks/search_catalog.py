@@ -0,0 +1,122 @@
+"""
+Product search: text index ($text + textScore) vs. the old unanchored $regex scan.
+
+Talks to MongoDB directly and seeds its own database, so no server is needed:
+
+    python -m benchmarks.search_catalog --products 1000000
+
+Seeding 1M products takes a few minutes; pass --reuse to keep an existing
+benchmark catalog between runs.
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime
+
+from pymongo import ASCENDING, TEXT, IndexModel, MongoClient
+
+from benchmarks.common import summarize
+
+CATEGORIES = ["Electronics", "Clothing", "Home & Kitchen", "Sports", "Books", "Toys"]
+BRANDS = ["Apple", "Samsung", "Nike", "Adidas", "Dyson", "LEGO", "Penguin", "Bowflex"]
+WORDS = (
+    "wireless portable classic premium compact digital organic stainless smart "
+    "ergonomic waterproof vintage ultra lightweight durable deluxe foldable "
+    "bluetooth cotton leather ceramic bamboo carbon titanium modular"
+).split()
+NOUNS = (
+    "headphones speaker jacket hoodie blender kettle backpack lamp novel puzzle "
+    "camera watch keyboard mouse sneakers bottle tent racket drone chair"
+).split()
+QUERIES = ["wireless headphones", "bamboo", "titanium watch", "organic cotton hoodie", "zzznomatch"]
+
+
+def make_product(rng: random.Random) -> dict:
+    name = " ".join(rng.sample(WORDS, 2) + [rng.choice(NOUNS)]).title()
+    description = " ".join(rng.sample(WORDS, 5) + rng.sample(NOUNS, 2))
+    now = datetime.utcnow()
+    return {
+        "name": name,
+        "description": description,
+        "price": round(rng.uniform(5, 2000), 2),
+        "category": rng.choice(CATEGORIES),
+        "brand": rng.choice(BRANDS),
+        "stock": rng.randint(0, 500),
+        "images": [],
+        "rating": 0,
+        "num_reviews": 0,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def seed(collection, count: int, batch_size: int = 10000) -> None:
+    rng = random.Random(42)
+    collection.drop()
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        collection.insert_many([make_product(rng) for _ in range(size)], ordered=False)
+    collection.create_indexes([
+        IndexModel([("category", ASCENDING)], name="category"),
+        IndexModel(
+            [("name", TEXT), ("description", TEXT)],
+            weights={"name": 10, "description": 2},
+            name="name_description_text",
+        ),
+    ])
+
+
+def regex_search(collection, term: str, category=None, limit: int = 100):
+    return list(collection.find({
+        "$or": [
+            {"name": {"$regex": term, "$options": "i"}},
+            {"description": {"$regex": term, "$options": "i"}},
+        ]
+    }).limit(limit))
+
+
+def text_search(collection, term: str, category=None, limit: int = 100):
+    query = {"$text": {"$search": term}}
+    if category:
+        query["category"] = category
+    score = {"score": {"$meta": "textScore"}}
+    return list(collection.find(query, score).sort([("score", {"$meta": "textScore"})]).limit(limit))
+
+
+def measure(search, collection, term, category, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        search(collection, term, category)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mongodb-url", default=os.environ.get("MONGODB_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="bench_search")
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reuse", action="store_true", help="keep an already seeded catalog")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongodb_url)
+    collection = client[args.database]["products"]
+    if not (args.reuse and collection.estimated_document_count() >= args.products):
+        seed(collection, args.products)
+
+    report = {"products": collection.estimated_document_count(), "queries": {}}
+    for term in QUERIES:
+        report["queries"][term] = {
+            "regex": measure(regex_search, collection, term, None, args.repeat),
+            "text": measure(text_search, collection, term, None, args.repeat),
+            "text_in_category": measure(text_search, collection, term, "Electronics", args.repeat),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
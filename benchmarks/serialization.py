@@ -0,0 +1,87 @@
+"""
+Per-document cost of the list response paths, no server or database needed.
+
+* model path: copy each document, rewrite _id, build ProductResponse, then
+  let FastAPI validate and encode the list against response_model
+* fast path: app.utils.serialization.serialize_products (one pass + orjson)
+
+    python -m benchmarks.serialization --documents 1000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.Schemas.product import ProductResponse
+from app.utils.serialization import PRODUCT_PROJECTION, serialize_products
+from benchmarks.search_catalog import make_product
+from bson import ObjectId
+
+RESPONSE_FIELD = create_response_field(name="products", type_=List[ProductResponse])
+
+
+def make_documents(count: int) -> list:
+    rng = random.Random(1)
+    documents = []
+    for _ in range(count):
+        product = make_product(rng)
+        product["_id"] = ObjectId()
+        product["images"] = [f"https://images.example.com/{rng.randint(1, 50)}.jpg?w=400&h=400&fit=crop"]
+        documents.append({key: value for key, value in product.items() if key in PRODUCT_PROJECTION or key == "_id"})
+    return documents
+
+
+async def model_path(documents: list) -> bytes:
+    product_responses = []
+    for product in documents:
+        product_dict = product.copy()
+        product_dict["id"] = str(product_dict.pop("_id"))
+        product_responses.append(ProductResponse(**product_dict))
+    content = await serialize_response(field=RESPONSE_FIELD, response_content=product_responses, is_coroutine=True)
+    return JSONResponse(content).body
+
+
+async def fast_path(documents: list) -> bytes:
+    return serialize_products(documents)
+
+
+async def measure(path, documents: list, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await path(documents)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        "best_ms": round(best * 1000, 3),
+        "per_document_us": round(best / len(documents) * 1e6, 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    documents = make_documents(args.documents)
+    assert json.loads(await model_path(documents)) == json.loads(await fast_path(documents))
+
+    model = await measure(model_path, documents, args.repeat)
+    fast = await measure(fast_path, documents, args.repeat)
+    print(json.dumps({
+        "documents": args.documents,
+        "model_path": model,
+        "fast_path": fast,
+        "speedup": round(model["best_ms"] / fast["best_ms"], 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""
+Flash-sale contention on one product: single stock document vs sharded counters.
+
+Seeds one product in a throwaway database and has --concurrency buyers take
+one unit at a time through ProductModel.decrement_stock_atomic, the path
+orders use, until --orders attempts have been made. It runs once on the
+plain product and once per --shards count after sharding the product's
+stock, and reports decrements/sec, latency and whether the units sold match
+the stock (more attempts than stock, so it also checks nothing is oversold).
+No server is needed:
+
+    python -m benchmarks.stock_contention --stock 20000 --orders 25000 --concurrency 500 --shards 4 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from benchmarks.common import summarize
+
+
+async def run(product_model, product_id: str, orders: int, concurrency: int) -> dict:
+    latencies = []
+    sold = 0
+    remaining = orders
+
+    async def buyer():
+        nonlocal sold, remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            if await product_model.decrement_stock_atomic(product_id, 1) is not None:
+                sold += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[buyer() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "sold": sold,
+        "elapsed_seconds": round(elapsed, 3),
+        "attempts_per_second": round(orders / elapsed, 1),
+        "latency": summarize(latencies),
+    }
+
+
+async def benchmark(args) -> dict:
+    from app.database import db
+    from app.models.product import ProductModel
+    from app.utils.indexes import ensure_indexes
+
+    await db.connect()
+    try:
+        product_model = ProductModel()
+        report = {"stock": args.stock, "orders": args.orders, "concurrency": args.concurrency, "runs": []}
+        for shards in [0] + args.shards:
+            await db.get_collection("products").drop()
+            await db.get_collection("stock_shards").drop()
+            await ensure_indexes()
+            product_id = await product_model.create_product({
+                "name": "Flash sale item", "description": "", "price": 1.0,
+                "category": "Bench", "stock": args.stock, "images": [],
+            })
+            if shards:
+                await product_model.enable_stock_shards(product_id, shards)
+
+            result = await run(product_model, product_id, args.orders, args.concurrency)
+            left = await product_model.stock_shards.total(product_id) if shards else (
+                await product_model.get_product_by_id(product_id, use_cache=False)
+            )["stock"]
+            result.update({
+                "shards": shards or None,
+                "stock_left": left,
+                "consistent": result["sold"] + left == args.stock and left >= 0,
+            })
+            report["runs"].append(result)
+        return report
+    finally:
+        await db.client.drop_database(args.database)
+        await db.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mongodb-url", default=os.environ.get("MONGODB_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default=f"bench_stock_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--stock", type=int, default=20_000)
+    parser.add_argument("--orders", type=int, default=25_000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--shards", type=int, nargs="+", default=[4, 16])
+    args = parser.parse_args()
+
+    # The app reads its settings at import time
+    os.environ["MONGODB_URL"] = args.mongodb_url
+    os.environ["DATABASE_NAME"] = args.database
+    os.environ.setdefault("MONGODB_MAX_POOL_SIZE", str(max(100, args.concurrency)))
+    print(json.dumps(asyncio.run(benchmark(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()